@@ -0,0 +1,68 @@
+'''
+Batched access log.
+
+An AccessLog takes one compact record for each http request, and writes the
+records, as json lines, in batches from a background thread (see
+rhc.batch). The event loop thread only builds a tuple and queues it;
+formatting and file i/o happen on the writer thread.
+
+Each record has these fields:
+
+    time     - when the response was sent (epoch seconds)
+    cid      - connection id
+    method   - http method
+    resource - http resource
+    code     - response status code
+    bytes    - response content length
+    t_read   - seconds from the request line to the complete request
+    t_handle - seconds from the complete request to the response
+
+Requests for silent mappings are logged with probability sample (0 means
+never, which matches the behavior of LoggingRESTHandler).
+'''
+import random
+import time
+
+import rhc.codec as codec
+from rhc.batch import BatchWriter, text
+
+
+FIELDS = ('time', 'cid', 'method', 'resource', 'code', 'bytes', 't_read', 't_handle')
+
+
+class AccessLog(BatchWriter):
+
+    STATS = BatchWriter.STATS + ('sampled_out',)
+
+    def __init__(self, path=None, sample=0.0, batch_size=100, interval=1.0, max_pending=10000):
+        '''
+            Parameters:
+                path        - file to append records to (default: stdout)
+                sample      - fraction of silent requests to log
+                batch_size  - wake the writer when this many records are waiting
+                interval    - seconds between writes when traffic is light
+                max_pending - limit on records waiting to be written
+        '''
+        super(AccessLog, self).__init__(path, batch_size, interval, max_pending)
+        self.sample = sample
+
+    def add(self, handler, code, content, silent=False):
+        ''' queue a record for the request being answered by handler (an HTTPHandler) '''
+        if silent and (not self.sample or random.random() >= self.sample):
+            self.stats.sampled_out += 1
+            return
+        now = time.time()
+        t_start = handler.t_http_start or handler.t_http_data
+        self.queue((
+            now,
+            handler.id,
+            handler.http_method,
+            handler.http_resource,
+            code,
+            len(content) if content else 0,
+            handler.t_http_data - t_start,
+            now - handler.t_http_data,
+        ))
+
+    def format(self, record):
+        return codec.dumps(dict(zip(FIELDS, (text(value) for value in record))))
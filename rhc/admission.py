@@ -0,0 +1,134 @@
+'''
+Admission control for REST requests.
+
+An AdmissionController limits the number of requests in progress (handled,
+but not yet responded to). Requests beyond the limit wait in a bounded queue
+and are started as earlier requests complete; when the queue is full the
+request is shed, which RESTHandler answers with a 503 and a Retry-After
+header.
+
+With adaptive=True the limit floats between min_concurrent and
+max_concurrent: it grows by one for every limit requests that complete within
+target_latency, and shrinks by backoff (at most once per target_latency
+period) when they take longer.
+'''
+import collections
+import time
+
+from rhc.stats import Stats
+from rhc.timer import TIMERS
+
+
+class AdmissionController(object):
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=0, adaptive=False, min_concurrent=1, target_latency=1.0, backoff=0.9, retry_after=1):
+        '''
+            Parameters:
+                max_concurrent - limit on requests in progress
+                max_queue      - limit on requests waiting to start
+                queue_timeout  - seconds a request can wait before it is shed (0 = no limit)
+                adaptive       - if True, adjust the limit based on request latency
+                min_concurrent - smallest adaptive limit
+                target_latency - seconds; slower requests reduce the adaptive limit
+                backoff        - multiplier applied to the adaptive limit on a slow request
+                retry_after    - value of the Retry-After header sent with a 503
+        '''
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_concurrent = min(min_concurrent, max_concurrent)
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.retry_after = retry_after
+
+        self.in_progress = 0
+        self.stats = Stats('admitted', 'queued', 'shed', 'expired', 'completed')
+        self._limit = float(max_concurrent)
+        self._t_decrease = 0
+        self._queue = collections.deque()
+        self._is_draining = False
+
+    def __repr__(self):
+        return 'AdmissionController[limit=%s, in_progress=%s, queued=%s]' % (
+            self.limit, self.in_progress, self.queue_depth
+        )
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def queue_depth(self):
+        return len(self._queue)
+
+    def admit(self, start, shed):
+        '''
+            start a request, queue it or shed it
+
+            start - callable(), called when the request can run (now, or when queued, later)
+            shed  - callable(), called if a queued request waits longer than queue_timeout
+
+            returns False if the request is shed immediately (start and shed are not called)
+        '''
+        if self.in_progress < self.limit:
+            self._start(start)
+            return True
+        if len(self._queue) < self.max_queue:
+            self.stats.queued += 1
+            timer = None
+            if self.queue_timeout:  # shed on time, even if nothing in progress completes
+                timer = TIMERS.add(lambda: self._expire(entry), self.queue_timeout * 1000)
+            entry = (time.time(), start, shed, timer)
+            self._queue.append(entry)
+            if timer:
+                timer.start()
+            return True
+        self.stats.shed += 1
+        return False
+
+    def release(self, latency):
+        ''' mark a request complete, and start queued requests if there is room '''
+        self.in_progress -= 1
+        self.stats.completed += 1
+        if self.adaptive:
+            self._adapt(latency)
+        if self._is_draining:
+            return  # a request started below completed immediately; the loop below carries on
+        self._is_draining = True
+        try:
+            now = time.time()
+            while self._queue and self.in_progress < self.limit:
+                t_queued, start, shed, timer = self._queue.popleft()
+                if timer:
+                    timer.cancel()
+                if self.queue_timeout and now - t_queued > self.queue_timeout:
+                    self.stats.expired += 1
+                    shed()
+                else:
+                    self._start(start)
+        finally:
+            self._is_draining = False
+
+    def _expire(self, entry):
+        ''' shed a request which has been queued for queue_timeout seconds '''
+        for index, queued in enumerate(self._queue):
+            if queued is entry:
+                del self._queue[index]
+                self.stats.expired += 1
+                entry[2]()
+                return
+
+    def _start(self, start):
+        self.in_progress += 1
+        self.stats.admitted += 1
+        start()
+
+    def _adapt(self, latency):
+        if latency > self.target_latency:
+            now = time.time()
+            if now - self._t_decrease >= self.target_latency:
+                self._t_decrease = now
+                self._limit = max(self.min_concurrent, self._limit * self.backoff)
+        else:
+            self._limit = min(self.max_concurrent, self._limit + 1.0 / self._limit)
@@ -22,7 +22,6 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
 import functools
-import json
 import string
 import time
 import types
@@ -31,9 +30,12 @@ from socket import gethostbyname
 from urllib import urlencode
 from urlparse import urlparse
 
+import rhc.codec as codec
+from rhc.balancer import Balancer
 from rhc.httphandler import HTTPHandler
 from rhc.tcpsocket import SERVER
-from rhc.task import Task
+from rhc.task import DEADLINE_HEADER, Task, current_deadline
+from rhc.tracing import TRACEPARENT_HEADER, current_span
 from rhc.timer import TIMERS
 
 
@@ -63,6 +65,9 @@ def connect(callback, url, method='GET', body=None, headers=None, is_json=True,
                       a subclass of ConnectionHandler with special logic in setup or evaluate
             kwargs - see notes about automatic generation of document body
 
+        Returns the ConnectHandler; its cancel method stops the request
+        without calling callback.
+
         Notes:
 
             1. If body is None and no additional kwargs are supplied, then body is empty. If body
@@ -72,7 +77,7 @@ def connect(callback, url, method='GET', body=None, headers=None, is_json=True,
                header is added.
     '''
     p = _URLParser(url)
-    _connect(callback, url, p.host, p.address, p.port, p.resource, p.is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, None, handler, False, kwargs)
+    return _connect(callback, url, p.host, p.address, p.port, p.resource, p.is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, None, handler, False, kwargs)
 
 
 def partial(fn):
@@ -166,6 +171,8 @@ class Connection(object):
             handler - handler class for connection
                       a subclass of ConnectionHandler with special logic in setup or evaluate
             headers - dict of headers to be included in all connections
+            policy - rhc.policy.Policy for retries, hedging and circuit breaking
+            balancer - rhc.balancer.Balancer for resource requests (see Note 4)
 
         Notes:
 
@@ -180,9 +187,17 @@ class Connection(object):
                 method) automatically supplied.  Any parameters specified to
                 these methods will override default values specified at
                 Connection init.
+
+            4.  If url is a list of urls, resource requests are balanced
+                across them (using a default Balancer if none is specified),
+                and the first url is used for everything else.
     '''
 
-    def __init__(self, url, is_json=True, is_debug=False, timeout=5.0, is_form=False, wrapper=None, setup=None, handler=None, headers=None):
+    def __init__(self, url, is_json=True, is_debug=False, timeout=5.0, is_form=False, wrapper=None, setup=None, handler=None, headers=None, policy=None, balancer=None):
+        if isinstance(url, (list, tuple)):
+            if balancer is None:
+                balancer = Balancer(url)
+            url = url[0]
         self._url = url
         self._last_url = None
         if not callable(url):
@@ -195,6 +210,8 @@ class Connection(object):
         self.setup = setup
         self.handler = handler
         self.headers = headers
+        self.policy = policy
+        self.balancer = balancer
 
         self.mock = None
 
@@ -234,7 +251,7 @@ class Connection(object):
     def is_mock(self):
         return self.mock is not None
 
-    def add_resource(self, name, path, method='GET', required=[], optional={}, headers=None, is_json=None, is_debug=None, trace=False, timeout=None, is_form=None, handler=None, wrapper=None, setup=None):
+    def add_resource(self, name, path, method='GET', required=[], optional={}, headers=None, is_json=None, is_debug=None, trace=False, timeout=None, is_form=None, handler=None, wrapper=None, setup=None, cache=None, policy=None):
         ''' bind a path + method to a name on the Connection
 
             name     - unique attribute name on Connection
@@ -253,10 +270,15 @@ class Connection(object):
             handler  - override for value on Connection
             wrapper  - override for value on Connection
             setup    - override for value on Connection
+            cache    - rhc.cache.ResourceCache for results (see Note 3)
+            policy   - override for value on Connection
 
             Notes:
 
-                1. the bound attribute is an async.partial.
+                1. the bound attribute is an async.partial. when called with a
+                   callback it returns a handle with an is_done attribute and
+                   a cancel method, which stops the call without calling the
+                   callback.
 
                 2. the path can have substitution variables which are a subset of the
                    string.format syntax, for example '/mypath/{my_variable}'. this will
@@ -266,6 +288,22 @@ class Connection(object):
 
                    a bracketed variable name must be specified, and must not be an
                    integer. this is a subset of what is allowed with string.format.
+
+                3. with a cache, results are keyed by substituted path, body and
+                   headers (including the values of callable headers).
+                   a fresh result is returned without an outbound request, and
+                   identical calls made while a request is in progress share its
+                   result. the cache is not used while the Connection is mocked.
+
+                4. if the call is made while a Task or RESTRequest with a deadline
+                   is running (see rhc.task.Deadline), the request's timeout is
+                   limited to the time remaining, the time remaining is sent in
+                   an X-Request-Timeout header, and the call fails with 'timeout'
+                   once the deadline has passed.
+
+                5. if the call is made while a Task or RESTRequest with a trace
+                   span is running (see rhc.tracing), a child span is sent in a
+                   traceparent header, and exported when the request finishes.
         '''
         if name in self.__dict__:
             raise Exception("resource '%s' already defined in Connection instance" % name)
@@ -286,6 +324,7 @@ class Connection(object):
         wrapper = wrapper if wrapper is not None else self.wrapper
         handler = handler if handler is not None else self.handler
         setup = setup if setup is not None else self.setup
+        policy = policy if policy is not None else self.policy
 
         if is_form is True:
             if _headers is None:
@@ -321,11 +360,18 @@ class Connection(object):
                 hdrs = None
 
             kwargs = {}
+            deadline = current_deadline()
+            span = current_span()
 
-            return self._connect(callback, name, _path, method, body, hdrs, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs)
+            def _send(callback, hdrs, flight=None):
+                return self._connect(callback, name, _path, method, body, hdrs, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs, flight, policy, deadline, span)
+
+            if cache is None or self.is_mock:
+                return _send(callback, hdrs)
+            return cache.call(callback, cache.key(_path, body, hdrs), hdrs, _send)
         setattr(self, name, partial(_resource))
 
-    def _connect(self, callback, name, path, method, body, headers, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs):
+    def _connect(self, callback, name, path, method, body, headers, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs, observer=None, policy=None, deadline=None, span=None):
         if self.is_mock:
             class Mock(object):
                 def __init__(self):
@@ -338,7 +384,28 @@ class Connection(object):
             return Mock()
         if not self.is_url_parsed:
             return callback(1, 'url not parsed')
-        return _connect(callback, self.url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, _is_debug, _timeout, wrapper, setup, handler, _trace, kwargs)
+
+        def send_to(e, callback, observer):
+            hdrs, timeout, child = headers, _timeout, None
+            if deadline is not None or span is not None:
+                hdrs = dict(headers) if headers else {}
+            if deadline is not None:
+                hdrs[DEADLINE_HEADER] = deadline.header
+                timeout = min(timeout, deadline.remaining)
+            if span is not None:
+                child = span.child()  # one span for each attempt
+                hdrs[TRACEPARENT_HEADER] = child.header
+            return _connect(callback, e.url, e.host, e.address, e.port, path, e.is_ssl, method, body, hdrs, is_json, _is_debug, timeout, wrapper, setup, handler, _trace, kwargs, observer, deadline, child)
+
+        def send(callback, observer):
+            if deadline is not None and deadline.is_expired:
+                return callback(1, 'timeout')
+            if self.balancer is None:
+                return send_to(self, callback, observer)
+            return self.balancer.call(callback, observer, send_to)
+        if policy is None:
+            return send(callback, observer)
+        return policy.call(callback, method, '%s:%s' % (self.host, self.port), send, observer)
 
     def connect(self, method, callback, path, *args, **kwargs):
         is_json = kwargs.pop('is_json', self.is_json)
@@ -353,14 +420,26 @@ class Connection(object):
         return _connect(callback, url, self.host, self.address, self.port, path, self.is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, None, handler, False, kwargs)
 
 
-def _connect(callback, url, host, address, port, path, is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, setup, handler, trace, kwargs):
-    c = ConnectContext(callback, url, method, path, host, headers, body, is_json, is_debug, timeout, wrapper, setup, kwargs, trace)
+def _connect(callback, url, host, address, port, path, is_ssl, method, body, headers, is_json, is_debug, timeout, wrapper, setup, handler, trace, kwargs, observer=None, deadline=None, span=None):
+    c = ConnectContext(callback, url, method, path, host, headers, body, is_json, is_debug, timeout, wrapper, setup, kwargs, trace, observer, deadline, span)
     return SERVER.add_connection((address, port), ConnectHandler if handler is None else handler, c, ssl=is_ssl)
 
 
 class ConnectContext(object):
+    '''
+        values for an outgoing http request
+
+        observer, if specified, has an on_response(status, headers) method
+        which is called when a response arrives (before evaluate).
+
+        deadline, if specified, is an rhc.task.Deadline which limits the
+        total duration of the request (timeout only limits inactivity).
+
+        span, if specified, is the request's rhc.tracing.SpanContext; the
+        span is exported when the connection closes.
+    '''
 
-    def __init__(self, callback, url, method, path, host, headers, body, is_json, is_debug, timeout, wrapper, setup, kwargs, trace):
+    def __init__(self, callback, url, method, path, host, headers, body, is_json, is_debug, timeout, wrapper, setup, kwargs, trace, observer=None, deadline=None, span=None):
         self.callback = callback
         self.url = url
         self.method = method
@@ -375,6 +454,9 @@ class ConnectContext(object):
         self.setup = setup
         self.kwargs = kwargs
         self.trace = trace
+        self.observer = observer
+        self.deadline = deadline
+        self.span = span
 
 
 class ConnectHandler(HTTPHandler):
@@ -389,6 +471,10 @@ class ConnectHandler(HTTPHandler):
         self.is_done = False
         self.setup()
         self.timer = TIMERS.add(self.context.timeout * 1000, self.on_timeout).start()
+        if self.context.deadline is not None:
+            self.deadline_timer = TIMERS.add(self.context.deadline.remaining * 1000, self.on_timeout).start()
+        else:
+            self.deadline_timer = None
 
     def after_init(self):
         if self.context.is_debug:
@@ -410,7 +496,7 @@ class ConnectHandler(HTTPHandler):
 
         if isinstance(context.body, (dict, list, tuple, float, bool, int)):
             try:
-                context.body = json.dumps(context.body)
+                context.body = codec.dumps(context.body)
             except Exception:
                 context.body = str(context.body)
             else:
@@ -418,11 +504,23 @@ class ConnectHandler(HTTPHandler):
                     context.headers = {}
                 context.headers['Content-Type'] = 'application/json; charset=utf-8'
 
-    def done(self, result, rc=0):
+    def _stop(self):
         if self.is_done:
-            return
+            return False
         self.is_done = True
         self.timer.cancel()
+        if self.deadline_timer:
+            self.deadline_timer.cancel()
+        return True
+
+    def cancel(self, reason='cancelled'):
+        ''' stop the request (and close the connection) without calling the callback '''
+        if self._stop():
+            self.close(reason)
+
+    def done(self, result, rc=0):
+        if not self._stop():
+            return
         self.context.callback(rc, result)
         if not self.close_reason:
             self.close_reason = 'transaction complete'
@@ -456,8 +554,26 @@ class ConnectHandler(HTTPHandler):
                     'success' if self.t_ready else 'fail',
                 )
             log.debug(msg)
+        if self.context.span is not None and self.context.span.is_recording:
+            self._export_span(reason)
         self.done(reason)
 
+    def _export_span(self, reason):
+        t_init = self.t_init
+        self.context.span.export(
+            'client',
+            '%s %s' % (self.context.method, self.context.path),
+            t_init,
+            time.time(),
+            oid=self.id,
+            host=self.name,
+            code=self.http_status_code,
+            reason=reason,
+            t_open=(self.t_open - t_init) if self.t_open else None,
+            t_ready=(self.t_ready - t_init) if self.t_ready else None,
+            t_response=(self.t_http_data - t_init) if self.t_http_data else None,
+        )
+
     def on_failed_handshake(self, reason):
         log.warning('ssl error cid=%s: %s', self.id, reason)
 
@@ -494,13 +610,15 @@ class ConnectHandler(HTTPHandler):
         return result
 
     def on_http_data(self):
+        if self.context.observer is not None:
+            self.context.observer.on_response(self.http_status_code, self.http_headers)
         result = self.evaluate()
         if self.is_done:
             return
 
         if self.context.is_json and result is not None and len(result):
             try:
-                result = json.loads(result)
+                result = codec.loads(result)
             except Exception as e:
                 return self.done(str(e), 1)
 
@@ -592,7 +710,7 @@ class _Context(object):
             content = urlencode(content)
 
         if type(content) in (types.DictType, types.ListType, types.FloatType, types.BooleanType):
-            content = json.dumps(content)
+            content = codec.dumps(content)
             if 'Content-Type' not in headers:
                 headers['Content-Type'] = 'application/json'
 
@@ -0,0 +1,195 @@
+'''
+Client-side load balancing for async.Connection.
+
+A Balancer spreads a Connection's resource requests over a set of endpoints:
+one for each url in a list, or, with resolve_all=True, one for each address
+(A record) of each url's host. With resolve_all, the hosts are resolved again
+every resolve_interval seconds while requests are being made, so that added
+and removed addresses are picked up; an address which is still present keeps
+its state.
+
+    p2c   - power of two choices: pick two healthy endpoints at random, and
+            use the one with fewer requests in progress
+    least - use the healthy endpoint with the fewest requests in progress
+
+An endpoint that fails (no response, or a 5xx response) eject_failures times
+in a row is ejected: it is not chosen until a timer reinstates it after
+eject_time seconds. No more than max_ejected of the endpoints are ejected at
+once, and if every endpoint is unhealthy they are all used anyway.
+'''
+import random
+import socket
+
+from urlparse import urlparse
+
+from rhc.stats import Stats
+from rhc.timer import TIMERS
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class Endpoint(object):
+
+    def __init__(self, url, host, address, port, is_ssl):
+        self.url = url
+        self.host = host
+        self.address = address
+        self.port = port
+        self.is_ssl = is_ssl
+        self.outstanding = 0
+        self.failures = 0  # consecutive
+        self.is_ejected = False
+        self.stats = Stats('requests', 'failures', 'ejected')
+
+    def __repr__(self):
+        return 'Endpoint[%s:%s, out=%s, ejected=%s]' % (self.address, self.port, self.outstanding, self.is_ejected)
+
+
+def parse_endpoints(url, resolve_all=False):
+    ''' Endpoints for url: one, or one for each of the host's addresses '''
+    u = urlparse(url)
+    is_ssl = u.scheme == 'https'
+    if ':' in u.netloc:
+        host, port = u.netloc.split(':', 1)
+        port = int(port)
+    else:
+        host, port = u.netloc, 443 if is_ssl else 80
+    base = '%s://%s' % (u.scheme, u.netloc)
+    if resolve_all:
+        addresses = socket.gethostbyname_ex(host)[2]
+    else:
+        addresses = [socket.gethostbyname(host)]
+    return [Endpoint(base, host, address, port, is_ssl) for address in addresses]
+
+
+class Balancer(object):
+
+    def __init__(self, urls, method='p2c', resolve_all=False, eject_failures=5, eject_time=30.0, max_ejected=0.5, resolve_interval=60.0):
+        '''
+            Parameters:
+                urls             - list of base urls
+                method           - p2c or least
+                resolve_all      - if True, balance over all of each host's addresses
+                eject_failures   - consecutive failures which eject an endpoint
+                eject_time       - seconds an ejected endpoint is out of use
+                max_ejected      - limit on the fraction of endpoints ejected at once
+                resolve_interval - seconds between resolutions of the hosts (with
+                                   resolve_all); 0 resolves them only once
+        '''
+        if method not in ('p2c', 'least'):
+            raise ValueError("invalid balance method: '%s'" % method)
+        self.urls = urls
+        self.method = method
+        self.resolve_all = resolve_all
+        self.eject_failures = eject_failures
+        self.eject_time = eject_time
+        self.max_ejected = max_ejected
+        self.resolve_interval = resolve_interval
+        self._resolve_timer = None
+        self.endpoints = []
+        for url in urls:
+            self.endpoints.extend(parse_endpoints(url, resolve_all))
+        if not self.endpoints:
+            raise ValueError('no endpoints to balance')
+
+    def __repr__(self):
+        return 'Balancer[method=%s, endpoints=%s]' % (self.method, self.endpoints)
+
+    def choose(self):
+        ''' pick an endpoint for a request; complete must be called when the request is done '''
+        healthy = [e for e in self.endpoints if not e.is_ejected] or self.endpoints
+        if len(healthy) == 1:
+            endpoint = healthy[0]
+        elif self.method == 'p2c':
+            a, b = random.sample(healthy, 2)
+            endpoint = a if a.outstanding <= b.outstanding else b
+        else:
+            endpoint = min(healthy, key=lambda e: (e.outstanding, random.random()))
+        endpoint.outstanding += 1
+        endpoint.stats.requests += 1
+        if self.resolve_all and self.resolve_interval and self._resolve_timer is None:
+            self._resolve_timer = TIMERS.add(self._resolve, self.resolve_interval * 1000).start()
+        return endpoint
+
+    def complete(self, endpoint, is_failure):
+        endpoint.outstanding -= 1
+        if not is_failure:
+            endpoint.failures = 0
+            return
+        endpoint.failures += 1
+        endpoint.stats.failures += 1
+        if endpoint.failures >= self.eject_failures and not endpoint.is_ejected:
+            ejected = len([e for e in self.endpoints if e.is_ejected])
+            if ejected + 1 <= self.max_ejected * len(self.endpoints):
+                self._eject(endpoint)
+
+    def call(self, callback, observer, send):
+        '''
+            make a request to a chosen endpoint
+
+            send - callable(endpoint, callback, observer) which makes the request
+
+            returns a handle with is_done and cancel
+        '''
+        request = _Request(self, self.choose(), callback, observer)
+        request.handler = send(request.endpoint, request.done, request)
+        return request
+
+    def _eject(self, endpoint):
+        log.warning('ejecting endpoint %s:%s after %d failures', endpoint.address, endpoint.port, endpoint.failures)
+        endpoint.is_ejected = True
+        endpoint.stats.ejected += 1
+        TIMERS.add(lambda: self._reinstate(endpoint), self.eject_time * 1000).start()
+
+    def _resolve(self):
+        self._resolve_timer = None
+        endpoints = []
+        try:
+            for url in self.urls:
+                endpoints.extend(parse_endpoints(url, True))
+        except socket.error as e:
+            log.warning('unable to resolve endpoints, keeping %d: %s', len(self.endpoints), e)
+            return
+        if not endpoints:
+            return
+        current = dict(((e.url, e.address), e) for e in self.endpoints)
+        self.endpoints = [current.get((e.url, e.address), e) for e in endpoints]
+
+    def _reinstate(self, endpoint):
+        log.info('reinstating endpoint %s:%s', endpoint.address, endpoint.port)
+        endpoint.is_ejected = False
+        endpoint.failures = 0
+
+
+class _Request(object):
+
+    def __init__(self, balancer, endpoint, callback, observer):
+        self.balancer = balancer
+        self.endpoint = endpoint
+        self.callback = callback
+        self.observer = observer
+        self.status = None
+        self.handler = None
+        self.is_done = False
+
+    def on_response(self, status, headers):
+        self.status = status
+        if self.observer is not None:
+            self.observer.on_response(status, headers)
+
+    def done(self, rc, result):
+        if self.is_done:
+            return
+        self.is_done = True
+        is_failure = rc != 0 and (self.status is None or self.status >= 500)
+        self.balancer.complete(self.endpoint, is_failure)
+        self.callback(rc, result)
+
+    def cancel(self, reason='cancelled'):
+        if self.is_done:
+            return
+        self.is_done = True
+        self.endpoint.outstanding -= 1  # neither a success nor a failure
+        if hasattr(self.handler, 'cancel'):
+            self.handler.cancel(reason)
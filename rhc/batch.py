@@ -0,0 +1,134 @@
+'''
+Background writer for line-oriented records.
+
+A BatchWriter queues records from the event loop thread and writes them in
+batches from a background thread, so that formatting and i/o stay off the
+loop. Subclasses define format (record to line) and, optionally, _write.
+
+The writer wakes when batch_size records are waiting, or every interval
+seconds when traffic is light. If it falls behind and max_pending records
+are waiting, new records are dropped and counted in stats.dropped rather
+than blocking the loop. A record that can't be formatted is logged, counted
+in stats.failed and skipped; it doesn't stop the writer.
+'''
+import collections
+import sys
+import threading
+
+from rhc.stats import Stats
+
+import logging
+log = logging.getLogger(__name__)
+
+
+def text(value):
+    ''' value, with a byte string decoded as utf8 (invalid bytes replaced) so that it can be serialized '''
+    if isinstance(value, str):
+        return value.decode('utf8', 'replace')
+    return value
+
+
+class BatchWriter(object):
+
+    STATS = ('records', 'dropped', 'failed', 'batches', 'bytes')
+
+    def __init__(self, path=None, batch_size=100, interval=1.0, max_pending=10000):
+        '''
+            Parameters:
+                path        - file to append records to (default: stdout)
+                batch_size  - wake the writer when this many records are waiting
+                interval    - seconds between writes when traffic is light
+                max_pending - limit on records waiting to be written
+        '''
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.stats = Stats(*self.STATS)
+        self._pending = collections.deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()  # one writer at a time
+        self._thread = None
+        self._is_closed = False
+        self._file = None
+
+    def __repr__(self):
+        return '%s[path=%s, pending=%d]' % (self.__class__.__name__, self.path, len(self._pending))
+
+    def format(self, record):
+        ''' return record as a line of text (without a newline) '''
+        raise NotImplementedError()
+
+    def queue(self, record):
+        ''' add a record to be written; returns False if it was dropped '''
+        if len(self._pending) >= self.max_pending:
+            self.stats.dropped += 1
+            return False
+        self._pending.append(record)
+        self.stats.records += 1
+        if self._thread is None and not self._is_closed:
+            self._start()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        ''' write all waiting records (called from the writer thread, or directly) '''
+        with self._lock:
+            lines = []
+            pending = self._pending
+            while pending:
+                record = pending.popleft()
+                try:
+                    lines.append(self.format(record))
+                except Exception:
+                    self.stats.failed += 1
+                    log.exception('unable to format record for %s', self)
+            if not lines:
+                return
+            try:
+                count = self._write(lines)
+            except Exception:
+                log.exception('unable to write %s', self)
+            else:
+                self.stats.batches += 1
+                self.stats.bytes += count
+
+    def close(self):
+        ''' stop the writer thread and write any waiting records '''
+        self._is_closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._is_closed:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception('error in %s', self)  # keep the writer running
+
+    def _write(self, lines):
+        ''' write lines, returning the number of bytes written '''
+        data = '\n'.join(lines) + '\n'
+        if self.path is None:
+            sys.stdout.write(data)
+            sys.stdout.flush()
+            return len(data)
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(data)
+        self._file.flush()
+        return len(data)
@@ -0,0 +1,384 @@
+'''
+Response caching for idempotent (GET) REST routes.
+
+A ResponseCache is attached to a route (RESTMapper.add(cache=...)). Entries
+are keyed by resource, query string and the values of any vary headers, and
+are held in an LRU bounded by entry count and by content bytes.
+
+    fresh - an entry younger than ttl seconds is returned without calling
+            the rest_handler
+    stale - an entry less than ttl + stale seconds old is returned, and the
+            rest_handler is called in the background to refresh it
+            (stale-while-revalidate)
+    miss  - the rest_handler is called; other requests for the same key
+            which arrive before it responds wait for, and share, its
+            response (request coalescing); a request which waits more than
+            wait_timeout seconds gets a 504, and once a response has been in
+            progress that long the next request for the key handles it
+
+Only 200 responses are stored, and not if they have a 'Cache-Control:
+no-store' header. Each entry has an ETag (the rest_handler's, or a hash of
+the content) so that a request with a matching If-None-Match gets a 304.
+
+A ResourceCache does the same job on the client side, for an async.Connection
+resource (Connection.add_resource(cache=...)). Results are keyed by the
+substituted path, the request body and the request headers (so callers with
+different credentials don't share results), and concurrent identical calls share
+one outbound request (single-flight). Upstream Cache-Control (no-store,
+no-cache, max-age) overrides the configured ttl; an expired entry with an
+ETag is revalidated with If-None-Match, and a 304 refreshes it. Each caller
+gets its own copy of a dict or list result.
+'''
+import copy
+import hashlib
+import logging
+import time
+
+from rhc.lru import LRU
+from rhc.stats import Stats
+from rhc.timer import TIMERS
+
+log = logging.getLogger(__name__)
+
+
+class CacheEntry(object):
+
+    def __init__(self, content, headers, message, expires, stale):
+        self.content = content
+        self.headers = headers
+        self.message = message
+        self.expires = expires
+        self.stale = stale  # expiry time for use as a stale entry
+        self.size = len(content)
+        self.etag = headers.get('ETag')
+
+    def is_match(self, if_none_match):
+        ''' True if the If-None-Match header value matches this entry '''
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        return self.etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+class ResponseCache(object):
+
+    def __init__(self, ttl, stale=0, max_bytes=10000000, max_entries=10000, vary=None, wait_timeout=10.0):
+        '''
+            Parameters:
+                ttl          - seconds an entry is fresh
+                stale        - seconds after ttl that an entry can be used while it is refreshed
+                max_bytes    - limit on the total content size of all entries
+                max_entries  - limit on the number of entries
+                vary         - list of header names whose values are part of the key
+                wait_timeout - seconds a coalesced request waits for the response in progress (0 = no limit)
+        '''
+        self.ttl = ttl
+        self.stale = stale
+        self.vary = tuple(vary) if vary else ()
+        self.wait_timeout = wait_timeout
+        self.stats = Stats('hit', 'stale', 'miss', 'coalesced', 'stored', 'not_modified', 'wait_timeout')
+        self._entries = LRU(max_entries, max_bytes, lambda entry: entry.size)
+        self._waiting = {}  # key -> (callback, timer) for requests waiting on a response in progress
+        self._started = {}  # key -> time the response in progress was started
+
+    def __repr__(self):
+        return 'ResponseCache[ttl=%s, stale=%s, entries=%d, bytes=%d]' % (
+            self.ttl, self.stale, len(self._entries), self._entries.bytes
+        )
+
+    def key(self, resource, query_string, headers):
+        key = (resource, query_string)
+        if self.vary:
+            key += tuple(headers.get(name) for name in self.vary)
+        return key
+
+    def lookup(self, key, now=None):
+        '''
+            find a usable entry for key
+
+            returns (entry, is_fresh); entry is None on a miss.
+        '''
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now is None:
+                now = time.time()
+            if now < entry.expires:
+                self.stats.hit += 1
+                return entry, True
+            if now < entry.stale:
+                self.stats.stale += 1
+                return entry, False
+            self._entries.pop(key)
+        self.stats.miss += 1
+        return None, False
+
+    def is_pending(self, key, now=None):
+        ''' True if a response for key is in progress, and has not taken longer than wait_timeout '''
+        started = self._started.get(key)
+        if started is None:
+            return False
+        if not self.wait_timeout:
+            return True
+        return (time.time() if now is None else now) - started < self.wait_timeout
+
+    def start(self, key):
+        '''
+            note that a response for key is in progress; complete must be
+            called. a response which has stalled is taken over: its waiters
+            get whichever response completes first.
+        '''
+        self._waiting.setdefault(key, [])
+        self._started[key] = time.time()
+
+    def wait(self, key, callback):
+        '''
+            wait for a response in progress
+
+            if a response for key is in progress, callback(result, entry) is
+            called when it completes, and True is returned; otherwise False.
+            if it doesn't complete within wait_timeout, callback(None, None)
+            is called instead.
+        '''
+        if not self.is_pending(key):
+            return False
+        waiting = self._waiting[key]
+        self.stats.coalesced += 1
+        timer = None
+        if self.wait_timeout:
+            timer = TIMERS.add(lambda: self._wait_expired(key, waiter), self.wait_timeout * 1000)
+        waiter = (callback, timer)
+        waiting.append(waiter)
+        if timer:
+            timer.start()
+        return True
+
+    def _wait_expired(self, key, waiter):
+        waiting = self._waiting.get(key, [])
+        for index, item in enumerate(waiting):
+            if item is waiter:
+                del waiting[index]
+                self.stats.wait_timeout += 1
+                waiter[0](None, None)
+                return
+
+    def complete(self, key, result):
+        '''
+            finish a response in progress
+
+            result is stored (if cacheable) and passed to any waiting
+            callbacks. returns the new CacheEntry, or None.
+        '''
+        entry = None
+        headers = result.headers or {}
+        if result.code == 200 and 'no-store' not in headers.get('Cache-Control', ''):
+            entry = self._store(key, result.content, headers, result.message)
+        self._started.pop(key, None)
+        for callback, timer in self._waiting.pop(key, ()):
+            if timer:
+                timer.cancel()
+            callback(result, entry)
+        return entry
+
+    def _store(self, key, content, headers, message):
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+        headers = dict(headers)
+        if 'ETag' not in headers:
+            headers['ETag'] = '"%s"' % hashlib.md5(content).hexdigest()
+        now = time.time()
+        entry = CacheEntry(content, headers, message, now + self.ttl, now + self.ttl + self.stale)
+        self._entries[key] = entry
+        self.stats.stored += 1
+        return entry
+
+
+def _freeze(value):
+    ''' hashable equivalent of a request body '''
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _copy(result):
+    ''' a caller's own copy of a cached result, so that changing it doesn't change the cache '''
+    if isinstance(result, (dict, list)):
+        return copy.deepcopy(result)
+    return result
+
+
+def _max_age(cache_control):
+    '''
+        seconds an upstream response can be cached according to its
+        Cache-Control header: None if the header doesn't say, -1 for no-store
+    '''
+    max_age = None
+    for directive in cache_control.lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'no-store':
+            return -1
+        elif name == 'no-cache':
+            max_age = 0
+        elif name == 'max-age' and max_age is None:
+            try:
+                max_age = max(0, int(value.strip('"')))
+            except ValueError:
+                pass
+    return max_age
+
+
+class ResourceEntry(object):
+
+    def __init__(self, result, etag, expires):
+        self.result = result
+        self.etag = etag
+        self.expires = expires
+
+
+class ResourceFlight(object):
+    '''
+        an outbound request for a ResourceCache key, with the callbacks
+        waiting for its result
+    '''
+
+    def __init__(self, cache, key, entry=None):
+        self.cache = cache
+        self.key = key
+        self.entry = entry  # expired entry being revalidated
+        self.callbacks = []
+        self.status = None
+        self.headers = None
+        self.handler = None  # outbound request handle
+        self.is_done = False
+
+    def on_response(self, status, headers):
+        ''' note the upstream status and headers (called by the ConnectHandler) '''
+        self.status = status
+        self.headers = headers
+
+    def done(self, rc, result):
+        ''' callback for the outbound request: update the cache and pass result to every caller '''
+        self.is_done = True
+        rc, result = self.cache._complete(self, rc, result)
+        for callback in self.callbacks:
+            try:
+                callback(rc, _copy(result))
+            except Exception:
+                log.exception('resource cache callback failed: key=%s', self.key)
+
+    def cancel(self):
+        ''' abandon the outbound request (when no callers are left) '''
+        self.is_done = True
+        self.cache._flights.pop(self.key, None)
+        if hasattr(self.handler, 'cancel'):
+            self.handler.cancel()
+
+
+class ResourceWaiter(object):
+    ''' one caller's interest in a ResourceFlight '''
+
+    def __init__(self, flight, callback):
+        self.flight = flight
+        self.callback = callback
+        self.is_cancelled = False
+
+    @property
+    def is_done(self):
+        return self.is_cancelled or self.flight.is_done
+
+    def cancel(self):
+        ''' stop waiting; the outbound request is cancelled if no one else is waiting '''
+        if self.is_done:
+            return
+        self.is_cancelled = True
+        self.flight.callbacks.remove(self.callback)
+        if not self.flight.callbacks:
+            self.flight.cancel()
+
+
+class ResourceCache(object):
+
+    def __init__(self, ttl, max_entries=1000):
+        '''
+            Parameters:
+                ttl         - seconds a result is fresh, unless upstream Cache-Control says otherwise
+                max_entries - limit on the number of entries
+        '''
+        self.ttl = ttl
+        self.stats = Stats('hit', 'miss', 'coalesced', 'stored', 'revalidated')
+        self._entries = LRU(max_entries)
+        self._flights = {}  # key -> ResourceFlight in progress
+
+    def __repr__(self):
+        return 'ResourceCache[ttl=%s, entries=%d, in_flight=%d]' % (
+            self.ttl, len(self._entries), len(self._flights)
+        )
+
+    def key(self, path, body, headers=None):
+        return (path, _freeze(body), _freeze(headers))
+
+    def call(self, callback, key, headers, send):
+        '''
+            callback(rc, result) with a cached result, or one from send
+
+            send - callable(callback, headers, flight) which makes the
+                   outbound request; it is only called if there is no
+                   fresh entry and no request in progress for key
+
+            returns a ResourceWaiter (is_done is True on completion;
+            cancel stops the callback)
+        '''
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.stats.coalesced += 1
+            flight.callbacks.append(callback)
+            return ResourceWaiter(flight, callback)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.time() < entry.expires:
+                self.stats.hit += 1
+                flight = ResourceFlight(self, key, entry)
+                flight.is_done = True
+                callback(0, _copy(entry.result))
+                return ResourceWaiter(flight, callback)
+            if entry.etag is None:
+                self._entries.pop(key)
+                entry = None
+            else:
+                headers = dict(headers) if headers else {}
+                headers['If-None-Match'] = entry.etag
+
+        self.stats.miss += 1
+        flight = self._flights[key] = ResourceFlight(self, key, entry)
+        flight.callbacks.append(callback)
+        try:
+            flight.handler = send(flight.done, headers, flight)
+        except Exception:
+            del self._flights[key]
+            raise
+        return ResourceWaiter(flight, callback)
+
+    def _complete(self, flight, rc, result):
+        self._flights.pop(flight.key, None)
+        headers = flight.headers or {}
+        if flight.status == 304 and flight.entry is not None:
+            self.stats.revalidated += 1
+            rc, result = 0, flight.entry.result
+            etag = flight.entry.etag
+        elif rc == 0 and (flight.status is None or 200 <= flight.status < 300):
+            etag = headers.get('ETag')
+        else:
+            return rc, result
+
+        max_age = _max_age(headers.get('Cache-Control', ''))
+        if max_age is None:
+            max_age = self.ttl
+        if max_age > 0 or (max_age == 0 and etag):
+            self._entries[flight.key] = ResourceEntry(result, etag, time.time() + max_age)
+            self.stats.stored += 1
+        else:
+            self._entries.pop(flight.key)
+        return rc, result
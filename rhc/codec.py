@@ -0,0 +1,57 @@
+'''
+JSON encoding and decoding.
+
+The fastest available backend is selected at import time:
+
+    ujson      - if installed and it supports the default argument
+    simplejson - if installed (uses its C speedups when they are built)
+    json       - the standard library
+
+BACKEND is the name of the selected backend.
+
+dumps always returns a utf-8 encoded str, ready to be used as http content
+without another conversion. date and datetime values are encoded with their
+isoformat method (the same as DAO._json).
+'''
+from datetime import date, datetime
+
+
+def default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def _ujson():
+    import ujson
+    ujson.dumps(date.today(), default=default)  # older versions don't support default (and mangle dates)
+    return ujson.dumps, ujson.loads
+
+
+def _simplejson():
+    import simplejson
+    return simplejson.dumps, simplejson.loads
+
+
+def _json():
+    import json
+    return json.dumps, json.loads
+
+
+for BACKEND, _setup in (('ujson', _ujson), ('simplejson', _simplejson), ('json', _json)):
+    try:
+        _dumps, _loads = _setup()
+        break
+    except Exception:
+        pass
+
+
+def dumps(obj):
+    result = _dumps(obj, default=default)
+    if isinstance(result, unicode):
+        result = result.encode('utf8')
+    return result
+
+
+def loads(data):
+    return _loads(data)
@@ -24,6 +24,9 @@ THE SOFTWARE.
 import os
 import re
 
+import logging
+log = logging.getLogger(__name__)
+
 
 class Config (object):
 
@@ -71,27 +74,71 @@ class Config (object):
          overrides the 'value' parameter and any parmemter read from the config
          file.
 
+      6. Values are read from a ConfigSnapshot (see _snapshot), which is
+         built on first access after a _define, _set or _load, so reading a
+         value is a few attribute (or, for _get, dict) lookups.
+
+      7. Callbacks registered with _on_change are called with the names of
+         the values changed by a _load (or by a micro reload).
+
     '''
 
     def __init__(self):
         self.ordered_keys = []
         self._values = ConfigItem()
         self._direct = {}
+        self._frozen = None
+        self._callbacks = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_frozen'] = None  # snapshot classes are built on the fly
+        state['_callbacks'] = []
+        return state
 
     def __repr__(self):
         return '\n'.join('%s=%s' % (k, getattr(self, k) if getattr(self, k) is not None else '') for k in self.ordered_keys)
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)  # eg. __setstate__ while unpickling, before _values exists
         if '.' in name:
             return self._get(name)
-        return getattr(self._values, name)
+        return getattr(self._snapshot(), name)
 
     def _get(self, name):
-        parts = name.split('.')
-        item = getattr(self, parts[0])
-        for part in parts[1:]:
-            item = getattr(item, part)
-        return item
+        return self._snapshot()._get(name)
+
+    def _snapshot(self):
+        '''
+            ConfigSnapshot of the current values, including env overrides
+
+            A snapshot never changes; a _define, _set or _load causes a new one
+            to be built. Code which reads values in a hot path can hold on to a
+            snapshot, and pick up a new one from the _on_change callback.
+        '''
+        if self._frozen is None:
+            self._frozen = _freeze(self._values)
+        return self._frozen
+
+    def _on_change(self, callback):
+        ''' register callback(config, names) to be called when values change '''
+        self._callbacks.append(callback)
+
+    def _changes(self, other):
+        ''' sorted names of the values which differ between this and another Config '''
+        before, after = self._snapshot()._values(), other._snapshot()._values()
+        return sorted(name for name in set(before) | set(after) if before.get(name) != after.get(name))
+
+    def _notify(self, names):
+        ''' call the _on_change callbacks with a list of changed names '''
+        if not names:
+            return
+        for callback in self._callbacks:
+            try:
+                callback(self, names)
+            except Exception:
+                log.exception('config change callback %s failed', callback)
 
     def _define(self, name, value=None, validator=None, env=None):
         self.ordered_keys.append(name)
@@ -107,11 +154,11 @@ class Config (object):
             raise AttributeError(
                 "Non-leaf node '%s' cannot be assigned" % part)
         item._validator = validator
-        item._env = os.getenv(env) if env else None
-        if item._env and validator:
-            item._env = validator(item._env)
+        item._env_name = env
+        item._read_env()
         item._value = value
         self._direct[name] = item
+        self._frozen = None
 
     def _set(self, name, value):
         if name not in self._direct:
@@ -120,6 +167,7 @@ class Config (object):
         if item._validator:
             value = item._validator(value)
         item._value = value
+        self._frozen = None
 
     def _load(self, config):
         '''
@@ -135,6 +183,9 @@ class Config (object):
 
             where <name> matches a name specified in an earlier _define
             call and <value> is the new value associated with that name.
+
+            The _on_change callbacks are called with the names of any values
+            which changed.
         '''
 
         if isinstance(config, str):
@@ -146,6 +197,7 @@ class Config (object):
         else:
             config = config.readlines()
 
+        before = self._snapshot()
         for lineno, line in enumerate(config, start=1):
 
             m = re.match(r'(.*?[^\\])??#', line)  # look for first non-escaped comment indicator ('#')
@@ -164,6 +216,9 @@ class Config (object):
                     raise Exception('Error on line %d of config: %s' % (lineno, e))
             else:
                 raise ValueError('Error on line %d of config: invalid syntax' % lineno)
+        if self._callbacks:
+            after, values = self._snapshot()._values(), before._values()
+            self._notify(sorted(name for name in after if after[name] != values.get(name)))
 
 
 class ConfigItem (object):
@@ -173,8 +228,21 @@ class ConfigItem (object):
         self._validator = None
         self._counter = None
         self._default = None
+        self._env_name = None
+        self._env = None
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._read_env()  # the environment may have changed since pickling
+
+    def _read_env(self):
+        self._env = os.getenv(self._env_name) if self._env_name else None
+        if self._env and self._validator:
+            self._env = self._validator(self._env)
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         if name in self._value:
             item = self._value[name]
             if item._counter or isinstance(item._value, dict):
@@ -189,6 +257,64 @@ class ConfigItem (object):
         return self._value[key]
 
 
+class ConfigSnapshot(object):
+
+    '''
+        Read-only copy of a Config's values.
+
+        Each level of the name hierarchy is an object with a slot for each
+        name, so cfg.server.port is two slot lookups. The top level also
+        answers _get('server.port') from a dict of every dotted name.
+    '''
+
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('config snapshot is read-only')
+
+    def __repr__(self):
+        return 'ConfigSnapshot[%s]' % ', '.join(name for name in type(self).__slots__ if name not in ('__dict__', '_flat'))
+
+    def _get(self, name):
+        try:
+            return self._flat[name]
+        except KeyError:
+            raise AttributeError("'%s' not found" % name)
+
+    def _values(self):
+        ''' {dotted name: value} for the leaf values '''
+        return {k: v for k, v in self._flat.items() if not isinstance(v, ConfigSnapshot)}
+
+
+def _freeze(item, path=None, flat=None):
+    ''' build a ConfigSnapshot of a ConfigItem hierarchy '''
+    is_top = flat is None
+    if is_top:
+        flat = {}
+    names = sorted(item._value)
+    values = []
+    for name in names:
+        child = item._value[name]
+        key = '%s.%s' % (path, name) if path else name
+        if child._counter or isinstance(child._value, dict):
+            value = _freeze(child, key, flat)
+        else:
+            value = child._env if child._env is not None else child._value
+        flat[key] = value
+        values.append(value)
+    slots = tuple(name for name in names if re.match(r'[A-Za-z_]\w*$', name))
+    if len(slots) < len(names):
+        slots += ('__dict__',)  # names like '1a' can't be slots
+    if is_top:
+        slots += ('_flat',)
+    node = object.__new__(type('ConfigSnapshot', (ConfigSnapshot,), {'__slots__': slots}))
+    for name, value in zip(names, values):
+        object.__setattr__(node, name, value)
+    if is_top:
+        object.__setattr__(node, '_flat', flat)
+    return node
+
+
 def validate_int(value):
     return int(value)
 
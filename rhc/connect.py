@@ -1,9 +1,9 @@
-import json
 from socket import gethostbyname
 import time
 from urllib import urlencode
 import urlparse
 
+import rhc.codec as codec
 from rhc.httphandler import HTTPHandler
 from rhc.tcpsocket import SERVER
 from rhc.timer import TIMERS
@@ -223,7 +223,7 @@ class ConnectHandler(HTTPHandler):
 
         if isinstance(context.body, (dict, list, tuple, float, bool, int)):
             try:
-                context.body = json.dumps(context.body)
+                context.body = codec.dumps(context.body)
             except Exception:
                 context.body = str(context.body)
             else:
@@ -334,7 +334,7 @@ class ConnectHandler(HTTPHandler):
 
         if self.context.is_json and result is not None and len(result):
             try:
-                result = json.loads(result)
+                result = codec.loads(result)
             except Exception as e:
                 return self.done(str(e), 1)
 
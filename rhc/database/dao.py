@@ -23,8 +23,8 @@ THE SOFTWARE.
 '''
 from datetime import datetime, date
 from itertools import chain
-import json
 
+import rhc.codec as codec
 from rhc.database import db
 from rhc.database.query import Query
 
@@ -122,7 +122,7 @@ class DAO(object):
     def _jsonify(self, kwargs):
         for f in self.JSON_FIELDS:
             if kwargs[f]:
-                kwargs[f] = json.loads(kwargs[f])
+                kwargs[f] = codec.loads(kwargs[f])
 
     @staticmethod
     def _import(target):
@@ -187,7 +187,7 @@ class DAO(object):
             if jsonify:
                 for n in self.JSON_FIELDS:
                     v = self._orig.get(n)
-                    self._orig[n] = json.dumps(self.on_json_save(n, v))
+                    self._orig[n] = codec.dumps(self.on_json_save(n, v))
 
     @property
     def _update_fields(self):
@@ -203,7 +203,7 @@ class DAO(object):
         for n in self.JSON_FIELDS:
             v = cache[n] = getattr(self, n)
             if v is not None:
-                setattr(self, n, json.dumps(self.on_json_save(n, v)))
+                setattr(self, n, codec.dumps(self.on_json_save(n, v)))
         try:
             self.before_save()
             self._save(insert)
@@ -21,15 +21,237 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
+from rhc.multipart import HTTPHeaders, HTTPPart, MultipartParser, multipart_boundary  # HTTPHeaders, HTTPPart: for existing imports
 from rhc.tcpsocket import BasicHandler
 
-from StringIO import StringIO
 import time
 import urlparse
-import gzip
+import zlib
 
 
-class HTTPHandler(BasicHandler):
+def compress(content, encoding, level=6):
+    ''' compress content with the 'gzip' or 'deflate' content-coding '''
+    wbits = zlib.MAX_WBITS + 16 if encoding == 'gzip' else zlib.MAX_WBITS
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    return compressor.compress(content) + compressor.flush()
+
+
+def accept_encoding(header):
+    ''' choose 'gzip', 'deflate' or None based on an Accept-Encoding header '''
+    if not header:
+        return None
+    accepted = {}
+    for item in header.split(','):
+        item = item.split(';')
+        coding = item[0].strip().lower()
+        q = 1.0
+        for param in item[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0
+        accepted[coding] = q
+    for coding in ('gzip', 'deflate'):
+        if accepted.get(coding, accepted.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+STATUS_MESSAGES = {
+    100: 'Continue',
+    101: 'Switching Protocols',
+    200: 'OK',
+    201: 'Created',
+    202: 'Accepted',
+    204: 'No Content',
+    206: 'Partial Content',
+    301: 'Moved Permanently',
+    302: 'Found',
+    303: 'See Other',
+    304: 'Not Modified',
+    307: 'Temporary Redirect',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    501: 'Not Implemented',
+    502: 'Bad Gateway',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+_STATUS_LINES = {
+    code: 'HTTP/1.1 %d %s\r\n' % (code, message)
+    for code, message in STATUS_MESSAGES.items()
+}
+
+
+def status_line(code, message):
+    ''' 'HTTP/1.1 code message\r\n', pre-built for the standard messages '''
+    if STATUS_MESSAGES.get(code) == message:
+        return _STATUS_LINES[code]
+    return 'HTTP/1.1 %d %s\r\n' % (code, message)
+
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+_date = [None, None]  # [second, formatted date]
+
+
+def format_date(t):
+    ''' RFC 7231 IMF-fixdate (always GMT; independent of locale) '''
+    t = time.gmtime(t)
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        _DAYS[t.tm_wday], t.tm_mday, _MONTHS[t.tm_mon - 1], t.tm_year,
+        t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def http_date():
+    ''' value for a Date header, formatted at most once per second '''
+    now = int(time.time())
+    if now != _date[0]:
+        _date[1] = format_date(now)
+        _date[0] = now
+    return _date[1]
+
+
+def format_headers(headers):
+    ''' serialize a dict of headers, each line terminated with CRLF '''
+    return ''.join(['%s: %s\r\n' % (k, v) for k, v in headers.items()])
+
+
+class HeaderTemplate(object):
+
+    '''
+        a static set of response headers serialized once, up front
+
+        Content-Length depends on the response, and can't be included.
+    '''
+
+    def __init__(self, headers):
+        self.headers = dict(headers)
+        self.keys = set(k.lower() for k in self.headers)
+        if 'content-length' in self.keys:
+            raise ValueError('Content-Length cannot be a template header')
+        self.block = format_headers(self.headers)
+
+    def merge(self, headers):
+        ''' combine with headers: return (template block, remaining headers)
+
+            if headers override any template header, the template is
+            merged into headers and the block is empty.
+        '''
+        if headers:
+            override = set(k.lower() for k in headers)
+            if not self.keys.isdisjoint(override):
+                merged = {k: v for k, v in self.headers.items() if k.lower() not in override}
+                merged.update(headers)
+                return '', merged
+        return self.block, headers
+
+
+def _decompressor(encoding):
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return zlib.decompressobj(zlib.MAX_WBITS + 32)  # +32: detect gzip or zlib header
+    return None
+
+
+def parse_query(query_string):
+    ''' query string -> dict; a name that occurs more than once has a list of values '''
+    if not query_string:
+        return {}
+    qs = urlparse.parse_qs(query_string)
+    for n, v in qs.items():
+        if len(v) == 1:
+            qs[n], = v
+    return qs
+
+
+def parse_multipart(content, content_type):
+    ''' multipart content -> list of HTTPPart (ValueError if malformed) '''
+    boundary = multipart_boundary(content_type)
+    if not boundary:
+        raise ValueError('Malformed multipart message: no boundary')
+    parser = MultipartParser(boundary)
+    parser.feed(content)
+    parser.close()
+    return parser.parts
+
+
+class HTTPMessage(object):
+
+    '''
+        Message fields which are derived from the raw message the first
+        time they are used: http_query (from http_query_string),
+        http_multipart (from multipart content) and http_content (decoded
+        using charset). Most requests never touch them.
+    '''
+
+    @property
+    def charset(self):
+        h = self.http_headers.get('Content-Type')
+        if h:
+            charset = [c.split('=')[1].strip() for c in h.split(';') if 'charset' in c]
+            if len(charset):
+                return charset[0]
+        return None
+
+    @property
+    def http_query(self):
+        if self._http_query is None:
+            self._http_query = parse_query(self.http_query_string)
+        return self._http_query
+
+    @http_query.setter
+    def http_query(self, value):
+        self._http_query = value
+
+    @property
+    def http_multipart(self):
+        if self._http_multipart is None:
+            content_type = self.http_headers.get('Content-Type', '')
+            if content_type.startswith('multipart'):
+                self._http_multipart = parse_multipart(self._http_content, content_type)
+            else:
+                self._http_multipart = []
+        return self._http_multipart
+
+    @http_multipart.setter
+    def http_multipart(self, value):
+        self._http_multipart = value
+
+    @property
+    def http_content(self):
+        if self._http_decode:
+            self._http_decode = False
+            charset = self.charset
+            if charset:
+                self._http_content = self._http_content.decode(charset)
+        return self._http_content
+
+    @http_content.setter
+    def http_content(self, value):
+        self._http_decode = False
+        self._http_content = value
+
+    def _copy_message(self, message):
+        ''' take the raw (not yet derived) fields from another HTTPMessage '''
+        self.http_headers = message.http_headers
+        self.http_query_string = message.http_query_string
+        self._http_query = message._http_query
+        self._http_multipart = message._http_multipart
+        self._http_content = message._http_content
+        self._http_decode = message._http_decode
+
+
+class HTTPHandler(BasicHandler, HTTPMessage):
 
     def __init__(self, socket, context=None):
         '''
@@ -39,7 +261,8 @@ class HTTPHandler(BasicHandler):
 
                     http_message - entire message
                     http_headers - dictionary of headers
-                    http_content - content
+                    http_content - content (gzip or deflate content-coding
+                                   is decoded as the data arrives)
                     error - any error message
 
                     client:
@@ -57,29 +280,60 @@ class HTTPHandler(BasicHandler):
                         if charset:
                             http_content: decoded http_content
 
+                    multipart content is parsed as it arrives, and is not
+                    kept in http_content. parts larger than
+                    http_multipart_threshold bytes are held in temporary
+                    files (see HTTPPart).
+
+                    http_headers is case-insensitive; http_query,
+                    http_multipart and the charset decode of http_content
+                    are done on first use (see HTTPMessage).
+
                 on_http_send(self, headers, content) - useful for debugging
                 on_http_data(self) - when data is available
+                on_http_part(self, part) - when a multipart part is complete
                 on_http_error(self)
+
+            A client that pipelines many messages is limited to
+            http_max_messages_per_turn calls to on_http_data for each
+            turn of the server loop; any remaining messages are handled
+            on later turns.
+
+            When the server drains (see Server.drain), an idle connection
+            is closed right away; a connection with a request in progress
+            is closed after the response is sent.
         '''
         super(HTTPHandler, self).__init__(socket, context)
+        self.t_http_start = 0
         self.t_http_data = 0
         self.__data = ''
+        self.__messages = 0
+        self.__is_deferred = False
         self._setup()
 
         self.http_max_content_length = None
         self.http_max_line_length = 10000
         self.http_max_header_count = 100
+        self.http_max_messages_per_turn = 10  # 0 = no limit
+        self.http_multipart_threshold = 65536
 
         self.__http_close_on_complete = False
+        self._http_in_progress = 0  # requests received and not yet responded to
+        self._is_draining = False
 
     @property
-    def charset(self):
-        h = self.http_headers.get('Content-Type')
-        if h:
-            charset = [c.split('=')[1].strip() for c in h.split(';') if 'charset' in c]
-            if len(charset):
-                return charset[0]
-        return None
+    def _is_busy(self):
+        ''' True if requests are being handled, or are buffered and not yet parsed '''
+        return bool(self._http_in_progress or self.__data or self.__is_deferred)
+
+    def on_drain(self):
+        self._is_draining = True
+        if self._is_busy:
+            return  # close after the last response (see send_server)
+        if self._sending:
+            self.__http_close_on_complete = True
+        else:
+            self.close('server draining')
 
     def on_http_send(self, headers, content):
         pass
@@ -90,27 +344,11 @@ class HTTPHandler(BasicHandler):
     def on_http_error(self):
         pass
 
-    def _multipart(self):
-        cache = self.__data
-        try:
-            self.http_headers['Content-Type'], boundary = self.http_headers['Content-Type'].split('; boundary=')
-            for self.__data in [p[2:] for p in self.http_content.split('--' + boundary)][1:-1]:  # split, remove \r\n and ignore first & last; stuff into __data for __line
-                headers = dict(l.split(': ', 1) for l in iter(self.__line, ''))
-                if 'Content-Disposition' in headers:
-                    headers['Content-Disposition'], rem = headers['Content-Disposition'].split('; ', 1)
-                    disposition = dict(part.split('=', 1) for part in rem.split('; '))
-                self.http_multipart.append(HTTPPart(headers, disposition, self.__data))
-        except Exception:
-            self.__error('Malformed multipart message')
-        self.__data = cache
+    def on_http_part(self, part):
+        pass
 
     def _on_http_data(self):
-        if self.http_headers.get('Content-Encoding') == 'gzip':
-            self.http_content = gzip.GzipFile(fileobj=StringIO(self.http_content)).read()
-        if self.http_headers.get('Content-Type', '').startswith('multipart'):
-            self._multipart()
-        if self.charset:
-            self.http_content = self.http_content.decode(self.charset)
+        self._http_decode = True
         self.t_http_data = time.time()
         self.on_http_data()
 
@@ -133,8 +371,7 @@ class HTTPHandler(BasicHandler):
             headers = {}
 
         if 'Date' not in headers:
-            headers['Date'] = time.strftime(
-                "%a, %d %b %Y %H:%M:%S %Z", time.localtime())
+            headers['Date'] = http_date()
 
         if 'Content-Length' not in headers:
             headers['Content-Length'] = len(content)
@@ -143,49 +380,66 @@ class HTTPHandler(BasicHandler):
             headers['Connection'] = 'close'
 
         if compress:
-            headers['Accept-Encoding'] = 'gzip'
+            headers['Accept-Encoding'] = 'gzip, deflate'
 
         if 'host' not in (k.lower() for k in headers):
             host = host if host else self.host if self.host else '%s:%s' % self.peer_address
             headers['Host'] = host
 
-        headers = '%s %s HTTP/1.1\r\n%s\r\n\r\n' % (
-            method, resource, '\r\n'.join(['%s: %s' % (k, v) for k, v in headers.items()])
+        headers = '%s %s HTTP/1.1\r\n%s\r\n' % (
+            method, resource, format_headers(headers)
         )
 
         self.__send(headers, content)
 
-    def send_server(self, content='', code=200, message='OK', headers=None, close=False):
+    def send_server(self, content='', code=200, message='OK', headers=None, close=False, template=None):
+        '''
+            send a response
+
+            template is an optional HeaderTemplate whose pre-serialized
+            headers are included in the response.
+        '''
 
         self.__http_close_on_complete = True if close else self.http_headers.get('Connection') == 'close'
+        if self._http_in_progress:
+            self._http_in_progress -= 1
+        if self._is_draining and not self._is_busy:
+            self.__http_close_on_complete = True
+            headers = dict(headers) if headers else {}
+            headers['Connection'] = 'close'
+
+        block = ''
+        if template:
+            block, headers = template.merge(headers)
 
         if headers is None:
             headers = {}
 
-        if 'Date' not in headers:
-            headers['Date'] = time.strftime(
-                "%a, %d %b %Y %H:%M:%S %Z", time.localtime())
+        if 'Date' not in headers and not (template and 'date' in template.keys):
+            block += 'Date: %s\r\n' % http_date()
 
         if 'Content-Length' not in headers:
-            headers['Content-Length'] = len(content)
+            block += 'Content-Length: %d\r\n' % len(content)
 
-        headers = 'HTTP/1.1 %d %s\r\n%s\r\n\r\n' % (
-            code, message,
-            '\r\n'.join(['%s: %s' % (k, v) for k, v in headers.items()]))
+        headers = status_line(code, message) + block + format_headers(headers) + '\r\n'
 
         self.__send(headers, content)
 
     def _setup(self):
         self.http_message = ''
-        self.http_headers = {}
-        self.http_content = ''
+        self.http_headers = HTTPHeaders()
+        self._http_content = ''
+        self._http_decode = False
         self.http_status_code = None
         self.http_status_message = None
         self.http_method = None
-        self.http_multipart = []
+        self._http_multipart = None
         self.http_resource = None
         self.http_query_string = None
-        self.http_query = {}
+        self._http_query = None
+        self.__decompressor = None
+        self.__decoded = 0  # bytes of decompressed content
+        self.__multipart = None
         self.__state = self.__status
 
     def on_http_headers(self):
@@ -199,8 +453,21 @@ class HTTPHandler(BasicHandler):
     def on_data(self, data):
         self.http_message += data
         self.__data += data
+        self.__process()
+
+    def __process(self):
+        self.__messages = 0
         while self.__state():
-            pass
+            if self.http_max_messages_per_turn and self.__messages == self.http_max_messages_per_turn and self.__data:
+                if not self.__is_deferred:
+                    self.__is_deferred = True
+                    self._network._set_deferred(self.__continue)
+                break
+
+    def __continue(self):
+        self.__is_deferred = False
+        if not self.closed:
+            self.__process()
 
     def __error(self, message):
         self.error = message
@@ -226,6 +493,7 @@ class HTTPHandler(BasicHandler):
         line = self.__line()
         if line is False or line is None:
             return False
+        self.t_http_start = time.time()
         toks = line.split()
         if len(toks) < 3:
             return self.__error('Invalid status line: too few tokens')
@@ -244,18 +512,15 @@ class HTTPHandler(BasicHandler):
             if toks[2] not in ('HTTP/1.0', 'HTTP/1.1'):
                 return self.__error('Invalid status line: not HTTP/1.0 or HTTP/1.1')
             self.http_method = toks[0]
+            self._http_in_progress += 1
 
-            res = urlparse.urlparse(toks[1])
-            self.http_resource = res.path
-            self.http_query = {}
-            self.http_query_string = ''
-            if res.query:
-                self.http_query_string = res.query
-                qs = urlparse.parse_qs(res.query)
-                for n, v in qs.items():
-                    if len(v) == 1:
-                        qs[n], = v
-                self.http_query = qs
+            target = toks[1]
+            if target.startswith('/') and ';' not in target:  # origin-form: no need for urlparse
+                self.http_resource, _, query = target.split('#', 1)[0].partition('?')
+            else:
+                res = urlparse.urlparse(target)
+                self.http_resource, query = res.path, res.query
+            self.http_query_string = query
 
         self.__state = self.__header
         return True
@@ -281,11 +546,18 @@ class HTTPHandler(BasicHandler):
 
     def _end_header(self):
 
-        # make sure lower-case versions of header names are available (for case-insensitive operation)
-        for n, v in self.http_headers.items():
-            self.http_headers[n.lower()] = v
+        self.__decompressor = _decompressor(self.http_headers.get('content-encoding'))
+
+        is_head = getattr(self, '_http_method', None) == 'HEAD'  # this gets set if the send method is called
+
+        content_type = self.http_headers.get('Content-Type')
+        if content_type and content_type.startswith('multipart') and not is_head:
+            boundary = multipart_boundary(content_type)
+            if not boundary:
+                return self.__error('Malformed multipart message: no boundary')
+            self.__multipart = MultipartParser(boundary, self.http_multipart_threshold, self.on_http_part, self.http_max_line_length)
 
-        if getattr(self, '_http_method', None) == 'HEAD':  # this gets set if the send method is called
+        if is_head:
             self.__length = 0
             self.__state = self.__content
 
@@ -323,18 +595,81 @@ class HTTPHandler(BasicHandler):
         return False
 
     def __on_identity_close(self):
-        self.http_content = self.__data
-        self._on_http_data()
+        data = self.__decode(self.__data, True)
+        if data is not False and self.__body(data) and self.__end_body():
+            self._on_http_data()
+
+    def __body(self, data):
+        ''' add (decoded) data to the content, or to the multipart parser '''
+        if self.__multipart:
+            try:
+                self.__multipart.feed(data)
+            except ValueError as e:
+                return self.__error(str(e))
+        else:
+            self._http_content += data
+        return True
+
+    def __end_body(self):
+        if self.__multipart:
+            try:
+                self.__multipart.close()
+            except ValueError as e:
+                return self.__error(str(e))
+            self._http_multipart = self.__multipart.parts
+            self.__multipart = None
+        return True
+
+    def __decode(self, data, final=False):
+        ''' decompress data, limiting the decoded content to http_max_content_length '''
+        if not self.__decompressor:
+            return data
+        limit = self.http_max_content_length
+        try:
+            if limit:
+                data = self.__decompressor.decompress(data, limit - self.__decoded + 1)
+                is_over = bool(self.__decompressor.unconsumed_tail)
+            else:
+                data = self.__decompressor.decompress(data)
+                is_over = False
+            if final and not is_over:
+                data += self.__decompressor.flush()
+        except zlib.error:
+            return self.__error('Invalid content encoding')
+        self.__decoded += len(data)
+        if is_over or (limit and self.__decoded > limit):
+            self.send_server(code=413, message='Request Entity Too Large')
+            return self.__error('Decoded content exceeds maximum length')
+        return data
 
     def __content(self):
+        if self.__decompressor or self.__multipart:
+            return self.__streamed_content()
         if len(self.__data) >= self.__length:
-            self.http_content = self.__data[:self.__length]
+            self._http_content = self.__data[:self.__length]
+            self.__messages += 1
             self._on_http_data()
             self.__data = self.__data[self.__length:]
             self._setup()
             return True
         return False
 
+    def __streamed_content(self):
+        # handle available data immediately, so that only decoded content (or no multipart content) is buffered
+        data, self.__data = self.__data[:self.__length], self.__data[self.__length:]
+        self.__length -= len(data)
+        data = self.__decode(data, self.__length == 0)
+        if data is False or not self.__body(data):
+            return False
+        if self.__length:
+            return False
+        if not self.__end_body():
+            return False
+        self.__messages += 1
+        self._on_http_data()
+        self._setup()
+        return True
+
     def __chunked_length(self):
         line = self.__line()
         if line is None:
@@ -356,7 +691,9 @@ class HTTPHandler(BasicHandler):
 
     def __chunked_content(self):
         if len(self.__data) >= self.__length:
-            self.http_content += self.__data[:self.__length]
+            data = self.__decode(self.__data[:self.__length])
+            if data is False or not self.__body(data):
+                return False
             self.__data = self.__data[self.__length:]
             self.__state = self.__chunked_content_end
             return True
@@ -377,6 +714,13 @@ class HTTPHandler(BasicHandler):
             return False
 
         if len(line) == 0:
+            if self.__decompressor:
+                data = self.__decode('', True)
+                if data is False or not self.__body(data):
+                    return False
+            if not self.__end_body():
+                return False
+            self.__messages += 1
             self._on_http_data()
             self._setup()
             return True
@@ -390,16 +734,3 @@ class HTTPHandler(BasicHandler):
         self.http_headers[name.strip()] = value.strip()
         return True
 
-
-class HTTPPart(object):
-
-    def __init__(self, headers, disposition, content):
-        '''
-            Container for one part of a multipart message.
-
-            The disposition is a dict with the k:v pairs from the 'Content-Disposition'
-            header, where things like filename are stored.
-        '''
-        self.headers = headers
-        self.disposition = disposition
-        self.content = content
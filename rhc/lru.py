@@ -0,0 +1,59 @@
+import collections
+
+
+class LRU(object):
+    '''
+        Dict-like container which holds at most max_size items.
+
+        When an item is added to a full LRU, the least recently used item
+        (the one least recently set or fetched with get) is discarded.
+        All operations are O(1).
+
+        If sizeof is specified, it is called with each value to determine
+        its size in bytes, and items are also discarded to keep the total
+        within max_bytes.
+    '''
+
+    def __init__(self, max_size, max_bytes=0, sizeof=None):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._sizeof = sizeof
+        self._data = collections.OrderedDict()
+
+    def __repr__(self):
+        return 'LRU[size=%d, max_size=%d, bytes=%d]' % (len(self._data), self.max_size, self.bytes)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        data = self._data
+        if key in data:
+            self.pop(key)
+        data[key] = value
+        if self._sizeof:
+            self.bytes += self._sizeof(value)
+        while len(data) > self.max_size or (self.max_bytes and self.bytes > self.max_bytes):
+            self.pop(next(iter(data)))
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value  # most recently used
+        return value
+
+    def pop(self, key, default=None):
+        value = self._data.pop(key, default)
+        if self._sizeof and value is not default:
+            self.bytes -= self._sizeof(value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
@@ -1,25 +1,51 @@
 from importlib import import_module
 import logging
+import os
+import signal
+import subprocess
 import sys
+import time
 import uuid
 
 import rhc.async as async
 import rhc.file_util as file_util
+from rhc.accesslog import AccessLog
+from rhc.admission import AdmissionController
+from rhc.balancer import Balancer
+from rhc.cache import ResourceCache, ResponseCache
+from rhc.policy import CircuitBreakers, Policy
+from rhc.ratelimit import RateLimiter
 from rhc.micro_fsm.parser import Parser as parser
-from rhc.resthandler import LoggingRESTHandler, RESTMapper
-from rhc.tcpsocket import SERVER
+from rhc.resthandler import LazyHandler, LoggingRESTHandler, RESTMapper
+from rhc.tcpsocket import LISTEN_FDS, SERVER, inherited_fds
+from rhc.tracing import SpanExporter, set_exporter
 from rhc.timer import TIMERS
 from rhc import CONNECTIONS as connection
 
 log = logging.getLogger(__name__)
 
+ACCESS_LOGS = []  # closed (and flushed) by stop
+
+_signals = []  # signals received, handled by run
+
+_sources = {}  # micro and config file names, for reload
+_running = {}  # server name: _Running
+_connections = {}  # connection name: signature of its definition and config
+_tracing = {}  # trace_export setting of the current span exporter
+
 
 class MicroContext(object):
 
-    def __init__(self, http_max_content_length, http_max_line_length, http_max_header_count):
+    def __init__(self, http_max_content_length, http_max_line_length, http_max_header_count, http_compress=False, http_compress_level=6, http_compress_threshold=1024, http_admission=None, http_rate_limit=None, http_access_log=None):
         self.http_max_content_length = http_max_content_length
         self.http_max_line_length = http_max_line_length
         self.http_max_header_count = http_max_header_count
+        self.http_compress = http_compress
+        self.http_compress_level = http_compress_level
+        self.http_compress_threshold = http_compress_threshold
+        self.http_admission = http_admission
+        self.http_rate_limit = http_rate_limit
+        self.http_access_log = http_access_log
 
 
 class MicroRESTHandler(LoggingRESTHandler):
@@ -30,6 +56,12 @@ class MicroRESTHandler(LoggingRESTHandler):
         self.http_max_content_length = context.http_max_content_length
         self.http_max_line_length = context.http_max_line_length
         self.http_max_header_count = context.http_max_header_count
+        self.http_compress = context.http_compress
+        self.http_compress_level = context.http_compress_level
+        self.http_compress_threshold = context.http_compress_threshold
+        self.http_admission = context.http_admission
+        self.http_rate_limit = context.http_rate_limit
+        self.access_log = context.http_access_log
 
     def on_rest_exception(self, exception_type, value, trace):
         code = uuid.uuid4().hex
@@ -55,8 +87,9 @@ def load_server(filename, config=None):
     p = _load(filename)
     if config:
         p.config._load(file_util.normalize_path(config))
+    _sources.update(micro=filename, config=config)
     sys.modules[__name__].config = p.config
-    SERVER.close()
+    SERVER.drain()
     setup_servers(p.config, p.servers, p.is_new)
     return p
 
@@ -71,7 +104,7 @@ def load_connection(filename, config=None):
 
 
 def re_start(p):
-    SERVER.close()
+    SERVER.drain()  # in-flight requests finish on the old listeners' connections
     setup_servers(p.config, p.servers, p.is_new)
 
 
@@ -82,47 +115,336 @@ def load_config(config='config', micro='micro'):
     return p.config
 
 
-def setup_servers(config, servers, is_new):
+def _admission(conf):
+    ''' server-wide AdmissionController, if http_max_concurrent is configured '''
+    if not getattr(conf, 'http_max_concurrent', None):
+        return None
+    return AdmissionController(
+        conf.http_max_concurrent,
+        conf.http_max_queue if hasattr(conf, 'http_max_queue') else 0,
+        conf.http_queue_timeout if hasattr(conf, 'http_queue_timeout') else 0,
+        conf.http_adaptive_concurrency if hasattr(conf, 'http_adaptive_concurrency') else False,
+        conf.http_min_concurrent if hasattr(conf, 'http_min_concurrent') else 1,
+        conf.http_target_latency if hasattr(conf, 'http_target_latency') else 1.0,
+        retry_after=conf.http_retry_after if hasattr(conf, 'http_retry_after') else 1,
+    )
+
+
+def _rate_limit(conf):
+    ''' server-wide RateLimiter, if http_rate_limit is configured '''
+    if not getattr(conf, 'http_rate_limit', None):
+        return None
+    return RateLimiter(
+        conf.http_rate_limit,
+        conf.http_rate_limit_burst if hasattr(conf, 'http_rate_limit_burst') else None,
+        conf.http_rate_limit_key if hasattr(conf, 'http_rate_limit_key') else 'peer',
+        conf.http_rate_limit_max_keys if hasattr(conf, 'http_rate_limit_max_keys') else 10000,
+    )
+
+
+def _access_log(conf):
+    ''' batched AccessLog, if http_access_log (a path, or "stdout") is configured '''
+    if not getattr(conf, 'http_access_log', None):
+        return None
+    access_log = AccessLog(
+        None if conf.http_access_log == 'stdout' else conf.http_access_log,
+        conf.http_access_log_sample if hasattr(conf, 'http_access_log_sample') else 0.0,
+        conf.http_access_log_batch if hasattr(conf, 'http_access_log_batch') else 100,
+        conf.http_access_log_interval if hasattr(conf, 'http_access_log_interval') else 1.0,
+    )
+    ACCESS_LOGS.append(access_log)
+    return access_log
+
+
+def _close_access_log(access_log):
+    ''' close a replaced AccessLog once no open connection is using it '''
+    if any(getattr(handler, 'access_log', None) is access_log for handler in SERVER._inbound):
+        TIMERS.add(lambda: _close_access_log(access_log), 1000).start()
+        return
+    if access_log in ACCESS_LOGS:
+        ACCESS_LOGS.remove(access_log)
+    access_log.close()
+
+
+def _span_exporter(config, servers, is_new):
+    '''
+        start exporting trace spans if an active server has trace_export
+        configured: a path, "stdout" or "udp:host:port"; on reload, the
+        exporter is only replaced if the setting changes
+    '''
+    export = None
     for server in servers.values():
-        if is_new:
-            conf = config._get('server.%s' % server.name)
+        conf = config._get(_server_prefix(server, is_new))
+        if conf.is_active is not False:
+            export = export or getattr(conf, 'trace_export', None)
+    if export == _tracing.get('export'):
+        return
+    _tracing['export'] = export
+    if not export:
+        set_exporter(None)
+        return
+    if export.startswith('udp:'):
+        _, host, port = export.split(':')
+        exporter = SpanExporter(address=(host, int(port)))
+    else:
+        exporter = SpanExporter(None if export == 'stdout' else export)
+    set_exporter(exporter)
+
+
+def connection_stats(request):
+    ''' rest_handler for a server's http_stats_path: the SERVER's connection counters '''
+    return SERVER.connection_stats()
+
+
+def _signature(item):
+    ''' comparable form of a parsed micro definition (for reload) '''
+    if isinstance(item, dict):
+        return tuple(sorted((k, _signature(v)) for k, v in item.items()))
+    if isinstance(item, (list, tuple)):
+        return tuple(_signature(v) for v in item)
+    if hasattr(item, '__dict__'):
+        return (item.__class__.__name__, _signature(vars(item)))
+    return item
+
+
+def _settings(config, prefix):
+    ''' config values whose names start with prefix '''
+    prefix += '.'
+    return {key: config._get(key) for key in config.ordered_keys if key.startswith(prefix)}
+
+
+class _Running(object):
+    ''' a started server: what it was built from, and what was built (for reload) '''
+
+    def __init__(self, settings, listener, context, mappings):
+        self.settings = settings
+        self.listener = listener
+        self.context = context
+        self.mappings = mappings  # route signature: RESTMapping
+
+
+LISTENER_SETTINGS = ('port', 'handler', 'ssl.is_active', 'ssl.certfile', 'ssl.keyfile')
+
+
+def _server_prefix(server, is_new):
+    return 'server.%s' % server.name if is_new else server.name
+
+
+def _context(conf, access_log=None):
+    ''' MicroContext for a server; access_log, if specified, is used instead of a new one '''
+    return MicroContext(
+        conf.http_max_content_length if hasattr(conf, 'http_max_content_length') else None,
+        conf.http_max_line_length if hasattr(conf, 'http_max_line_length') else 10000,
+        conf.http_max_header_count if hasattr(conf, 'http_max_header_count') else 100,
+        conf.http_compress if hasattr(conf, 'http_compress') else False,
+        conf.http_compress_level if hasattr(conf, 'http_compress_level') else 6,
+        conf.http_compress_threshold if hasattr(conf, 'http_compress_threshold') else 1024,
+        _admission(conf),
+        _rate_limit(conf),
+        access_log or _access_log(conf),
+    )
+
+
+def _mapper(conf, server, context, mappings=None):
+    '''
+        RESTMapper for server's routes; a route with the same definition as
+        one in mappings (from an earlier build) keeps its RESTMapping, along
+        with its cache, admission and rate limit state
+
+        if http_lazy_import is set, route handlers are LazyHandlers, which
+        are imported on a route's first request (or by _warm_up)
+
+        returns (mapper, {route signature: RESTMapping})
+    '''
+    mappings = mappings or {}
+    is_lazy = getattr(conf, 'http_lazy_import', False)
+    built = {}
+    mapper = RESTMapper(context)
+    for route in server.routes:
+        signature = _signature(route)
+        if signature in mappings:
+            built[signature] = mapper.add_mapping(mappings[signature])
+            continue
+        kwargs = {}
+        for method, path in route.methods.items():
+            kwargs[method] = LazyHandler(path) if is_lazy else _import(path)
+        if route.compress:
+            kwargs['compress'] = route.compress.is_active
+            kwargs['compress_level'] = route.compress.level
+            kwargs['compress_threshold'] = route.compress.threshold
+        if route.admission:
+            a = route.admission
+            kwargs['admission'] = AdmissionController(
+                a.max_concurrent, a.max_queue, a.queue_timeout, a.adaptive,
+                a.min_concurrent, a.target_latency, retry_after=a.retry_after,
+            )
+        if route.rate_limit:
+            r = route.rate_limit
+            kwargs['rate_limit'] = RateLimiter(r.rate, r.burst, r.key, r.max_keys)
+        if route.cache:
+            c = route.cache
+            kwargs['cache'] = ResponseCache(c.ttl, c.stale, c.max_bytes, c.max_entries, c.vary, c.wait_timeout)
+        if route.deadline:
+            kwargs['deadline'] = route.deadline
+        built[signature] = mapper.add(route.pattern, silent=route.silent, **kwargs)
+    if getattr(conf, 'http_stats_path', None):
+        mapper.add('%s$' % conf.http_stats_path, get=connection_stats, silent=True)
+    return mapper, built
+
+
+def _warm_up(name, conf, mappings):
+    '''
+        if http_warm_up is set, import a server's LazyHandlers from the
+        event loop, one every http_warm_up_interval seconds, so that the
+        listener is serving requests while the rest of the handlers load
+    '''
+    if not getattr(conf, 'http_warm_up', False):
+        return
+    interval = conf.http_warm_up_interval if hasattr(conf, 'http_warm_up_interval') else 0.01
+    handlers = [h for m in mappings.values() for h in m.method.values() if isinstance(h, LazyHandler)]
+
+    def _next():
+        while handlers:
+            handler = handlers.pop(0)
+            if not handler.is_loaded:
+                handler.load()
+                break
+        if handlers:
+            TIMERS.add(_next, interval * 1000).start()
         else:
-            conf = config._get('%s' % server.name)
+            log.info('warm up complete on %s', name)
+
+    TIMERS.add(_next, interval * 1000).start()
+
+
+def _start_server(server, conf, settings, context, mapper, mappings):
+    handler = _import(conf.handler, is_module=True) if hasattr(conf, 'handler') else MicroRESTHandler
+    listener = SERVER.add_server(
+        conf.port,
+        handler,
+        mapper,
+        conf.ssl.is_active,
+        conf.ssl.certfile,
+        conf.ssl.keyfile,
+    )
+    _running[server.name] = _Running(settings, listener, context, mappings)
+    log.info('listening on %s port %d', server.name, conf.port)
+    _warm_up(server.name, conf, mappings)
+
+
+def setup_servers(config, servers, is_new):
+    for server in servers.values():
+        prefix = _server_prefix(server, is_new)
+        conf = config._get(prefix)
         if conf.is_active is False:
             continue
-        context = MicroContext(
-            conf.http_max_content_length if hasattr(conf, 'http_max_content_length') else None,
-            conf.http_max_line_length if hasattr(conf, 'http_max_line_length') else 10000,
-            conf.http_max_header_count if hasattr(conf, 'http_max_header_count') else 100,
-        )
-        mapper = RESTMapper(context)
-        for route in server.routes:
-            methods = {}
-            for method, path in route.methods.items():
-                methods[method] = _import(path)
-            mapper.add(route.pattern, silent=route.silent, **methods)
-        handler = _import(conf.handler, is_module=True) if hasattr(conf, 'handler') else MicroRESTHandler
-        SERVER.add_server(
-            conf.port,
-            handler,
-            mapper,
-            conf.ssl.is_active,
-            conf.ssl.certfile,
-            conf.ssl.keyfile,
-        )
-        log.info('listening on %s port %d', server.name, conf.port)
+        context = _context(conf)
+        mapper, mappings = _mapper(conf, server, context)
+        _start_server(server, conf, _settings(config, prefix), context, mapper, mappings)
+    _span_exporter(config, servers, is_new)
+
+
+def reload_servers(config, servers, is_new):
+    '''
+        apply a new parse of the micro and config files to the running
+        servers, and return a list of changes
+
+        Changed routes and server settings are swapped into a running
+        server's RESTMapper, and apply to new requests; unchanged routes
+        keep their state (for instance, cached responses). A server whose
+        port, handler or ssl settings change gets a new listener; its open
+        connections keep running with the old definitions.
+    '''
+    changes = []
+    for server in servers.values():
+        prefix = _server_prefix(server, is_new)
+        conf = config._get(prefix)
+        settings = _settings(config, prefix)
+        running = _running.get(server.name)
+        if conf.is_active is False:
+            if running:
+                _stop_server(server.name)
+                changes.append('server %s: stopped' % server.name)
+            continue
+        if running is None:
+            context = _context(conf)
+            mapper, mappings = _mapper(conf, server, context)
+            _start_server(server, conf, settings, context, mapper, mappings)
+            changes.append('server %s: started on port %d' % (server.name, conf.port))
+            continue
+        changed = set(key for key in set(settings) | set(running.settings) if settings.get(key) != running.settings.get(key))
+        listener_changed = changed & set('%s.%s' % (prefix, key) for key in LISTENER_SETTINGS)
+        context = running.context
+        if changed - listener_changed:
+            access_log = running.context.http_access_log
+            if any(key.startswith('%s.http_access_log' % prefix) for key in changed):
+                if access_log:
+                    _close_access_log(access_log)
+                access_log = None
+            context = _context(conf, access_log)
+        mapper, mappings = _mapper(conf, server, context, running.mappings)
+        if context is not running.context:
+            changes.append('server %s: settings changed' % server.name)
+        before = {m.pattern.pattern: s for s, m in running.mappings.items()}
+        after = {m.pattern.pattern: s for s, m in mappings.items()}
+        for pattern in sorted(set(before) | set(after)):
+            if pattern not in before:
+                changes.append('server %s: route %s added' % (server.name, pattern))
+            elif pattern not in after:
+                changes.append('server %s: route %s removed' % (server.name, pattern))
+            elif before[pattern] != after[pattern]:
+                changes.append('server %s: route %s changed' % (server.name, pattern))
+        if listener_changed:
+            running.listener.close()
+            _start_server(server, conf, settings, context, mapper, mappings)
+            changes.append('server %s: listening on port %d' % (server.name, conf.port))
+        else:
+            running.listener.context.update(mapper)
+            running.settings, running.context, running.mappings = settings, context, mappings
+            _warm_up(server.name, conf, mappings)
+    for name in set(_running) - set(servers):
+        _stop_server(name)
+        changes.append('server %s: stopped' % name)
+    _span_exporter(config, servers, is_new)
+    return changes
+
+
+def _stop_server(name):
+    running = _running.pop(name)
+    running.listener.close()
+    if running.context.http_access_log:
+        _close_access_log(running.context.http_access_log)
+
+
+def _policy(c, breakers):
+    ''' connection-wide Policy, if any of its features are configured '''
+    if c.retries or c.hedge is not None or breakers is not None:
+        return Policy(c.retries, c.backoff, c.backoff_max, c.hedge, breakers)
+    return None
+
+
+def _connection_signature(config, c):
+    return _signature(c), _settings(config, 'connection.%s' % c.name)
 
 
 def setup_connections(config, connections):
     for c in connections.values():
+        _connections[c.name] = _connection_signature(config, c)
         conf = config._get('connection.%s' % c.name)
         headers = {}
         for header in c.headers.values():
             value = config._get('connection.%s.header.%s' % (c.name, header.config)) if header.config else _import(header.code) if header.code else header.default
             if value:
                 headers[header.key] = value
+        breakers = CircuitBreakers(c.breaker, c.breaker_reset) if c.breaker else None
+        url = conf.url if c.url is not None else _import(c.code)
+        balancer = None
+        if c.balance and c.url is not None:
+            urls = [u.strip() for u in url.split(',')]
+            balancer = Balancer(urls, c.balance, c.resolve_all, c.eject_failures, c.eject_time)
+            url = urls[0]
         conn = async.Connection(
-           conf.url if c.url is not None else _import(c.code),
+           url,
            c.is_json,
            conf.is_debug,
            conf.timeout,
@@ -131,6 +453,8 @@ def setup_connections(config, connections):
            _import(c.handler) if c.handler else None,
            _import(c.setup) if c.setup else None,
            headers,
+           _policy(c, breakers),
+           balancer,
         )
         for resource in c.resources.values():
             optional = {}
@@ -154,20 +478,109 @@ def setup_connections(config, connections):
                 _import(resource.handler) if resource.handler else None,
                 _import(resource.wrapper) if resource.wrapper else None,
                 _import(resource.setup) if resource.setup else None,
+                ResourceCache(resource.cache, resource.cache_entries) if resource.cache is not None else None,
+                Policy(
+                    resource.retries if resource.retries is not None else c.retries,
+                    c.backoff,
+                    c.backoff_max,
+                    resource.hedge if resource.hedge is not None else c.hedge,
+                    breakers,
+                ) if resource.retries is not None or resource.hedge is not None else None,
             )
         setattr(connection, c.name, conn)
 
 
+def reload_connections(config, connections):
+    '''
+        apply a new parse of the micro and config files to the connections,
+        and return a list of changes
+
+        A changed connection is rebuilt and replaces the old one in
+        rhc.CONNECTIONS, so new calls use it; calls in progress finish on the
+        old one. Unchanged connections (and their caches) are kept.
+    '''
+    changes = []
+    for c in connections.values():
+        previous = _connections.get(c.name)
+        if previous == _connection_signature(config, c):
+            continue
+        setup_connections(config, {c.name: c})
+        changes.append('connection %s: %s' % (c.name, 'added' if previous is None else 'changed'))
+    for name in set(_connections) - set(connections):
+        del _connections[name]
+        if hasattr(connection, name):
+            delattr(connection, name)
+        changes.append('connection %s: removed' % name)
+    return changes
+
+
+def reload(micro=None, config=None):
+    '''
+        re-read the micro and config files (by default, the ones the servers
+        were started with), apply the differences to the running servers and
+        connections (see reload_servers and reload_connections), and return
+        the list of changes
+
+        The new Config replaces the old one in a single assignment; callbacks
+        registered with the old Config's _on_change move to the new one, and
+        are called with the names of the changed values.
+    '''
+    previous = getattr(sys.modules[__name__], 'config', None)
+    micro = micro or _sources.get('micro', 'micro')
+    config = config or _sources.get('config')
+    p = parser.parse(micro, _sources.get('cache') if micro == _sources.get('micro') else None)
+    if config:
+        p.config._load(file_util.normalize_path(config))
+    changes = reload_servers(p.config, p.servers, p.is_new)
+    if p.is_new:
+        changes.extend(reload_connections(p.config, p.connections))
+    sys.modules[__name__].config = p.config
+    if __name__ == '__main__':
+        module.config = p.config  # the copy of this module imported by rest handlers
+    if previous is not None:
+        for callback in previous._callbacks:
+            p.config._on_change(callback)
+        p.config._notify(previous._changes(p.config))
+    for change in changes:
+        log.info('reload: %s', change)
+    if not changes:
+        log.info('reload: no changes')
+    return changes
+
+
 def start(config, setup):
     if setup:
         _import(setup)(config)
 
 
-def run(sleep=100, max_iterations=100):
+def _on_signal(signum, frame):
+    _signals.append(signum)
+
+
+def run(sleep=100, max_iterations=100, drain_timeout=30.0):
+    '''
+        service the network and timers until shutdown
+
+        SIGTERM drains the server (see drain) before returning. SIGUSR2 starts
+        a new copy of this process which takes over the listening sockets
+        (see hand_off), and then drains. SIGHUP reloads the micro and config
+        files (see reload).
+    '''
+    for signum in (signal.SIGTERM, signal.SIGUSR2, signal.SIGHUP):
+        signal.signal(signum, _on_signal)
     while True:
         try:
             SERVER.service(delay=sleep/1000.0, max_iterations=max_iterations)
             TIMERS.service()
+            while _signals:
+                signum = _signals.pop(0)
+                if signum == signal.SIGHUP:
+                    reload()
+                    continue
+                if signum == signal.SIGUSR2:
+                    hand_off()
+                drain(drain_timeout, sleep, max_iterations)
+                return
         except KeyboardInterrupt:
             log.info('Received shutdown command from keyboard')
             break
@@ -175,9 +588,51 @@ def run(sleep=100, max_iterations=100):
             log.exception('exception encountered')
 
 
+def drain(timeout=30.0, sleep=100, max_iterations=100):
+    '''
+        stop accepting connections, and keep servicing the open ones until
+        their requests are done (or timeout seconds have passed)
+    '''
+    log.info('draining: %d connections open', SERVER.inbound_count)
+    SERVER.drain()
+    expires = time.time() + timeout
+    while not SERVER.is_drained and time.time() < expires:
+        SERVER.service(delay=sleep/1000.0, max_iterations=max_iterations)
+        TIMERS.service()
+    if not SERVER.is_drained:
+        log.warning('drain timeout: closing %d connections', SERVER.inbound_count)
+    SERVER.close()
+
+
+def _keep_fds(fds):
+    '''
+        preexec_fn for a child process which closes every inherited fd except
+        stdin, stdout, stderr and fds; open connections stay with this process
+    '''
+    def _close():
+        start = 3
+        for fd in sorted(fds) + [os.sysconf('SC_OPEN_MAX')]:
+            os.closerange(start, fd)
+            start = fd + 1
+    return _close
+
+
+def hand_off():
+    ''' start a new copy of this process, which inherits the listening sockets '''
+    env = dict(os.environ)
+    env[LISTEN_FDS] = SERVER.handoff_fds()
+    fds = inherited_fds(env).values()
+    p = subprocess.Popen([sys.executable] + sys.argv, env=env, close_fds=False, preexec_fn=_keep_fds(fds))
+    log.info('handed off listening sockets to pid %d', p.pid)
+
+
 def stop(teardown):
     if teardown:
         _import(teardown)()
+    while ACCESS_LOGS:
+        ACCESS_LOGS.pop().close()
+    set_exporter(None)
+    _tracing.clear()
 
 
 def launch(micro):
@@ -202,15 +657,19 @@ if __name__ == '__main__':
     aparser.add_argument('--config', default='config', help='configuration file')
     aparser.add_argument('--no-config', dest='no_config', default=False, action='store_true', help="don't use a config file")
     aparser.add_argument('--micro', default='micro', help='micro description file')
+    aparser.add_argument('--no-cache', dest='no_cache', default=False, action='store_true', help="don't save or use a cached parse of the micro file (in <micro>.cache)")
     aparser.add_argument('-c', '--config-only', dest='config_only', action='store_true', default=False, help='parse micro and config files and display config values')
 
     aparser.add_argument('-v', '--verbose', action='store_true', default=False, help='display debug level messages')
     aparser.add_argument('-s', '--stdout', action='store_true', default=False, help='display messages to stdout')
     args = aparser.parse_args()
 
-    p = parser.parse(args.micro)
+    cache = None if args.no_cache else '%s.cache' % args.micro
+    p = parser.parse(args.micro, cache)
+    _sources.update(micro=args.micro, cache=cache)
     if args.no_config is False:
         p.config._load(args.config)
+        _sources.update(config=args.config)
     if args.config_only is True:
         print p.config
     else:
@@ -1,6 +1,9 @@
+import cPickle as pickle
+import os
 import re
 
 import rhc.config as config_file
+import rhc.micro_fsm.fsm_micro as fsm_micro
 from rhc.file_util import normalize_path
 from rhc.micro_fsm.fsm_micro import create as create_machine
 
@@ -58,6 +61,51 @@ def load(micro='micro', files=None, lines=None):
     return lines
 
 
+CACHE_VERSION = 1
+
+
+def _stamp(paths):
+    ''' (path, mtime, size) for each path: a cached parse is used only if these are unchanged '''
+    result = []
+    for path in paths:
+        st = os.stat(path)
+        result.append((path, st.st_mtime, st.st_size))
+    return result
+
+
+def _code_files():
+    ''' source of the parser, which also decides what a cached parse contains '''
+    return [os.path.splitext(module.__file__)[0] + '.py' for module in (config_file, fsm_micro)] + [os.path.splitext(__file__)[0] + '.py']
+
+
+def _load_cache(cache, micro):
+    try:
+        with open(cache, 'rb') as f:
+            version, name, stamp, parser = pickle.load(f)
+    except IOError:
+        return None  # no cache yet
+    except Exception as e:
+        log.warning('ignoring unreadable micro cache %s: %s', cache, e)
+        return None
+    try:
+        if version == CACHE_VERSION and name == micro and _stamp(p for p, _, _ in stamp) == stamp:
+            return parser
+    except OSError:
+        pass  # a file was removed
+    return None
+
+
+def _save_cache(cache, micro, files, parser):
+    try:
+        stamp = _stamp(files + _code_files())
+        temp = '%s.%d' % (cache, os.getpid())
+        with open(temp, 'wb') as f:
+            pickle.dump((CACHE_VERSION, micro, stamp, parser), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, cache)  # atomic: a concurrent load sees the old cache or the new one
+    except Exception as e:
+        log.warning('unable to write micro cache %s: %s', cache, e)
+
+
 class Parser(object):
 
     def __init__(self):
@@ -76,6 +124,11 @@ class Parser(object):
             add_server=self.act_add_server,
             add_setup=self.act_add_setup,
             add_teardown=self.act_add_teardown,
+            admission=self.act_admission,
+            cache=self.act_cache,
+            compress=self.act_compress,
+            deadline=self.act_deadline,
+            rate_limit=self.act_rate_limit,
             silent=self.act_silent,
         )
         self.error = None
@@ -92,16 +145,38 @@ class Parser(object):
         return len(self._config_servers) == 0
 
     @classmethod
-    def parse(cls, micro='micro'):
+    def parse(cls, micro='micro', cache=None):
+        '''
+            Parse a micro file (or a list of lines).
+
+            If cache is a path, the parse of a micro file is saved there, and
+            loaded instead of parsing the next time, as long as the micro file
+            and the files it IMPORTs are unchanged. Config env values are
+            read again when a cached parse is loaded.
+        '''
+        is_cached = cache and isinstance(micro, str)
+        if is_cached:
+            parser = _load_cache(cache, micro)
+            if parser is not None:
+                return parser
+        files = []
         parser = cls()
-        for fname, num, parser.event, parser.line in load(micro):
+        for fname, num, parser.event, parser.line in load(micro, files):
             parser.args, parser.kwargs = to_args(parser.line)
             if not parser.fsm.handle(parser.event.lower()):
                 raise Exception("Unexpected directive '%s', file=%s, line=%d" % (parser.event, fname, num))
             if parser.error:
                 raise Exception('%s, line=%d' % (parser.error, num))
+        if is_cached:
+            _save_cache(cache, micro, files, parser)
         return parser
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in ('fsm', 'event', 'line', 'args', 'kwargs'):
+            state.pop(name, None)  # parsing state
+        return state
+
     def _add_config(self, name, **kwargs):
         self.config._define(name, **kwargs)
 
@@ -230,6 +305,31 @@ class Parser(object):
             raise Exception('one argument must be specified')
         self.server.set_silent(config_file.validate_bool(self.args[0]))
 
+    def act_compress(self):
+        if len(self.args) != 1:
+            raise Exception('one argument must be specified')
+        self.server.set_compress(Compress(*self.args, **self.kwargs))
+
+    def act_admission(self):
+        if len(self.args) != 1:
+            raise Exception('one argument must be specified')
+        self.server.set_admission(Admission(*self.args, **self.kwargs))
+
+    def act_rate_limit(self):
+        if len(self.args) != 1:
+            raise Exception('one argument must be specified')
+        self.server.set_rate_limit(RateLimit(*self.args, **self.kwargs))
+
+    def act_cache(self):
+        if len(self.args) != 1:
+            raise Exception('one argument must be specified')
+        self.server.set_cache(Cache(*self.args, **self.kwargs))
+
+    def act_deadline(self):
+        if len(self.args) != 1:
+            raise Exception('one argument must be specified')
+        self.server.set_deadline(float(self.args[0]))
+
 
 class Config(object):
 
@@ -264,6 +364,21 @@ class Server(object):
     def set_silent(self, flag):
         self.route.silent = flag
 
+    def set_compress(self, compress):
+        self.route.compress = compress
+
+    def set_admission(self, admission):
+        self.route.admission = admission
+
+    def set_rate_limit(self, rate_limit):
+        self.route.rate_limit = rate_limit
+
+    def set_deadline(self, deadline):
+        self.route.deadline = deadline
+
+    def set_cache(self, cache):
+        self.route.cache = cache
+
 
 class Route(object):
 
@@ -271,6 +386,11 @@ class Route(object):
         self.pattern = pattern
         self.methods = {}
         self.silent = False
+        self.compress = None
+        self.admission = None
+        self.rate_limit = None
+        self.cache = None
+        self.deadline = None
 
     def __repr__(self):
         return 'Route[pattern=%s, methods=%s, silent=%s]' % (
@@ -278,6 +398,62 @@ class Route(object):
         )
 
 
+class Compress(object):
+
+    def __init__(self, is_active, level=None, threshold=None):
+        self.is_active = config_file.validate_bool(is_active)
+        self.level = int(level) if level is not None else None
+        self.threshold = int(threshold) if threshold is not None else None
+
+    def __repr__(self):
+        return 'Compress[is_active=%s, level=%s, threshold=%s]' % (
+            self.is_active, self.level, self.threshold
+        )
+
+
+class Admission(object):
+
+    def __init__(self, max_concurrent, max_queue=0, queue_timeout=0, adaptive=False, min_concurrent=1, target_latency=1.0, retry_after=1):
+        self.max_concurrent = int(max_concurrent)
+        self.max_queue = int(max_queue)
+        self.queue_timeout = float(queue_timeout)
+        self.adaptive = config_file.validate_bool(adaptive)
+        self.min_concurrent = int(min_concurrent)
+        self.target_latency = float(target_latency)
+        self.retry_after = int(retry_after)
+
+    def __repr__(self):
+        return 'Admission[max_concurrent=%s, max_queue=%s, adaptive=%s]' % (
+            self.max_concurrent, self.max_queue, self.adaptive
+        )
+
+
+class RateLimit(object):
+
+    def __init__(self, rate, burst=None, key='peer', max_keys=10000):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else None
+        self.key = key
+        self.max_keys = int(max_keys)
+
+    def __repr__(self):
+        return 'RateLimit[rate=%s, burst=%s, key=%s]' % (self.rate, self.burst, self.key)
+
+
+class Cache(object):
+
+    def __init__(self, ttl, stale=0, max_bytes=10000000, max_entries=10000, vary=None, wait_timeout=10.0):
+        self.ttl = float(ttl)
+        self.stale = float(stale)
+        self.max_bytes = int(max_bytes)
+        self.max_entries = int(max_entries)
+        self.vary = vary.split(',') if vary else None
+        self.wait_timeout = float(wait_timeout)
+
+    def __repr__(self):
+        return 'Cache[ttl=%s, stale=%s, vary=%s]' % (self.ttl, self.stale, self.vary)
+
+
 class Method(object):
 
     def __init__(self, method, path):
@@ -290,7 +466,7 @@ class Method(object):
 
 class Connection(object):
 
-    def __init__(self, name, url=None, is_json=True, is_debug=False, timeout=5.0, handler=None, wrapper=None, setup=None, is_form=False, code=None):
+    def __init__(self, name, url=None, is_json=True, is_debug=False, timeout=5.0, handler=None, wrapper=None, setup=None, is_form=False, code=None, retries=0, backoff=0.1, backoff_max=5.0, hedge=None, breaker=None, breaker_reset=30.0, balance=None, resolve_all=False, eject_failures=5, eject_time=30.0):
         self.name = name
         self.url = url
         self.is_json = config_file.validate_bool(is_json)
@@ -301,6 +477,16 @@ class Connection(object):
         self.setup = setup
         self.is_form = config_file.validate_bool(is_form)
         self.code = code
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.backoff_max = float(backoff_max)
+        self.hedge = float(hedge) if hedge is not None else None
+        self.breaker = int(breaker) if breaker is not None else None
+        self.breaker_reset = float(breaker_reset)
+        self.balance = balance
+        self.resolve_all = config_file.validate_bool(resolve_all)
+        self.eject_failures = int(eject_failures)
+        self.eject_time = float(eject_time)
 
         self.headers = {}
         self.resources = {}
@@ -344,7 +530,7 @@ class Header(object):
 
 class Resource(object):
 
-    def __init__(self, name, path, method='GET', is_json=None, is_debug=None, trace=None, timeout=None, handler=None, wrapper=None, setup=None, is_form=None):
+    def __init__(self, name, path, method='GET', is_json=None, is_debug=None, trace=None, timeout=None, handler=None, wrapper=None, setup=None, is_form=None, cache=None, cache_entries=1000, retries=None, hedge=None):
         self.name = name
         self.path = path
         self.method = method
@@ -356,6 +542,10 @@ class Resource(object):
         self.wrapper = wrapper
         self.setup = setup
         self.is_form = config_file.validate_bool(is_form) if is_form is not None else None
+        self.cache = float(cache) if cache is not None else None
+        self.cache_entries = int(cache_entries)
+        self.retries = int(retries) if retries is not None else None
+        self.hedge = float(hedge) if hedge is not None else None
 
         self.required = []
         self.optional = {}
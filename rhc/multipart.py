@@ -0,0 +1,260 @@
+'''
+Incremental multipart (RFC 2046) parsing.
+
+A MultipartParser is fed the message content as it arrives. Each part is
+handed to on_part as soon as its closing delimiter is seen, so a large
+upload is never held in memory as a whole: part content up to threshold
+bytes is kept in memory, beyond that it is written to a temporary file.
+'''
+import tempfile
+
+from StringIO import StringIO
+
+
+def multipart_boundary(content_type):
+    ''' boundary parameter from a multipart Content-Type header (or None) '''
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'boundary':
+            return value.strip().strip('"') or None
+    return None
+
+
+class HTTPHeaders(dict):
+
+    ''' dict of http headers with case-insensitive names
+
+        names keep the case in which they were first set; any case
+        can be used to get, test or replace a value.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(HTTPHeaders, self).__init__()
+        self._names = {}
+        self.update(*args, **kwargs)
+
+    def _name(self, name):
+        return self._names.get(name.lower(), name)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, self._name(name))
+
+    def __setitem__(self, name, value):
+        lower = name.lower()
+        previous = self._names.get(lower)
+        if previous is not None and previous != name:
+            dict.__delitem__(self, previous)
+        self._names[lower] = name
+        dict.__setitem__(self, name, value)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, self._names.pop(name.lower(), name))
+
+    def __contains__(self, name):
+        return name.lower() in self._names
+
+    has_key = __contains__
+
+    def get(self, name, default=None):
+        return dict.get(self, self._name(name), default)
+
+    def pop(self, name, *default):
+        return dict.pop(self, self._names.pop(name.lower(), name), *default)
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def update(self, *args, **kwargs):
+        for n, v in dict(*args, **kwargs).items():
+            self[n] = v
+
+    def clear(self):
+        self._names.clear()
+        dict.clear(self)
+
+    def copy(self):
+        return HTTPHeaders(self)
+
+
+class HTTPPart(object):
+
+    def __init__(self, headers, disposition, content=None, threshold=65536):
+        '''
+            Container for one part of a multipart message.
+
+            The disposition is a dict with the k:v pairs from the 'Content-Disposition'
+            header, where things like filename are stored.
+
+            Content is added with write; once more than threshold bytes have
+            been written it is moved to a temporary file (is_file is True).
+            Use the file attribute to read large content without loading it.
+        '''
+        self.headers = headers
+        self.disposition = disposition
+        self.threshold = threshold
+        self.size = 0
+        self._chunks = []
+        self._file = None
+        if content:
+            self.write(content)
+
+    @property
+    def is_file(self):
+        return self._file is not None
+
+    def write(self, data):
+        self.size += len(data)
+        if self._file is None and self.size > self.threshold:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(''.join(self._chunks))
+            self._chunks = None
+        if self._file is None:
+            self._chunks.append(data)
+        else:
+            self._file.write(data)
+
+    @property
+    def content(self):
+        if self._file is None:
+            if len(self._chunks) > 1:
+                self._chunks = [''.join(self._chunks)]
+            return self._chunks[0] if self._chunks else ''
+        self._file.seek(0)
+        return self._file.read()
+
+    @property
+    def file(self):
+        ''' file-like object positioned at the start of the content '''
+        if self._file is None:
+            return StringIO(self.content)
+        self._file.seek(0)
+        return self._file
+
+    def close(self):
+        ''' release the temporary file (if any) '''
+        if self._file is not None:
+            self._file.close()
+
+
+class MultipartParser(object):
+
+    def __init__(self, boundary, threshold=65536, on_part=None, max_header_length=10000):
+        '''
+            Incremental parser for the content of a multipart message.
+
+            Parameters:
+                boundary          - boundary parameter from the Content-Type header
+                threshold         - part content larger than this is written to a temporary file
+                on_part           - callable(HTTPPart), called as each part completes
+                max_header_length - limit on the size of any part's headers
+
+            Call feed with each piece of content, and close at the end of the
+            content. Malformed content raises ValueError. Completed parts are
+            in the parts list.
+        '''
+        self.threshold = threshold
+        self.on_part = on_part
+        self.max_header_length = max_header_length
+        self.parts = []
+        self.is_complete = False
+
+        self._delimiter = '\r\n--' + boundary
+        self._buffer = '\r\n'  # the first delimiter isn't preceded by a line end
+        self._state = self._preamble
+        self._headers = None
+        self._header_length = 0
+        self._part = None
+
+    def feed(self, data):
+        self._buffer += data
+        while self._state():
+            pass
+
+    def close(self):
+        if not self.is_complete:
+            raise ValueError('Malformed multipart message: missing close delimiter')
+
+    def _keep(self):
+        ''' size of buffer tail that may hold the start of a delimiter '''
+        return len(self._delimiter) - 1
+
+    def _preamble(self):
+        index = self._buffer.find(self._delimiter)
+        if index == -1:
+            self._buffer = self._buffer[-self._keep():]
+            return False
+        self._buffer = self._buffer[index + len(self._delimiter):]
+        self._state = self._boundary_end
+        return True
+
+    def _boundary_end(self):
+        if self._buffer.startswith('--'):
+            self.is_complete = True
+            self._state = self._epilogue
+            return True
+        index = self._buffer.find('\n')
+        if index == -1:
+            if len(self._buffer) > self.max_header_length:
+                raise ValueError('Malformed multipart message: invalid delimiter')
+            return False
+        if self._buffer[:index].strip(' \t\r'):  # only transport padding is allowed
+            raise ValueError('Malformed multipart message: invalid delimiter')
+        self._buffer = self._buffer[index + 1:]
+        self._headers = HTTPHeaders()
+        self._header_length = 0
+        self._state = self._header
+        return True
+
+    def _header(self):
+        index = self._buffer.find('\n')
+        if index == -1:
+            if self._header_length + len(self._buffer) > self.max_header_length:
+                raise ValueError('Malformed multipart message: headers too long')
+            return False
+        line, self._buffer = self._buffer[:index], self._buffer[index + 1:]
+        self._header_length += index + 1
+        if self._header_length > self.max_header_length:
+            raise ValueError('Malformed multipart message: headers too long')
+        if line.endswith('\r'):
+            line = line[:-1]
+        if line:
+            test = line.split(':', 1)
+            if len(test) != 2:
+                raise ValueError('Malformed multipart message: invalid header')
+            self._headers[test[0].strip()] = test[1].strip()
+            return True
+
+        headers, disposition = self._headers, {}
+        if 'Content-Disposition' in headers:
+            params = headers['Content-Disposition'].split(';')
+            headers['Content-Disposition'] = params[0].strip()
+            for param in params[1:]:
+                name, _, value = param.strip().partition('=')
+                disposition[name] = value
+        self._part = HTTPPart(headers, disposition, threshold=self.threshold)
+        self._state = self._content
+        return True
+
+    def _content(self):
+        index = self._buffer.find(self._delimiter)
+        if index == -1:
+            keep = self._keep()
+            if len(self._buffer) > keep:
+                self._part.write(self._buffer[:-keep])
+                self._buffer = self._buffer[-keep:]
+            return False
+        if index:
+            self._part.write(self._buffer[:index])
+        self._buffer = self._buffer[index + len(self._delimiter):]
+        part, self._part = self._part, None
+        self.parts.append(part)
+        if self.on_part:
+            self.on_part(part)
+        self._state = self._boundary_end
+        return True
+
+    def _epilogue(self):
+        self._buffer = ''
+        return False
@@ -0,0 +1,292 @@
+'''
+Failure handling policies for outbound (async.Connection) requests.
+
+A Policy wraps each request made by a Connection resource:
+
+    retry   - a request that fails without a response, or with a 5xx or
+              429 response, is retried up to retries times, after a delay
+              that starts at backoff seconds and doubles with each retry
+              (a BackoffTimer), up to backoff_max seconds
+    hedge   - if a request takes longer than the hedge percentile of
+              recent successful latencies, a second identical request is
+              started; the first response wins and the other connection is
+              closed
+    breaker - a CircuitBreakers instance, shared by the resources of a
+              Connection, that tracks failures for each host. after
+              threshold consecutive failures a host's breaker opens and
+              requests fail immediately with 'circuit open'; after
+              reset_timeout seconds one request is let through, and its
+              success closes the breaker again
+
+Only idempotent requests (GET, HEAD, PUT, DELETE, OPTIONS) are retried or
+hedged. Counters are kept in the stats attribute of Policy and CircuitBreaker.
+'''
+import collections
+import time
+
+from rhc.stats import Stats
+from rhc.timer import TIMERS
+
+
+IDEMPOTENT = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+
+class CircuitBreaker(object):
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        '''
+            Parameters:
+                threshold     - consecutive failures which open the breaker
+                reset_timeout - seconds the breaker stays open before a trial request is allowed
+        '''
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.stats = Stats('opened', 'closed', 'rejected')
+        self._t_open = 0
+        self._is_probing = False
+
+    def __repr__(self):
+        return 'CircuitBreaker[state=%s, failures=%s]' % (self.state, self.failures)
+
+    def allow(self):
+        ''' True if a request can be made '''
+        if self.state == self.OPEN and time.time() - self._t_open >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._is_probing = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._is_probing:
+            self._is_probing = True
+            return True
+        self.stats.rejected += 1
+        return False
+
+    def success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self.stats.closed += 1
+
+    def abandon(self):
+        ''' the trial request was cancelled before it finished; let another one through '''
+        if self.state == self.HALF_OPEN:
+            self._is_probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            self.state = self.OPEN
+            self._t_open = time.time()
+            self.stats.opened += 1
+
+
+class CircuitBreakers(object):
+    ''' a CircuitBreaker for each host, created on first use '''
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+
+    def __repr__(self):
+        return 'CircuitBreakers[%s]' % ', '.join('%s=%s' % (host, b.state) for host, b in self._breakers.items())
+
+    def __getitem__(self, host):
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(self.threshold, self.reset_timeout)
+        return breaker
+
+    @property
+    def states(self):
+        return {host: breaker.state for host, breaker in self._breakers.items()}
+
+
+class Policy(object):
+
+    def __init__(self, retries=0, backoff=0.1, backoff_max=5.0, hedge=None, breaker=None, window=100, min_samples=10):
+        '''
+            Parameters:
+                retries     - number of times a failed request is retried
+                backoff     - seconds before the first retry
+                backoff_max - limit on seconds between retries
+                hedge       - latency percentile (eg, 95) after which a hedged request is started
+                breaker     - CircuitBreakers instance
+                window      - number of recent latencies used to calculate the hedge delay
+                min_samples - number of latencies needed before requests are hedged
+        '''
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.breaker = breaker
+        self.min_samples = min_samples
+        self.stats = Stats('calls', 'retries', 'hedges', 'hedge_wins', 'failures', 'rejected')
+        self._latency = collections.deque(maxlen=window)
+
+    def __repr__(self):
+        return 'Policy[retries=%s, hedge=%s, breaker=%s]' % (self.retries, self.hedge, self.breaker)
+
+    @property
+    def hedge_delay(self):
+        ''' seconds after which a request is hedged (or None) '''
+        if self.hedge is None or len(self._latency) < self.min_samples:
+            return None
+        latency = sorted(self._latency)
+        index = int(len(latency) * self.hedge / 100.0)
+        return latency[min(index, len(latency) - 1)]
+
+    def call(self, callback, method, host, send, observer=None):
+        '''
+            make a request using this policy
+
+            callback - callable(rc, result), called once with the final result
+            method   - http method
+            host     - key for the circuit breaker
+            send     - callable(callback, observer) which makes one attempt and returns its handler
+            observer - passed the winning response's status and headers (see ConnectContext)
+
+            returns a PolicyCall (is_done is True on completion; cancel stops it)
+        '''
+        self.stats.calls += 1
+        call = PolicyCall(self, callback, method, host, send, observer)
+        call.start()
+        return call
+
+
+class _Attempt(object):
+
+    def __init__(self, call, is_hedge):
+        self.call = call
+        self.is_hedge = is_hedge
+        self.t_start = time.time()
+        self.status = None
+        self.headers = None
+        self.handler = None
+        self.is_probe = False  # True if this is the circuit breaker's trial request
+
+    def on_response(self, status, headers):
+        self.status = status
+        self.headers = headers
+
+    def done(self, rc, result):
+        self.call._on_attempt(self, rc, result)
+
+    @property
+    def is_failure(self):
+        ''' True if a failed attempt counts against the host (no response, 5xx or 429) '''
+        return self.status is None or self.status >= 500 or self.status == 429
+
+
+class PolicyCall(object):
+
+    def __init__(self, policy, callback, method, host, send, observer):
+        self.policy = policy
+        self.callback = callback
+        self.host = host
+        self.send = send
+        self.observer = observer
+        self.is_done = False
+
+        is_idempotent = method.upper() in IDEMPOTENT
+        self._retries = policy.retries if is_idempotent else 0
+        self._is_hedged = is_idempotent and policy.hedge is not None
+        self._breaker = policy.breaker[host] if policy.breaker is not None else None
+        self._attempts = []  # attempts in progress
+        self._retry_timer = None
+        self._hedge_timer = None
+
+    def start(self):
+        self._attempt()
+        if self._is_hedged and not self.is_done:
+            delay = self.policy.hedge_delay
+            if delay is not None:
+                self._hedge_timer = TIMERS.add(self._on_hedge, delay * 1000).start()
+
+    def cancel(self, reason='cancelled'):
+        ''' stop the call without calling callback '''
+        if not self.is_done:
+            self.is_done = True
+            self._cleanup(reason)
+
+    def _attempt(self, is_hedge=False):
+        if self._breaker is not None and not self._breaker.allow():
+            self.policy.stats.rejected += 1
+            if not self._attempts:
+                self._finish(None, 1, 'circuit open')
+            return
+        attempt = _Attempt(self, is_hedge)
+        attempt.is_probe = self._breaker is not None and self._breaker.state == CircuitBreaker.HALF_OPEN
+        self._attempts.append(attempt)
+        handler = self.send(attempt.done, attempt)
+        if attempt in self._attempts:  # still running
+            attempt.handler = handler
+
+    def _on_hedge(self):
+        if not self.is_done and len(self._attempts) == 1:
+            self.policy.stats.hedges += 1
+            self._attempt(is_hedge=True)
+
+    def _on_retry(self):
+        if not self.is_done:
+            self._attempt()
+
+    def _on_attempt(self, attempt, rc, result):
+        if self.is_done or attempt not in self._attempts:
+            return
+        self._attempts.remove(attempt)
+
+        is_failure = rc != 0 and attempt.is_failure
+        if self._breaker is not None:
+            if is_failure:
+                self._breaker.failure()
+            else:
+                self._breaker.success()
+
+        if not is_failure:
+            if rc == 0:
+                self.policy._latency.append(time.time() - attempt.t_start)
+            return self._finish(attempt, rc, result)
+
+        if self._attempts:
+            return  # a hedged attempt is still running
+        if self._retries > 0:
+            self._retries -= 1
+            self.policy.stats.retries += 1
+            if self._retry_timer is None:
+                self._retry_timer = TIMERS.add_backoff(self._on_retry, self.policy.backoff * 1000, self.policy.backoff_max * 1000)
+            self._retry_timer.start()
+            return
+        self._finish(attempt, rc, result)
+
+    def _cleanup(self, reason):
+        for timer in (self._retry_timer, self._hedge_timer):
+            if timer is not None:
+                timer.cancel()
+        attempts, self._attempts = self._attempts, []
+        for attempt in attempts:
+            if attempt.is_probe:
+                self._breaker.abandon()
+            handler = attempt.handler
+            if hasattr(handler, 'cancel'):
+                handler.cancel(reason)
+            elif hasattr(handler, 'close'):
+                handler.close(reason)
+
+    def _finish(self, attempt, rc, result):
+        self.is_done = True
+        self._cleanup('hedged request complete')
+        if rc != 0:
+            self.policy.stats.failures += 1
+        if attempt is not None:
+            if attempt.is_hedge:
+                self.policy.stats.hedge_wins += 1
+            if self.observer is not None and attempt.status is not None:
+                self.observer.on_response(attempt.status, attempt.headers)
+        self.callback(rc, result)
@@ -0,0 +1,77 @@
+'''
+Token-bucket rate limiting.
+
+A RateLimiter holds a token bucket for each key (for instance, each client
+address). A bucket holds up to burst tokens and refills at rate tokens per
+second; each request takes one token, and a request that finds the bucket
+empty is limited. Buckets are kept in an LRU of max_keys entries, so memory
+use is bounded no matter how many distinct keys are seen. A discarded
+bucket starts again full, which only ever favors the client.
+
+The key describes how RESTHandler identifies a client:
+
+    peer        - the client's address
+    header:name - the value of an http header (eg, header:X-Api-Key)
+    group:n     - regex group n (from zero) of the matching route
+    all         - a single bucket for every request
+'''
+import time
+
+from rhc.lru import LRU
+from rhc.stats import Stats
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate, burst=None, key='peer', max_keys=10000):
+        '''
+            Parameters:
+                rate     - tokens added to each bucket per second
+                burst    - bucket size, at least 1 (default=max(rate, 1))
+                key      - how requests are grouped into buckets (see module docstring)
+                max_keys - number of buckets kept
+        '''
+        self.rate = float(rate)
+        if not self.rate > 0:
+            raise ValueError("invalid rate limit rate '%s'" % rate)
+        self.burst = float(burst) if burst is not None else max(self.rate, 1.0)
+        if not self.burst >= 1:
+            raise ValueError("invalid rate limit burst '%s'" % burst)
+        self.key = key
+        self.key_type, _, key_name = key.partition(':')
+        if self.key_type == 'group':
+            self.key_name = int(key_name)
+        elif self.key_type == 'header':
+            self.key_name = key_name
+        elif self.key_type in ('peer', 'all'):
+            self.key_name = None
+        else:
+            raise ValueError("invalid rate limit key '%s'" % key)
+        self.stats = Stats('allowed', 'limited')
+        self._buckets = LRU(max_keys)
+
+    def __repr__(self):
+        return 'RateLimiter[rate=%s, burst=%s, key=%s]' % (self.rate, self.burst, self.key)
+
+    def acquire(self, key, now=None):
+        '''
+            take a token from key's bucket
+
+            returns 0 if a token was available, else the number of seconds
+            until one will be
+        '''
+        if now is None:
+            now = time.time()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]  # [tokens, time of last refill]
+            self._buckets[key] = bucket
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.stats.allowed += 1
+            return 0
+        self.stats.limited += 1
+        return (1 - bucket[0]) / self.rate
@@ -22,7 +22,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
 import datetime
-import json
+import functools
+import math
 import re
 import sys
 import time
@@ -30,33 +31,69 @@ import traceback
 import types
 import urlparse
 
+import rhc.codec as codec
 from rhc.database.db import DB
-from rhc.httphandler import HTTPHandler
-from rhc.task import Task, inspect_parameters
+from rhc.httphandler import HTTPHandler, HTTPMessage, HeaderTemplate, STATUS_MESSAGES, accept_encoding, compress
+from rhc.stats import Stats
+from rhc.task import DEADLINE_HEADER, Deadline, Task, deadline_scope, inspect_parameters, is_cancellable
+from rhc.tracing import TRACEPARENT_HEADER, SpanContext, span_scope
 
 import logging
 log = logging.getLogger(__name__)
 
 
-class RESTRequest(object):
+COMPRESSION = Stats('responses', 'bytes_in', 'bytes_out')  # bytes saved = bytes_in - bytes_out
+
+
+class RESTRequest(HTTPMessage):
 
     def __init__(self, handler):
         self.handler = handler
         self.context = handler.context.context  # context from RESTMapper
         self.http_message = handler.http_message
-        self.http_headers = handler.http_headers
-        self.http_content = handler.http_content
         self.http_method = handler.http_method
-        self.http_multipart = handler.http_multipart
         self.http_resource = handler.http_resource
-        self.http_query_string = handler.http_query_string
-        self.http_query = handler.http_query
+        self._copy_message(handler)  # headers, content, query and multipart
         self.timestamp = datetime.datetime.now()
         self.is_delayed = False
+        self.compress = None  # (encoding, level, threshold) if response can be compressed
+        self.template = None  # HeaderTemplate from the matching RESTMapping
+        self._admission = None  # AdmissionController, while the request holds one of its slots
+        self._cache = None  # (ResponseCache, key) if the response will fill a cache entry
+        self._is_revalidate = False  # True if the response only refreshes a cache entry
+        self.deadline = None  # rhc.task.Deadline from the X-Request-Timeout header or RESTMapping
+        self._calls = []  # handles of async calls in progress (see cancel)
+        self.span = None  # rhc.tracing.SpanContext from the traceparent header
+        self.t_start = handler.t_http_start or handler.t_http_data
 
     def delay(self):
         self.is_delayed = True
 
+    def _admit(self, admission):
+        self._admission = admission
+        self._t_admit = time.time()
+        self.handler._admitted.add(self)
+
+    def _release(self):
+        if self._admission:
+            admission, self._admission = self._admission, None
+            self.handler._admitted.discard(self)
+            admission.release(time.time() - self._t_admit)
+
+    def _track(self, handle):
+        if is_cancellable(handle):
+            self._calls = [h for h in self._calls if not h.is_done]
+            self._calls.append(handle)
+            self.handler._calling.add(self)
+
+    def cancel(self):
+        ''' cancel the async calls in progress (called when the connection closes) '''
+        self.handler._calling.discard(self)
+        calls, self._calls = self._calls, []
+        for handle in calls:
+            if not handle.is_done:
+                handle.cancel()
+
     @property
     def id(self):
         return self.handler.id
@@ -74,14 +111,14 @@ class RESTRequest(object):
             result = RESTResult(*args, **kwargs)
         result.close = self.http_headers.get('Connection') == 'close'  # grab Connection from cached headers in case they have been cleared on the HTTPHandler
         self.is_delayed = True  # treat as delayed to stop on_http_data from responding a second time in the non-delay case
-        self.handler.rest_response(result)
+        self.handler._rest_result(self, result)
 
     @property
     def json(self):
         if not hasattr(self, '_json'):
             if self.http_content and self.http_content.lstrip()[0] in '[{':
                 try:
-                    self._json = json.loads(self.http_content)
+                    self._json = codec.loads(self.http_content)
                 except Exception:
                     raise Exception('Unable to parse json content')
             elif len(self.http_query) > 0:
@@ -145,6 +182,12 @@ class RESTRequest(object):
             2. If the first parameter of fn (from inspection) is named 'task',
                then an rhc.Task object is passed instead of a callable.
 
+            3. If the request's deadline has passed, fn is not called;
+               instead, the request is responded to with a 504.
+
+            4. If the connection closes before the request is responded to,
+               the call is cancelled (see Task.call, Note 4).
+
         Example:
 
             def on_load(task, result):
@@ -161,11 +204,16 @@ class RESTRequest(object):
         """
 
         def cb(rc, result):
-            if rc == 0:
-                _callback(self, fn, result, on_success, on_success_code,
-                          on_none, on_none_404)
-            else:
-                _callback_error(self, fn, result, on_error)
+            with deadline_scope(self.deadline), span_scope(self.span):
+                if rc == 0:
+                    _callback(self, fn, result, on_success, on_success_code,
+                              on_none, on_none_404)
+                else:
+                    _callback_error(self, fn, result, on_error)
+
+        if self.deadline is not None and self.deadline.is_expired:
+            log.debug('request.call, cid=%s fn=%s deadline expired', self.id, fn)
+            return self.respond(504)
 
         if args is None:
             args = ()
@@ -179,12 +227,14 @@ class RESTRequest(object):
         task = inspect_parameters(fn, kwargs)
 
         if task:
-            cb = Task(cb, self.id)
+            cb = Task(cb, self.id, self.deadline, self.span)
 
         try:
             log.debug('request.call, cid=%s fn=%s %s', self.id, fn,
                       'as task' if task else '')
-            fn(cb, *args, **kwargs)
+            with deadline_scope(self.deadline), span_scope(self.span):
+                handle = fn(cb, *args, **kwargs)
+            self._track(cb if task else handle)
             self.delay()
         except Exception:
             log.exception('cid=%s: exception on call')
@@ -289,10 +339,12 @@ class RESTResult(object):
 
         self.code = code
         self.close = False
+        self.compress = None
+        self.template = None
 
         if isinstance(content, (types.DictType, types.ListType, types.FloatType, types.BooleanType, types.IntType)):
             try:
-                content = json.dumps(content)
+                content = codec.dumps(content)
                 content_type = 'application/json; charset=utf-8'
             except Exception:
                 content = str(content)
@@ -303,17 +355,7 @@ class RESTResult(object):
             headers['Content-Type'] = content_type
 
         if not message:
-            message = {
-                200: 'OK',
-                201: 'Created',
-                204: 'No Content',
-                302: 'Found',
-                400: 'Bad Request',
-                401: 'Unauthorized',
-                403: 'Forbidden',
-                404: 'Not Found',
-                500: 'Internal Server Error',
-            }.get(code, '')
+            message = STATUS_MESSAGES.get(code, '')
         self.message = message
         self.content = content
         self.headers = headers
@@ -345,38 +387,178 @@ class RESTHandler(HTTPHandler):
         request object; the socket will remain open and set the
         is_delayed flag on the RESTRequest.
 
+        If http_compress is True (or compression is enabled on the matching
+        mapping), responses of at least http_compress_threshold bytes are
+        compressed at http_compress_level using a content-coding accepted by
+        the client. Totals are kept in resthandler.COMPRESSION.
+
+        If http_admission is an AdmissionController (or the matching mapping
+        has one), requests are started, queued or shed (503 with Retry-After)
+        according to its limits. Shared controllers limit across connections.
+
+        If http_rate_limit is a RateLimiter (or the matching mapping has one),
+        a request from a client which is over its rate is answered with a 429
+        and Retry-After before any other processing.
+
+        GET requests for a mapping with a ResponseCache are answered from the
+        cache where possible (see rhc.cache).
+
         Callback methods:
             on_rest_data(self, *groups)
             on_rest_exception(self, exc_type, exc_value, exc_traceback)
             on_rest_send(self, code, message, content, headers)
+            on_rest_shed(self)
+            on_rest_limited(self)
     '''
 
     def __init__(self, *args, **kwargs):
         super(RESTHandler, self).__init__(*args, **kwargs)
         self._silent = False
+        self.http_compress = False
+        self.http_compress_level = 6
+        self.http_compress_threshold = 1024
+        self.http_admission = None
+        self.http_rate_limit = None
+        self._admitted = set()  # RESTRequests holding an admission slot
+        self._calling = set()  # RESTRequests with async calls in progress
+        self._peer_host = None
 
     def on_http_data(self):
-        handler, groups, silent = self.context._match(
+        mapping, handler, groups = self.context._find(
             self.http_resource, self.http_method
         )
         if handler:
-            self._silent = silent
-            try:
-                request = RESTRequest(self)
-                self.on_rest_data(request, *groups)
-                result = handler(request, *groups)
-                if not request.is_delayed:
-                    self.rest_response(RESTResult.coerce(result))
-            except Exception:
-                content = self.on_rest_exception(*sys.exc_info())
-                kwargs = dict(code=501, message='Internal Server Error')
-                if content:
-                    kwargs['content'] = str(content)
-                self._rest_send(**kwargs)
+            self._silent = mapping.silent
+            limiter = mapping.rate_limit or self.http_rate_limit
+            if limiter:
+                wait = limiter.acquire(self._rate_limit_key(limiter, groups))
+                if wait:
+                    self.on_rest_limited()
+                    self._rest_send(code=429, message='Too Many Requests', headers={'Retry-After': str(int(math.ceil(wait)))})
+                    return
+            request = RESTRequest(self)
+            request.compress = self._compression(mapping)
+            request.template = mapping.template
+            request.deadline = Deadline.from_header(self.http_headers.get(DEADLINE_HEADER), mapping.deadline)
+            request.span = SpanContext.from_header(self.http_headers.get(TRACEPARENT_HEADER))
+            if mapping.cache and self.http_method == 'GET':
+                if self._rest_cache(mapping, handler, groups, request):
+                    return
+            self._rest_admit(mapping, handler, groups, request)
         else:
             self.on_rest_no_match()
             self._rest_send(code=404, message='Not Found')
 
+    def _rest_admit(self, mapping, handler, groups, request):
+        ''' handle request, subject to the mapping's (or handler's) AdmissionController '''
+        admission = mapping.admission or self.http_admission
+        if admission is None:
+            self._rest_handle(handler, groups, request)
+        else:
+            start = functools.partial(self._rest_admitted, admission, handler, groups, request)
+            shed = functools.partial(self._rest_shed, admission, request)
+            if not admission.admit(start, shed):
+                shed()
+
+    def _rate_limit_key(self, limiter, groups):
+        key_type = limiter.key_type
+        if key_type == 'peer':
+            if self._peer_host is None:
+                self._peer_host = self.peer_address()[0]
+            return self._peer_host
+        if key_type == 'header':
+            return self.http_headers.get(limiter.key_name)
+        if key_type == 'group':
+            return groups[limiter.key_name] if limiter.key_name < len(groups) else None
+        return None
+
+    def _rest_cache(self, mapping, handler, groups, request):
+        ''' respond from (or wait on) the mapping's cache; returns False if the request must be handled '''
+        cache = mapping.cache
+        key = cache.key(self.http_resource, self.http_query_string, self.http_headers)
+        entry, is_fresh = cache.lookup(key)
+        if entry:
+            self._rest_result(request, self._cached_result(cache, entry, request))
+            if not is_fresh and not cache.is_pending(key):
+                revalidate = RESTRequest(self)
+                revalidate._cache = cache, key
+                revalidate._is_revalidate = True
+                cache.start(key)
+                self._rest_admit(mapping, handler, groups, revalidate)
+            return True
+        if cache.wait(key, functools.partial(self._cache_waiter, cache, request)):
+            return True
+        request._cache = cache, key
+        cache.start(key)
+        return False
+
+    @staticmethod
+    def _cached_result(cache, entry, request):
+        if entry.is_match(request.http_headers.get('If-None-Match')):
+            cache.stats.not_modified += 1
+            return RESTResult(304, headers={'ETag': entry.etag}, message='Not Modified')
+        return RESTResult(content=entry.content, headers=dict(entry.headers), message=entry.message)
+
+    def _cache_waiter(self, cache, request, result, entry):
+        if result is None:
+            result = RESTResult(504, message='Gateway Timeout')  # the response in progress took too long
+        elif entry:
+            result = self._cached_result(cache, entry, request)
+        else:
+            result = RESTResult(result.code, result.content, dict(result.headers) if result.headers else None, result.message)
+        self._rest_result(request, result)
+
+    def _rest_admitted(self, admission, handler, groups, request):
+        request._admit(admission)
+        if self.closed and not request._cache:  # connection closed while the request was queued
+            request._release()
+        else:
+            self._rest_handle(handler, groups, request)
+
+    def _rest_shed(self, admission, request):
+        if not self.closed:
+            self.on_rest_shed()
+        self._rest_result(request, RESTResult(503, headers={'Retry-After': str(admission.retry_after)}, message='Service Unavailable'))
+
+    def _rest_handle(self, handler, groups, request):
+        if request.deadline is not None and request.deadline.is_expired:
+            return self._rest_result(request, RESTResult(504))  # expired while queued
+        try:
+            self.on_rest_data(request, *groups)
+            with deadline_scope(request.deadline), span_scope(request.span):
+                result = handler(request, *groups)
+            if not request.is_delayed:
+                self._rest_result(request, RESTResult.coerce(result))
+        except Exception:
+            content = self.on_rest_exception(*sys.exc_info())
+            self._rest_result(request, RESTResult(501, str(content) if content else '', message='Internal Server Error'))
+
+    def _rest_result(self, request, result):
+        ''' complete a request: fill its cache entry, send the response and release its admission slot '''
+        if request._cache:
+            (cache, key), request._cache = request._cache, None
+            entry = cache.complete(key, result)
+            if entry:
+                result = self._cached_result(cache, entry, request)
+        if not request._is_revalidate and not self.closed:
+            result.compress = request.compress
+            result.template = request.template
+            self.rest_response(result)
+        request._release()
+        if request._calls:
+            self._calling.discard(request)
+            request._calls = []
+        if request.span is not None and request.span.is_recording:
+            request.span.export('server', '%s %s' % (request.http_method, request.http_resource), request.t_start, time.time(), cid=request.id, code=result.code)
+
+    def _on_close(self):
+        super(RESTHandler, self)._on_close()
+        for request in list(self._calling):
+            if not request._cache:  # a cache fill has other requests waiting on it
+                request.cancel()  # nobody is waiting for the result
+        for request in list(self._admitted):
+            request._release()  # delayed requests which will never be responded to
+
     def on_rest_data(self, request, *groups):
         ''' called on rest_handler match '''
         pass
@@ -384,9 +566,51 @@ class RESTHandler(HTTPHandler):
     def on_rest_no_match(self):
         pass
 
+    def on_rest_shed(self):
+        ''' called before a 503 is sent for a request turned away by admission control '''
+        pass
+
+    def on_rest_limited(self):
+        ''' called before a 429 is sent for a request over its rate limit '''
+        pass
+
     def rest_response(self, result):
         result = RESTResult.coerce(result)
-        self._rest_send(result.content, result.code, result.message, result.headers, result.close)
+        content, headers = result.content, result.headers
+        if result.compress:
+            content, headers = self._compress(content, headers, *result.compress)
+        self._rest_send(content, result.code, result.message, headers, result.close, result.template)
+
+    def _compression(self, mapping):
+        ''' (encoding, level, threshold) if the mapping compresses; encoding is None if the client can't accept it '''
+        is_active = self.http_compress if mapping.compress is None else mapping.compress
+        if not is_active:
+            return None
+        encoding = accept_encoding(self.http_headers.get('accept-encoding'))
+        level = self.http_compress_level if mapping.compress_level is None else mapping.compress_level
+        threshold = self.http_compress_threshold if mapping.compress_threshold is None else mapping.compress_threshold
+        return encoding, level, threshold
+
+    @staticmethod
+    def _compress(content, headers, encoding, level, threshold):
+        headers = dict(headers) if headers else {}
+        vary = headers.get('Vary')
+        if not vary:
+            headers['Vary'] = 'Accept-Encoding'  # on every variant, compressed or not, for shared caches
+        elif 'accept-encoding' not in vary.lower():
+            headers['Vary'] = vary + ', Accept-Encoding'
+        if not encoding or not content or len(content) < threshold:
+            return content, headers
+        if 'Content-Encoding' in headers:
+            return content, headers
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+        compressed = compress(content, encoding, level)
+        COMPRESSION.responses += 1
+        COMPRESSION.bytes_in += len(content)
+        COMPRESSION.bytes_out += len(compressed)
+        headers['Content-Encoding'] = encoding
+        return compressed, headers
 
     def on_rest_exception(self, exception_type, exception_value, exception_traceback):
         ''' handle Exception raised during REST processing
@@ -403,12 +627,14 @@ class RESTHandler(HTTPHandler):
         '''
         return None
 
-    def _rest_send(self, content=None, code=200, message='OK', headers=None, close=False):
+    def _rest_send(self, content=None, code=200, message='OK', headers=None, close=False, template=None):
         args = dict(code=code, message=message, close=close)
         if content:
             args['content'] = content
         if headers:
             args['headers'] = headers
+        if template:
+            args['template'] = template
         self.on_rest_send(code, message, content, headers)
         self.send_server(**args)
 
@@ -417,6 +643,15 @@ class RESTHandler(HTTPHandler):
 
 
 class LoggingRESTHandler(RESTHandler):
+    '''
+        RESTHandler which logs connections, requests and errors.
+
+        If access_log is an AccessLog (see rhc.accesslog), each response is
+        recorded there instead, and the per-connection open, request and
+        close log lines are skipped. Errors are still logged.
+    '''
+
+    access_log = None
 
     def __init__(self, socket, context):
         super(LoggingRESTHandler, self).__init__(socket, context)
@@ -431,7 +666,7 @@ class LoggingRESTHandler(RESTHandler):
         log.info('open: cid=%d, %s', self.id, self.name)
 
     def on_close(self):
-        if self._silent:
+        if self._silent or self.access_log is not None:
             return
         self._log_open()
         log.info(
@@ -444,7 +679,7 @@ class LoggingRESTHandler(RESTHandler):
         )
 
     def on_rest_data(self, request, *groups):
-        if self._silent:
+        if self._silent or self.access_log is not None:
             return
         self._log_open()
         log.info(
@@ -457,6 +692,9 @@ class LoggingRESTHandler(RESTHandler):
         )
 
     def on_rest_send(self, code, message, content, headers):
+        if self.access_log is not None:
+            self.access_log.add(self, code, content, self._silent)
+            return
         if self._silent:
             return
         log.debug(
@@ -476,6 +714,24 @@ class LoggingRESTHandler(RESTHandler):
             self.http_resource
         )
 
+    def on_rest_shed(self):
+        self._log_open()
+        log.warning(
+            'shed cid=%d, method=%s, resource=%s',
+            self.id,
+            self.http_method,
+            self.http_resource
+        )
+
+    def on_rest_limited(self):
+        self._log_open()
+        log.warning(
+            'rate limited cid=%d, method=%s, resource=%s',
+            self.id,
+            self.http_method,
+            self.http_resource
+        )
+
     def on_http_error(self):
         log.warning('http error cid=%d: %s', self.id, self.error)
 
@@ -509,7 +765,9 @@ class RESTMapper(object):
         pass
 
     def add(self, pattern, get=None, post=None, put=None, delete=None,
-            silent=False):
+            silent=False, compress=None, compress_level=None,
+            compress_threshold=None, headers=None, admission=None,
+            rate_limit=None, cache=None, deadline=None):
         '''
             Add a mapping between a URI and a CRUD method.
 
@@ -534,9 +792,56 @@ class RESTMapper(object):
 
                 in this case, my_func must be defined to take the
                 parameter.
+
+            The compress arguments override the RESTHandler's http_compress
+            settings for this mapping; None means use the handler's value.
+
+            The headers argument is a dict of static headers added to every
+            response from this mapping. They are serialized once, here, and
+            are overridden by any same-named header in a RESTResult.
+
+            The admission argument is an AdmissionController, and the
+            rate_limit argument a RateLimiter, for requests matching this
+            mapping; they are used instead of the RESTHandler's
+            http_admission and http_rate_limit.
+
+            The cache argument is a ResponseCache for GET requests matching
+            this mapping.
+
+            The deadline argument is the number of seconds a request matching
+            this mapping has to complete (see rhc.task.Deadline); a shorter
+            X-Request-Timeout header from the client takes precedence.
+
+            A method may be a function, a dotted path to one (imported
+            here), or a LazyHandler (imported on first use).
+
+            The new RESTMapping is returned.
         '''
-        self.__mapping.append(RESTMapping(pattern, get, post, put, delete,
-                                          silent))
+        return self.add_mapping(RESTMapping(pattern, get, post, put, delete,
+                                            silent, compress, compress_level,
+                                            compress_threshold, headers,
+                                            admission, rate_limit, cache,
+                                            deadline))
+
+    def add_mapping(self, mapping):
+        ''' add an existing RESTMapping (for instance, one from another RESTMapper) '''
+        self.__mapping.append(mapping)
+        return mapping
+
+    @property
+    def mappings(self):
+        return list(self.__mapping)
+
+    def update(self, mapper):
+        '''
+            Take the context and mappings of another RESTMapper.
+
+            The change is atomic: a request is matched against either the
+            old mappings or the new ones, never a mix. Requests already
+            matched are not affected.
+        '''
+        self.context = mapper.context
+        self.__mapping = mapper.__mapping
 
     def _match(self, resource, method):
         '''
@@ -552,13 +857,20 @@ class RESTMapper(object):
             and look for a match on the regex which also has a method
             defined.
         '''
+        mapping, handler, groups = self._find(resource, method)
+        if mapping:
+            return handler, groups, mapping.silent
+        return None, None, False
+
+    def _find(self, resource, method):
+        ''' like _match, but return (RESTMapping, handler, groups) '''
         for mapping in self.__mapping:
             m = mapping.pattern.match(resource)
             if m:
                 handler = mapping.method.get(method.lower())
                 if handler:
-                    return handler, m.groups(), mapping.silent
-        return None, None, False
+                    return mapping, handler, m.groups()
+        return None, None, None
 
 
 def import_by_pathname(target):
@@ -571,11 +883,55 @@ def import_by_pathname(target):
     return target
 
 
+class LazyHandler(object):
+
+    '''
+        rest_handler named by a dotted path, which is imported the first time
+        it is called (or loaded), so that modules for rarely used routes don't
+        slow down startup.
+
+        If the import fails, the error is logged and every call responds with
+        a 500.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._handler = None
+        self._error = None
+
+    def __repr__(self):
+        return 'LazyHandler[%s, loaded=%s]' % (self.path, self.is_loaded)
+
+    @property
+    def is_loaded(self):
+        ''' True if the import has been tried '''
+        return self._handler is not None or self._error is not None
+
+    def load(self):
+        ''' import the handler (once); returns False if the import failed '''
+        if not self.is_loaded:
+            try:
+                self._handler = import_by_pathname(self.path)
+            except Exception as e:
+                self._error = '%s: %s' % (e.__class__.__name__, e)
+                log.exception('unable to import rest_handler %s', self.path)
+        return self._handler is not None
+
+    def __call__(self, request, *groups):
+        if not self.load():
+            log.error('rest_handler %s unavailable (%s)', self.path, self._error)
+            return RESTResult(500, 'unable to load handler for this resource\n', message='Internal Server Error')
+        return self._handler(request, *groups)
+
+
 class RESTMapping(object):
 
     ''' container for one mapping definition '''
 
-    def __init__(self, pattern, get, post, put, delete, silent):
+    def __init__(self, pattern, get, post, put, delete, silent,
+                 compress=None, compress_level=None, compress_threshold=None,
+                 headers=None, admission=None, rate_limit=None, cache=None,
+                 deadline=None):
         self.pattern = re.compile(pattern)
         self.method = {
             'get': import_by_pathname(get),
@@ -584,6 +940,14 @@ class RESTMapping(object):
             'delete': import_by_pathname(delete),
         }
         self.silent = silent
+        self.compress = compress
+        self.compress_level = compress_level
+        self.compress_threshold = compress_threshold
+        self.template = HeaderTemplate(headers) if headers else None
+        self.admission = admission
+        self.rate_limit = rate_limit
+        self.cache = cache
+        self.deadline = deadline
 
 
 def content_to_json(*fields, **kwargs):
@@ -0,0 +1,27 @@
+class Stats(object):
+    '''
+        A named set of counters.
+
+        Counters are plain attributes, so updating one costs no more than
+        updating any other attribute:
+
+            stats = Stats('accepted', 'closed')
+            stats.accepted += 1
+
+        Use as_dict to take a snapshot, for instance to report on a status
+        endpoint or to log periodically.
+    '''
+
+    def __init__(self, *names):
+        self._names = names
+        self.reset()
+
+    def __repr__(self):
+        return 'Stats[%s]' % ', '.join('%s=%s' % (n, getattr(self, n)) for n in self._names)
+
+    def reset(self):
+        for name in self._names:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self._names}
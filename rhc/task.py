@@ -22,17 +22,102 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
 
+import contextlib
 import inspect
+import math
+import time
+
+from rhc.timer import TIMERS
+from rhc.tracing import current_span, span_scope
+
 import logging
 log = logging.getLogger(__name__)
 
 
+DEADLINE_HEADER = 'X-Request-Timeout'  # seconds remaining until a request's deadline
+
+_deadlines = []  # stack of deadlines for the code that is currently running
+
+
+class Deadline(object):
+    '''
+        The time by which some work (usually a REST request) must be done.
+
+        While a Task or RESTRequest with a deadline is running code (calling
+        an async function, or handling its result), that deadline is the
+        current_deadline. Async functions use it to limit how long they
+        take: async.Connection resources cap their timeout at the time
+        remaining, send it in an X-Request-Timeout header, and fail with
+        'timeout' once it has passed. Task.call fails the same way instead
+        of calling a function after the deadline.
+    '''
+
+    def __init__(self, timeout):
+        self.expires = time.time() + timeout
+
+    def __repr__(self):
+        return 'Deadline[remaining=%.3f]' % self.remaining
+
+    @classmethod
+    def from_header(cls, value, timeout=None):
+        '''
+            Deadline from an X-Request-Timeout header value (or None),
+            limited to timeout seconds (if specified)
+        '''
+        if value:
+            try:
+                value = float(value)
+                if math.isnan(value) or math.isinf(value) or value <= 0:
+                    raise ValueError('not a positive number of seconds')
+            except ValueError:
+                log.warning('invalid %s header: %s', DEADLINE_HEADER, value)
+            else:
+                timeout = value if timeout is None else min(value, timeout)
+        return cls(timeout) if timeout is not None else None
+
+    @property
+    def remaining(self):
+        return max(0.0, self.expires - time.time())
+
+    @property
+    def is_expired(self):
+        return time.time() >= self.expires
+
+    @property
+    def header(self):
+        return '%.3f' % self.remaining
+
+
+def is_cancellable(handle):
+    ''' True if handle is an unfinished async call that can be cancelled '''
+    return hasattr(handle, 'cancel') and not getattr(handle, 'is_done', True)
+
+
+def current_deadline():
+    ''' Deadline of the running Task or RESTRequest (or None) '''
+    return _deadlines[-1] if _deadlines else None
+
+
+@contextlib.contextmanager
+def deadline_scope(deadline):
+    ''' make deadline the current_deadline for the duration of a with block '''
+    _deadlines.append(deadline)
+    try:
+        yield
+    finally:
+        _deadlines.pop()
+
+
 class Task(object):
 
-    def __init__(self, callback, cid=None):
+    def __init__(self, callback, cid=None, deadline=None, span=None):
         self._callback = [callback]
         self.cid = cid
         self.final = None  # callable executed before callback (error or success)
+        self.deadline = deadline if deadline is not None else current_deadline()
+        self.span = span if span is not None else current_span()  # rhc.tracing.SpanContext
+        self.is_cancelled = False
+        self._calls = []  # handles of async calls in progress (see cancel)
 
     @property
     def callback(self):
@@ -42,7 +127,15 @@ class Task(object):
 
     @property
     def is_done(self):
-        return len(self._callback) == 0
+        return self.is_cancelled or len(self._callback) == 0
+
+    def cancel(self):
+        ''' cancel the async calls in progress, and ignore any further results '''
+        self.is_cancelled = True
+        calls, self._calls = self._calls, []
+        for handle in calls:
+            if not handle.is_done:
+                handle.cancel()
 
     def on_done(self):
         if self.final:
@@ -96,6 +189,13 @@ class Task(object):
             2. If the first parameter of fn (from inspection) is named 'task',
                then an rhc.Task object is passed instead of a callable.
 
+            3. If the task's deadline has passed, fn is not called; instead,
+               the call fails with the result 'timeout'.
+
+            4. If fn returns a handle with is_done and cancel (for instance,
+               from an async.Connection resource) it is cancelled by the
+               task's cancel method.
+
         Example:
 
             def on_load(task, result):
@@ -112,10 +212,18 @@ class Task(object):
         """
 
         def cb(rc, result):
-            if rc == 0:
-                _callback(self, fn, result, on_success, on_none)
-            else:
-                _callback_error(self, fn, result, on_error, on_timeout)
+            if self.is_cancelled:
+                return
+            with deadline_scope(self.deadline), span_scope(self.span):
+                if rc == 0:
+                    _callback(self, fn, result, on_success, on_none)
+                else:
+                    _callback_error(self, fn, result, on_error, on_timeout)
+
+        if self.deadline is not None and self.deadline.is_expired:
+            log.debug('task.call cid=%s fn=%s deadline expired', self.cid, fn)
+            cb(1, 'timeout')
+            return self
 
         if args is None:
             args = ()
@@ -134,9 +242,28 @@ class Task(object):
 
         log.debug('task.call cid=%s fn=%s %s', self.cid, fn,
                   'as task' if has_task else '')
-        fn(callback, *args, **kwargs)
+        with deadline_scope(self.deadline), span_scope(self.span):
+            handle = fn(callback, *args, **kwargs)
+        if handle is not self and is_cancellable(handle):
+            self._calls = [h for h in self._calls if not h.is_done]
+            self._calls.append(handle)
         return self
 
+    def gather(self, calls, limit=0, quorum=None, timeout=None, on_success=None, on_error=None, on_timeout=None):
+        """ Call async functions concurrently (see the gather function).
+
+        The on_success, on_error and on_timeout parameters are handled as they
+        are by the call method.
+        """
+        return self.call(
+            gather,
+            args=(calls,),
+            kwargs=dict(limit=limit, quorum=quorum, timeout=timeout),
+            on_success=on_success,
+            on_error=on_error,
+            on_timeout=on_timeout,
+        )
+
     def defer(self, task_cmd, partial_callback, final_fn=None):
         # DEPRECATED: use call
         ''' defer the task until partial_callback completes; then call task_cmd
@@ -183,6 +310,153 @@ class Task(object):
         self.callback(rc, result)
 
 
+def gather(callback, calls, limit=0, quorum=None, timeout=None):
+    """ Run async functions concurrently, and aggregate the results.
+
+    Parameters:
+        callback - callable(rc, result), called once when the gather is done
+
+        calls - list of async functions, each taking only a callback
+                (use functools.partial, or an async.partial, to supply args)
+
+        limit - maximum number of calls in progress at once (0 = no limit)
+
+        quorum - number of successful calls needed (None = all calls)
+
+        timeout - seconds to wait before giving up (None = no limit)
+
+    Result:
+
+        On completion, callback is called with:
+
+            rc - 0 if quorum calls succeeded, otherwise 1
+            result - list of (rc, result) for each call, in the order of calls;
+                     calls that didn't finish, or didn't start, are None
+
+        or with (1, 'timeout') if the timeout expires.
+
+        Once the outcome is known (quorum reached, or no longer possible)
+        no more calls are started, the timeout is cancelled, and calls
+        still in progress are cancelled (if they return a cancellable
+        handle; see Task.call) or their results ignored.
+
+    Notes:
+
+        1. gather is itself an async function, so it can be used with
+           Task.call or RESTRequest.call:
+
+               request.call(gather, args=[calls], kwargs=dict(limit=10),
+                            on_success=on_gathered)
+
+    Returns a Gather (is_done is True on completion; cancel stops it).
+    """
+    g = Gather(callback, calls, limit, quorum, timeout)
+    g.start()
+    return g
+
+
+def first_success(callback, calls, limit=0, timeout=None):
+    """ Run async functions concurrently until one succeeds.
+
+    Like gather with a quorum of one, except that on success callback is
+    called with (0, result) of the first call to succeed.
+    """
+    def on_gather(rc, result):
+        if rc == 0:
+            result = next(r for r in result if r is not None and r[0] == 0)[1]
+        callback(rc, result)
+    return gather(on_gather, calls, limit, 1, timeout)
+
+
+class Gather(object):
+
+    def __init__(self, callback, calls, limit, quorum, timeout):
+        self.callback = callback
+        self.calls = list(calls)
+        self.limit = limit
+        self.quorum = len(self.calls) if quorum is None else quorum
+        self.results = [None] * len(self.calls)
+        self.is_done = False
+        self.in_progress = 0
+        self._handles = {}  # index -> cancellable handle of a call in progress
+        self._next = 0
+        self._success = 0
+        self._failure = 0
+        self._is_starting = False
+        self._timer = TIMERS.add(self._on_timeout, timeout * 1000).start() if timeout else None
+
+    def start(self):
+        if not self._check():
+            self._start_calls()
+
+    def _start_calls(self):
+        if self._is_starting:
+            return  # a call completed immediately; the loop below carries on
+        self._is_starting = True
+        try:
+            while not self.is_done and self._next < len(self.calls) and (not self.limit or self.in_progress < self.limit):
+                index = self._next
+                self._next += 1
+                self.in_progress += 1
+                try:
+                    handle = self.calls[index](self._on_result(index))
+                    if self.results[index] is None and is_cancellable(handle):
+                        self._handles[index] = handle
+                except Exception as e:
+                    log.exception('gather call failed to start')
+                    self._result(index, 1, str(e))
+        finally:
+            self._is_starting = False
+
+    def _on_result(self, index):
+        def cb(rc, result):
+            self._result(index, rc, result)
+        return cb
+
+    def _result(self, index, rc, result):
+        if self.is_done or self.results[index] is not None:
+            return
+        self.in_progress -= 1
+        self._handles.pop(index, None)
+        self.results[index] = (rc, result)
+        if rc == 0:
+            self._success += 1
+        else:
+            self._failure += 1
+        if not self._check():
+            self._start_calls()
+
+    def _check(self):
+        ''' finish if the outcome is known '''
+        if self._success >= self.quorum:
+            self._done(0, self.results)
+        elif self._failure > len(self.calls) - self.quorum:
+            self._done(1, self.results)
+        return self.is_done
+
+    def _on_timeout(self):
+        if not self.is_done:
+            self._done(1, 'timeout')
+
+    def cancel(self):
+        ''' stop without calling callback '''
+        if not self.is_done:
+            self._stop()
+
+    def _stop(self):
+        self.is_done = True
+        if self._timer:
+            self._timer.cancel()
+        handles, self._handles = self._handles, {}
+        for handle in handles.values():
+            if not handle.is_done:
+                handle.cancel()
+
+    def _done(self, rc, result):
+        self._stop()
+        self.callback(rc, result)
+
+
 def unpartial(partial):
     """ turn a partial into a callback_fn
 
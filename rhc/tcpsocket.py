@@ -21,17 +21,35 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 '''
+import collections
 import errno
+import fcntl
 import os
 import select
 import socket
 import ssl as ssl_library
 import time
 
+from rhc.stats import Stats
+from rhc.timer import TIMERS
+
 
 EVENT_READ = select.POLLIN | select.POLLPRI
 EVENT_WRITE = select.POLLOUT
 
+OP_NO_TICKET = getattr(ssl_library, 'OP_NO_TICKET', 0x4000)  # not exposed before python 3.6
+HAS_SSL_SESSION = hasattr(ssl_library, 'SSLSession')
+
+LISTEN_FDS = 'RHC_LISTEN_FDS'  # environment variable naming listening sockets inherited from a parent (port:fd,...)
+
+
+def inherited_fds(environ=None):
+    ''' {port: fd} of the listening sockets handed to this process (see Server.handoff_fds) '''
+    value = (os.environ if environ is None else environ).get(LISTEN_FDS)
+    if not value:
+        return {}
+    return dict((int(port), int(fd)) for port, fd in (item.split(':') for item in value.split(',')))
+
 
 class Server(object):
 
@@ -47,43 +65,127 @@ class Server(object):
       allocated for each connection. An optional context is also permitted, one
       context shared for every socket on a listener, and one unshared context
       for each outbound connection.
+
+      SSL contexts are cached and shared by every connection with the same
+      certificate and verification settings; client sessions are cached by
+      (host, port) and offered on the next connection to the same peer
+      (python versions with ssl.SSLSession only). Counters describing the
+      cost of ssl setup are kept in ssl_stats.
+
+      Connection counters (accepts, connects, failures, bytes in and out)
+      are kept in stats, and outlive the handlers which update them; the
+      number of open connections is kept for each listening port and for
+      outbound connections, and close reasons are counted in close_reasons.
+      connection_stats returns a snapshot of all of them.
+
+      A burst of inbound ssl connections can be throttled by setting
+      max_handshakes: handshakes beyond the limit wait in a queue until an
+      in-progress handshake finishes. During each call to service, sockets
+      with established connections are handled before sockets which are
+      still handshaking. If handshake_timeout is set, a connection which
+      does not complete the handshake (including time spent in the queue)
+      in that many seconds is closed; TIMERS must be serviced for this to
+      work.
+
+      Sockets which are ready at the same time are serviced in a rotating
+      order, so that no socket is always first. A handler which has more
+      work than it should do in one turn can use _set_deferred to continue
+      on the next turn, after every other ready socket has been serviced.
+
+      To shut down without dropping requests, call drain: listeners stop
+      accepting connections and each inbound connection is asked to close
+      once it is idle (see BasicHandler.on_drain); keep calling service
+      until is_drained. To restart without refusing connections, start
+      the new process with the value of handoff_fds in its RHC_LISTEN_FDS
+      environment variable, keeping those fds (and no others) open in it
+      (see micro.hand_off): its add_server uses the inherited listening
+      socket for the same port instead of binding a new one. Connections
+      queued on the listener are accepted by the new process once the old
+      one drains, and the old one finishes its open connections.
     '''
     def __init__(self):
         self._poll_map = {}
         self._poll = select.poll()
         self._id = 0
+        self._ssl_contexts = {}
+        self._ssl_sessions = {}
+        self.ssl_stats = Stats(
+            'context_created',
+            'context_reused',
+            'handshake',
+            'handshake_failed',
+            'handshake_time',
+            'session_reused',
+            'handshake_queued',
+            'handshake_timeout',
+        )
+        self.stats = Stats(
+            'accepted',
+            'accept_failed',
+            'connected',
+            'connect_failed',
+            'closed',
+            'bytes_in',
+            'bytes_out',
+            'eintr',
+            'ewouldblock',
+        )
+        self.open_connections = collections.Counter()  # listening port or 'outbound': count
+        self.close_reasons = collections.Counter()
+        self.max_handshakes = 0  # limit on concurrent inbound handshakes (0 = no limit)
+        self.handshake_timeout = 0  # seconds (0 = no limit)
+        self._handshaking = {}  # fileno: handler
+        self._inbound_handshakes = 0
+        self._handshake_queue = collections.deque()
+        self._is_starting_handshakes = False
+        self._pending = []
+        self._deferred = []
+        self._turn = 0
+        self._listeners = []
+        self._inbound = set()  # open inbound handlers
+        self._inherited = inherited_fds()
 
     @property
     def next_id(self):
         self._id += 1
         return self._id
 
-    def add_server(self, port, handler, context=None, ssl=None, ssl_certfile=None, ssl_keyfile=None):
+    def add_server(self, port, handler, context=None, ssl=None, ssl_certfile=None, ssl_keyfile=None, ssl_tickets=True):
         '''
           Start a listening socket.
 
           Parameters:
-            port    - listening port
-            handler - name of handler class (subclass of BasicHandler)
-            context - optional context associated with this listener
-            ssl     - optional SSLParam, if this exists the keyfile and
-                      certfile are the only values respected.
+            port        - listening port
+            handler     - name of handler class (subclass of BasicHandler)
+            context     - optional context associated with this listener
+            ssl         - optional SSLParam, if this exists the keyfile and
+                          certfile are the only values respected.
+            ssl_tickets - if False, don't issue session tickets; clients
+                          can still resume using the server's session
+                          cache.
         '''
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('', port))
+        if port in self._inherited:
+            fd = self._inherited.pop(port)
+            s = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)  # already bound and listening
+            os.close(fd)  # fromfd made a copy
+        else:
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(('', port))
+            s.listen(100)
         s.setblocking(False)
-        s.listen(100)
         if ssl:
-            ssl_ctx = ssl_library.create_default_context(purpose=ssl_library.Purpose.CLIENT_AUTH)
+            certfile, keyfile = None, None
             if isinstance(ssl, SSLParam) and ssl.certfile:
-                ssl_ctx.load_cert_chain(ssl.certfile, ssl.keyfile)
+                certfile, keyfile = ssl.certfile, ssl.keyfile
             if ssl_certfile:
-                ssl_ctx.load_cert_chain(ssl_certfile, ssl_keyfile)
+                certfile, keyfile = ssl_certfile, ssl_keyfile
+            ssl_ctx = self._server_ssl_context(certfile, keyfile, ssl_tickets)
         else:
             ssl_ctx = None
-        l = Listener(s, self, context=context, handler=handler, ssl_ctx=ssl_ctx)
+        l = Listener(s, self, context=context, handler=handler, ssl_ctx=ssl_ctx, port=port)
         self._register(s, EVENT_READ, l._do_accept)
+        self._listeners.append(l)
         return l
 
     def add_connection(self, address, handler, context=None, ssl=None, certfile=None, cafile=None):
@@ -105,16 +207,12 @@ class Server(object):
         h.name = '%s:%s' % address
         h.host = address[0]
         h.id = self.next_id
+        h._open_key = 'outbound'
+        self.open_connections['outbound'] += 1
+        self.stats.connected += 1
         if ssl:
-            ssl_ctx = ssl_library.create_default_context()  # ignore the SSLParams, and make our own context
-            ssl_ctx.check_hostname = False
-            if certfile is not None:
-                ssl_ctx.load_cert_chain(certfile)
-            if cafile is not None:
-                ssl_ctx.load_verify_locations(cafile)
-            else:
-                ssl_ctx.verify_mode = ssl_library.CERT_NONE
-            h._ssl_ctx = ssl_ctx
+            h._ssl_ctx = self._client_ssl_context(certfile, cafile)  # ignore the SSLParams, and use our own context
+            h._ssl_session_key = address
         h.after_init()
         try:
             s.connect(address)
@@ -123,6 +221,7 @@ class Server(object):
             if errno.EINPROGRESS == error:
                 self._register(s, EVENT_WRITE, h._on_delayed_connect)
             else:
+                self.stats.connect_failed += 1
                 h.on_fail()
                 h.close_reason = 'failed to setup connection: %s' % errmsg
                 h.close()
@@ -158,12 +257,172 @@ class Server(object):
                     break
         return did_anything
 
+    @property
+    def handshake_queue_depth(self):
+        return len(self._handshake_queue)
+
+    @property
+    def handshakes_in_progress(self):
+        return len(self._handshaking)
+
+    def ssl_session_stats(self):
+        '''
+          Sum of the openssl session statistics (see
+          SSLContext.session_stats) for all cached contexts; 'hits' counts
+          resumed sessions.
+        '''
+        result = {}
+        for ctx in self._ssl_contexts.values():
+            for name, value in ctx.session_stats().items():
+                result[name] = result.get(name, 0) + value
+        return result
+
+    def connection_stats(self):
+        '''
+          Snapshot of the connection counters, suitable for a status
+          endpoint. Close reasons are counted without any detail following
+          a ':' (for instance, the errno message of a recv error).
+        '''
+        result = self.stats.as_dict()
+        result['open'] = dict(
+            inbound={port: count for port, count in self.open_connections.items() if port != 'outbound'},
+            outbound=self.open_connections['outbound'],
+        )
+        result['close_reasons'] = dict(self.close_reasons)
+        result['ssl'] = self.ssl_stats.as_dict()
+        result['ssl']['handshakes_in_progress'] = self.handshakes_in_progress
+        return result
+
+    def drain(self):
+        '''
+          Stop accepting connections, and ask each open inbound connection
+          to close when it is idle. Outbound connections are not affected.
+        '''
+        for listener in list(self._listeners):
+            listener.close()
+        for handler in list(self._inbound):
+            handler.on_drain()
+
+    @property
+    def inbound_count(self):
+        ''' number of open inbound connections '''
+        return len(self._inbound)
+
+    @property
+    def is_drained(self):
+        return self.inbound_count == 0
+
+    def handoff_fds(self):
+        '''
+          Listening sockets as a RHC_LISTEN_FDS value, for a new process
+          which takes over from this one. The sockets are made inheritable.
+        '''
+        result = []
+        for listener in self._listeners:
+            fd = listener.socket.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags & ~fcntl.FD_CLOEXEC)
+            result.append('%s:%s' % (listener.port, fd))
+        return ','.join(result)
+
+    def _on_closed(self, handler):
+        self.stats.closed += 1
+        self.open_connections[handler._open_key] -= 1
+        self._inbound.discard(handler)
+        reason = handler.close_reason or 'unspecified'
+        self.close_reasons[reason.split(':', 1)[0]] += 1
+
+    def _client_ssl_context(self, certfile, cafile):
+        verify_mode = ssl_library.CERT_NONE if cafile is None else ssl_library.CERT_REQUIRED
+        key = ('client', certfile, cafile, verify_mode)
+        ssl_ctx = self._ssl_contexts.get(key)
+        if ssl_ctx:
+            self.ssl_stats.context_reused += 1
+            return ssl_ctx
+        ssl_ctx = ssl_library.create_default_context()
+        ssl_ctx.check_hostname = False
+        if certfile is not None:
+            ssl_ctx.load_cert_chain(certfile)
+        if cafile is not None:
+            ssl_ctx.load_verify_locations(cafile)
+        ssl_ctx.verify_mode = verify_mode
+        self.ssl_stats.context_created += 1
+        self._ssl_contexts[key] = ssl_ctx
+        return ssl_ctx
+
+    def _server_ssl_context(self, certfile, keyfile, tickets):
+        key = ('server', certfile, keyfile, tickets)
+        ssl_ctx = self._ssl_contexts.get(key)
+        if ssl_ctx:
+            self.ssl_stats.context_reused += 1
+            return ssl_ctx
+        ssl_ctx = ssl_library.create_default_context(purpose=ssl_library.Purpose.CLIENT_AUTH)
+        if certfile:
+            ssl_ctx.load_cert_chain(certfile, keyfile)
+        if not tickets:
+            ssl_ctx.options |= OP_NO_TICKET
+        self.ssl_stats.context_created += 1
+        self._ssl_contexts[key] = ssl_ctx
+        return ssl_ctx
+
+    def _start_handshake(self, handler):
+        handler._is_handshaking = True
+        if self.handshake_timeout:
+            handler._handshake_timer = TIMERS.add(handler._on_handshake_timeout, self.handshake_timeout * 1000.0).start()
+        if handler._incoming and self.max_handshakes and self._inbound_handshakes >= self.max_handshakes:
+            self.ssl_stats.handshake_queued += 1
+            self._handshake_queue.append(handler)
+        else:
+            self.__handshake(handler)
+
+    def __handshake(self, handler):
+        if handler._incoming:
+            self._inbound_handshakes += 1
+        self._handshaking[handler._sock.fileno()] = handler
+        handler._do_handshake()
+
+    def _end_handshake(self, handler):
+        handler._is_handshaking = False
+        if handler._handshake_timer:
+            handler._handshake_timer.cancel()
+            handler._handshake_timer = None
+        for fileno, h in self._handshaking.items():
+            if h is handler:
+                del self._handshaking[fileno]
+                if handler._incoming:
+                    self._inbound_handshakes -= 1
+                break
+        else:
+            try:
+                self._handshake_queue.remove(handler)
+            except ValueError:
+                pass
+        if self._is_starting_handshakes:
+            return  # a handshake that ended at once; the loop below carries on
+        self._is_starting_handshakes = True
+        try:
+            while self._handshake_queue and self._inbound_handshakes < self.max_handshakes:
+                self.__handshake(self._handshake_queue.popleft())
+        finally:
+            self._is_starting_handshakes = False
+
+    def _get_ssl_session(self, key):
+        return self._ssl_sessions.get(key)
+
+    def _set_ssl_session(self, key, session):
+        if session is not None:
+            self._ssl_sessions[key] = session
+
     def close(self):
-        for _, sock in self._poll_map.values():
+        self._listeners = []
+        self._inbound = set()
+        for fileno, (_, sock) in self._poll_map.items():
+            self._poll.unregister(fileno)
             try:
                 sock.close()
             except Exception:
                 pass
+        self._poll_map = {}
 
     def _register(self, sock, mask, callback):
         fileno = sock.fileno()
@@ -180,15 +439,45 @@ class Server(object):
             del self._poll_map[sock]
 
     def _set_pending(self, callback):
+        ''' run callback at the end of the current turn '''
         self._pending.append(callback)
 
+    def _set_deferred(self, callback):
+        ''' run callback on the next turn, after the ready sockets '''
+        self._deferred.append(callback)
+
     def _service(self, timeout):
         processed = False
         self._pending = []
+        handshaking = []
+        deferred, self._deferred = self._deferred, []
+        if deferred:
+            processed = True
+            timeout = 0  # work is waiting, don't block
 
-        for sock, _ in self._poll.poll(timeout * 1000):
+        try:
+            ready = self._poll.poll(timeout * 1000)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            ready = []  # interrupted by a signal
+        if len(ready) > 1:
+            self._turn = (self._turn + 1) % len(ready)
+            ready = ready[self._turn:] + ready[:self._turn]
+
+        for sock, _ in ready:
             processed = True
-            self._poll_map[sock][0]()
+            if sock in self._handshaking:
+                handshaking.append(sock)  # established connections first
+            else:
+                self._poll_map[sock][0]()
+
+        for sock in handshaking:
+            if sock in self._poll_map:  # could have been closed by an earlier callback
+                self._poll_map[sock][0]()
+
+        for callback in deferred:
+            callback()
 
         for callback in self._pending:
             callback()
@@ -246,7 +535,11 @@ class BasicHandler(object):
         self._sock = socket
         self._incoming = True
         self._ssl_ctx = None
+        self._ssl_session_key = None
+        self._is_handshaking = False
+        self._handshake_timer = None
         self._network = None
+        self._open_key = None  # key in Server.open_connections
 
         self.name = 'BasicHandler::init'
         self.host = None
@@ -261,6 +554,7 @@ class BasicHandler(object):
         self.t_open = 0
         self.t_ready = 0
         self.t_close = 0
+        self.t_handshake = 0
 
         self.on_init()
 
@@ -274,11 +568,15 @@ class BasicHandler(object):
         if not self.closed:
             self.t_close = time.time()
             self.closed = True
+            if self._is_handshaking:
+                self._network._end_handshake(self)
             self._network._unregister(self._sock)
             if self._sock:
                 self._sock.close()
             if reason:
                 self.close_reason = reason
+            if self._open_key is not None:
+                self._network._on_closed(self)
             self._on_close()  # for libraries
             self.on_close()
 
@@ -387,6 +685,13 @@ class BasicHandler(object):
         '''
         pass
 
+    def on_drain(self):
+        '''
+          Called when the server is draining (see Server.drain); close the
+          connection when it has nothing more to do.
+        '''
+        self.close('server draining')
+
     def on_close(self):
         '''
           Called when the socket is closed.
@@ -443,6 +748,7 @@ class BasicHandler(object):
             self._on_connect()
         else:
             self.close_reason = 'failed to connect'
+            self._network.stats.connect_failed += 1
             self.on_fail()
             self.close()
 
@@ -452,13 +758,17 @@ class BasicHandler(object):
         self.on_open()
         self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # bye bye NAGLE
         if self._ssl_ctx:
+            self.t_handshake = time.time()
+            kwargs = dict(server_side=self._incoming, do_handshake_on_connect=False)
+            if HAS_SSL_SESSION and self._ssl_session_key:
+                kwargs['session'] = self._network._get_ssl_session(self._ssl_session_key)
             try:
-                self._sock = self._ssl_ctx.wrap_socket(self._sock, server_side=self._incoming, do_handshake_on_connect=False)
+                self._sock = self._ssl_ctx.wrap_socket(self._sock, **kwargs)
             except Exception as e:
                 self.close_reason = str(e)
                 self.close()
             else:
-                self._do_handshake()
+                self._network._start_handshake(self)
         else:
             self._on_ready()
 
@@ -470,10 +780,19 @@ class BasicHandler(object):
         except ssl_library.SSLWantWriteError:
             self._network._register(self._sock, EVENT_WRITE, self._do_handshake)
         except Exception as e:
+            self._network.ssl_stats.handshake_failed += 1
             self.on_failed_handshake(str(e))
             self.close_reason = 'failed ssl handshake'
             self.close()
         else:
+            self._network._end_handshake(self)
+            stats = self._network.ssl_stats
+            stats.handshake += 1
+            stats.handshake_time += time.time() - self.t_handshake
+            if HAS_SSL_SESSION and self._ssl_session_key:
+                if self._sock.session_reused:
+                    stats.session_reused += 1
+                self._network._set_ssl_session(self._ssl_session_key, self._sock.session)
             self.peer_cert = self._sock.getpeercert()
             if not self.on_handshake(self.peer_cert):
                 self.close_reason = 'failed ssl certificate check'
@@ -481,6 +800,12 @@ class BasicHandler(object):
                 return
             self._on_ready()
 
+    def _on_handshake_timeout(self):
+        self._handshake_timer = None
+        self._network.ssl_stats.handshake_timeout += 1
+        self.on_failed_handshake('ssl handshake timeout')
+        self.close('ssl handshake timeout')
+
     def _on_ready(self):
         self.t_ready = time.time()
         self._network._register(self._sock, EVENT_READ, self._do_read)
@@ -514,6 +839,7 @@ class BasicHandler(object):
             else:
                 self._network._register(self._sock, EVENT_READ, self._do_read)
                 self.rxByteCount += len(data)
+                self._network.stats.bytes_in += len(data)
                 self.on_data(data)
                 if self._is_pending:
                     self._network._set_pending(self._do_read)  # give buffered ssl data another chance
@@ -535,6 +861,12 @@ class BasicHandler(object):
         except socket.error as e:
             errnum, errmsg = e
             if errnum in (errno.EINTR, errno.EWOULDBLOCK):
+                if errnum == errno.EINTR:
+                    self.EINTR_cnt += 1
+                    self._network.stats.eintr += 1
+                else:
+                    self.EWOULDBLOCK_cnt += 1
+                    self._network.stats.ewouldblock += 1
                 self.error = errmsg
                 self.on_send_error()  # not fatal
                 self._sending = data
@@ -545,6 +877,7 @@ class BasicHandler(object):
             self.close('send error on socket: %s' % str(e))
         else:
             self.txByteCount += l
+            self._network.stats.bytes_out += l
             if l == len(data):
                 self._network._register(self._sock, EVENT_READ, self._do_read)
                 self.on_send_complete()
@@ -563,8 +896,9 @@ class BasicHandler(object):
 
 class Listener(object):
 
-    def __init__(self, socket, server, handler, context=None, ssl_ctx=None):
+    def __init__(self, socket, server, handler, context=None, ssl_ctx=None, port=None):
         self.socket = socket
+        self.port = port
         self.network = server
         self.handler = handler
         self.context = context
@@ -578,14 +912,24 @@ class Listener(object):
         '''
         self.network._unregister(self.socket)
         self.socket.close()
+        if self in self.network._listeners:
+            self.network._listeners.remove(self)
 
     def _do_accept(self):
-        s, _ = self.socket.accept()
+        try:
+            s, _ = self.socket.accept()
+        except socket.error:
+            self.network.stats.accept_failed += 1  # eg. EMFILE, or the client went away
+            return
         s.setblocking(False)
         h = self.handler(s, self.context)
         h._network = self.network
         h._ssl_ctx = self.ssl_ctx
         h.id = self.network.next_id
+        h._open_key = self.port
+        self.network.open_connections[self.port] += 1
+        self.network._inbound.add(h)
+        self.network.stats.accepted += 1
         h.after_init()
         if h.on_accept():
             h._on_connect()
@@ -0,0 +1,170 @@
+'''
+Distributed tracing context.
+
+A SpanContext identifies one hop of a request as it moves between
+services, using the W3C traceparent header:
+
+    traceparent: 00-<trace id, 32 hex>-<span id, 16 hex>-<flags, 2 hex>
+
+RESTHandler continues the trace in an inbound request's traceparent header
+(or starts a new one) and makes it the current_span while the request's
+code is running; Task carries it to callbacks. async.Connection resources
+send a child span of the current_span in their traceparent header.
+
+If EXPORTER is set (see set_exporter), finished spans are written, one json
+line per span, in batches from a background thread (see rhc.batch): to a
+file, stdout, or as udp datagrams to a collector. A span has these fields:
+
+    trace    - trace id
+    span     - span id
+    parent   - parent span id (or null)
+    kind     - server or client
+    name     - http method and resource
+    start    - epoch seconds
+    duration - seconds
+    plus any other timings or attributes of the span
+'''
+import contextlib
+import random
+import socket
+
+import rhc.codec as codec
+from rhc.batch import BatchWriter, text
+
+import logging
+log = logging.getLogger(__name__)
+
+
+TRACEPARENT_HEADER = 'traceparent'
+
+EXPORTER = None  # SpanExporter for finished spans (see set_exporter)
+
+_spans = []  # stack of span contexts for the code that is currently running
+
+
+def _new_id(bits):
+    return '%0*x' % (bits / 4, random.getrandbits(bits))
+
+
+class SpanContext(object):
+
+    def __init__(self, trace_id=None, span_id=None, parent_id=None, is_sampled=True):
+        self.trace_id = trace_id or _new_id(128)
+        self.span_id = span_id or _new_id(64)
+        self.parent_id = parent_id
+        self.is_sampled = is_sampled
+
+    def __repr__(self):
+        return 'SpanContext[%s]' % self.header
+
+    @classmethod
+    def from_header(cls, value):
+        '''
+            SpanContext for a request with a traceparent header value (or
+            None): a child of the caller's span, or the root of a new trace
+        '''
+        if value:
+            try:
+                version, trace_id, span_id, flags = value.strip().split('-')[:4]
+                if len(trace_id) != 32 or len(span_id) != 16:
+                    raise ValueError('invalid id length')
+                int(trace_id, 16), int(span_id, 16)
+                is_sampled = bool(int(flags, 16) & 1)
+            except ValueError:
+                log.warning('invalid %s header: %s', TRACEPARENT_HEADER, value)
+            else:
+                return cls(trace_id.lower(), parent_id=span_id.lower(), is_sampled=is_sampled)
+        return cls()
+
+    def child(self):
+        ''' SpanContext for a call made as part of this span '''
+        return SpanContext(self.trace_id, parent_id=self.span_id, is_sampled=self.is_sampled)
+
+    @property
+    def header(self):
+        return '00-%s-%s-%s' % (self.trace_id, self.span_id, '01' if self.is_sampled else '00')
+
+    @property
+    def is_recording(self):
+        ''' True if the span will be exported when it finishes '''
+        return EXPORTER is not None and self.is_sampled
+
+    def export(self, kind, name, start, end, **attributes):
+        ''' write the finished span to the EXPORTER (if there is one) '''
+        if self.is_recording:
+            EXPORTER.queue((self.trace_id, self.span_id, self.parent_id, kind, name, start, end - start, attributes))
+
+
+def current_span():
+    ''' SpanContext of the running Task or RESTRequest (or None) '''
+    return _spans[-1] if _spans else None
+
+
+@contextlib.contextmanager
+def span_scope(span):
+    ''' make span the current_span for the duration of a with block '''
+    _spans.append(span)
+    try:
+        yield
+    finally:
+        _spans.pop()
+
+
+class SpanExporter(BatchWriter):
+
+    def __init__(self, path=None, address=None, batch_size=100, interval=1.0, max_pending=10000, max_datagram=8192):
+        '''
+            Parameters:
+                path         - file to append spans to (default: stdout)
+                address      - (host, port) of a udp collector, instead of path
+                batch_size   - wake the writer when this many spans are waiting
+                interval     - seconds between writes when traffic is light
+                max_pending  - limit on spans waiting to be written
+                max_datagram - largest udp payload; spans are packed into as
+                               few datagrams as fit
+        '''
+        super(SpanExporter, self).__init__(path, batch_size, interval, max_pending)
+        self.address = address
+        self.max_datagram = max_datagram
+        self._udp = None
+
+    def format(self, record):
+        trace_id, span_id, parent_id, kind, name, start, duration, attributes = record
+        span = dict(attributes, trace=trace_id, span=span_id, parent=parent_id, kind=kind, name=name, start=start, duration=duration)
+        return codec.dumps({n: text(v) for n, v in span.items()})  # name and attributes come from request data
+
+    def _write(self, lines):
+        if self.address is None:
+            return super(SpanExporter, self)._write(lines)
+        if self._udp is None:
+            self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        count = 0
+        datagram = []
+        size = 0
+        for line in lines + [None]:
+            if datagram and (line is None or size + len(line) + 1 > self.max_datagram):
+                data = '\n'.join(datagram) + '\n'
+                self._udp.sendto(data, self.address)
+                count += len(data)
+                datagram, size = [], 0
+            if line is not None:
+                datagram.append(line)
+                size += len(line) + 1
+        return count
+
+    def close(self):
+        super(SpanExporter, self).close()
+        if self._udp is not None:
+            self._udp.close()
+            self._udp = None
+
+
+def set_exporter(exporter):
+    '''
+        set the SpanExporter for finished spans (None to stop exporting);
+        the previous exporter, if any, is closed
+    '''
+    global EXPORTER
+    previous, EXPORTER = EXPORTER, exporter
+    if previous is not None and previous is not exporter:
+        previous.close()
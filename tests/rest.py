@@ -0,0 +1,23 @@
+from rhc.httphandler import HTTPHeaders
+from rhc.resthandler import RESTHandler
+
+
+class Handler(RESTHandler):
+    ''' RESTHandler without a connection: responses are recorded in sent '''
+
+    def __init__(self, mapper, resource='/test'):
+        super(Handler, self).__init__(0, context=mapper)
+        self.id = 1
+        self.http_method = 'GET'
+        self.http_resource = resource
+        self.http_query_string = ''
+        self.sent = []
+
+    def request(self, **headers):
+        ''' handle a request with headers; return the response, or None if there isn't one yet '''
+        self.http_headers = HTTPHeaders(headers)
+        self.on_http_data()
+        return self.sent[-1] if self.sent else None
+
+    def send_server(self, **kwargs):
+        self.sent.append(kwargs)
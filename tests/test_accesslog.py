@@ -0,0 +1,99 @@
+import json
+import time
+
+from rhc.accesslog import AccessLog
+from rhc.httphandler import HTTPHeaders
+from rhc.resthandler import LoggingRESTHandler, RESTMapper
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.id = 7
+        self.http_method = 'GET'
+        self.http_resource = '/test'
+        self.t_http_start = 100.0
+        self.t_http_data = 100.5
+
+
+def read(path):
+    return [json.loads(line) for line in path.read().splitlines()]
+
+
+def test_record(tmpdir):
+    path = tmpdir.join('access.log')
+    a = AccessLog(str(path))
+    a.add(Handler(), 200, 'hello')
+    a.close()
+    record, = read(path)
+    assert record['cid'] == 7
+    assert record['resource'] == '/test'
+    assert record['code'] == 200
+    assert record['bytes'] == 5
+    assert record['t_read'] == 0.5
+    assert a.stats.batches == 1
+
+
+def test_batch(tmpdir):
+    path = tmpdir.join('access.log')
+    a = AccessLog(str(path), batch_size=2, interval=60)
+    handler = Handler()
+    a.add(handler, 200, '')
+    a.add(handler, 404, '')
+    for _ in range(100):  # the writer wakes at batch_size, not interval
+        if path.check() and path.read().count('\n') == 2:
+            break
+        time.sleep(0.01)
+    assert [r['code'] for r in read(path)] == [200, 404]
+    a.close()
+
+
+def test_sample_and_drop(tmpdir):
+    a = AccessLog(str(tmpdir.join('access.log')), max_pending=1)
+    a._is_closed = True  # no writer thread
+    handler = Handler()
+    a.add(handler, 200, '', silent=True)
+    a.add(handler, 200, '')
+    a.add(handler, 200, '')
+    assert a.stats.as_dict() == dict(records=1, sampled_out=1, dropped=1, failed=0, batches=0, bytes=0)
+
+
+def test_handler(tmpdir):
+    path = tmpdir.join('access.log')
+    mapper = RESTMapper()
+    mapper.add('/test$', get=lambda request: 'ok')
+    h = LoggingRESTHandler(0, context=mapper)
+    h.access_log = AccessLog(str(path))
+    h.id = 1
+    h.http_method = 'GET'
+    h.http_resource = '/test'
+    h.http_headers = HTTPHeaders()
+    h.send_server = lambda **kwargs: None
+    h.on_http_data()
+    h.access_log.close()
+    record, = read(path)
+    assert record['code'] == 200
+    assert record['bytes'] == 2
+
+
+def test_bad_bytes(tmpdir):
+    path = tmpdir.join('access.log')
+    a = AccessLog(str(path))
+    handler = Handler()
+    handler.http_resource = '/bad\xff'
+    a.add(handler, 200, '')
+    a.close()
+    record, = read(path)
+    assert record['resource'] == u'/bad\ufffd'
+
+
+def test_format_failure(tmpdir):
+    path = tmpdir.join('access.log')
+    a = AccessLog(str(path))
+    a._is_closed = True  # no writer thread
+    a.queue(None)
+    a.add(Handler(), 200, '')
+    a.flush()
+    assert a.stats.failed == 1
+    assert len(read(path)) == 1
+    a.close()
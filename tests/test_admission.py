@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from rhc.admission import AdmissionController
+from rhc.resthandler import RESTMapper
+from rhc.timer import TIMERS
+
+from tests.rest import Handler
+
+
+class Log(object):
+
+    def __init__(self):
+        self.events = []
+
+    def start(self, name):
+        return lambda: self.events.append(('start', name))
+
+    def shed(self, name):
+        return lambda: self.events.append(('shed', name))
+
+
+def test_queue():
+    log = Log()
+    a = AdmissionController(1, max_queue=1)
+    assert a.admit(log.start(1), log.shed(1))
+    assert a.admit(log.start(2), log.shed(2))
+    assert a.queue_depth == 1
+    assert not a.admit(log.start(3), log.shed(3))
+    assert a.stats.shed == 1
+    a.release(0)
+    assert log.events == [('start', 1), ('start', 2)]
+    assert a.in_progress == 1
+    assert a.queue_depth == 0
+
+
+def test_queue_timeout():
+    log = Log()
+    a = AdmissionController(1, max_queue=1, queue_timeout=0.001)
+    a.admit(log.start(1), log.shed(1))
+    a.admit(log.start(2), log.shed(2))
+    a._queue[0] = (0,) + a._queue[0][1:]  # queued a long time ago
+    a.release(0)
+    assert log.events == [('start', 1), ('shed', 2)]
+    assert a.stats.expired == 1
+    assert a.in_progress == 0
+
+
+def test_queue_timeout_stalled():
+    log = Log()
+    a = AdmissionController(1, max_queue=2, queue_timeout=0.001)
+    a.admit(log.start(1), log.shed(1))
+    a.admit(log.start(2), log.shed(2))
+    a.admit(log.start(3), log.shed(3))
+    time.sleep(0.01)
+    TIMERS.service()  # nothing in progress has completed
+    assert log.events == [('start', 1), ('shed', 2), ('shed', 3)]
+    assert a.queue_depth == 0
+    assert a.stats.expired == 2
+
+
+def test_adaptive():
+    a = AdmissionController(10, adaptive=True, min_concurrent=2, target_latency=0.1)
+    a.in_progress = 5
+    a.release(1.0)
+    assert a.limit == 9
+    a.release(1.0)  # at most one decrease per target_latency
+    assert a.limit == 9
+    for _ in range(10):
+        a.in_progress += 1
+        a.release(0.01)
+    assert a.limit == 10
+
+
+class TestHandler(object):
+
+    @pytest.fixture
+    def handler(self):
+
+        requests = []
+
+        def delay(request):
+            request.delay()
+            requests.append(request)
+
+        mapper = RESTMapper()
+        mapper.add('/test$', get=delay)
+        handler = Handler(mapper)
+        handler.http_admission = AdmissionController(1)
+        handler.requests = requests
+        return handler
+
+    def test_shed(self, handler):
+        handler.on_http_data()
+        handler.on_http_data()
+        assert len(handler.requests) == 1
+        assert handler.sent[0]['code'] == 503
+        assert handler.sent[0]['headers'] == {'Retry-After': '1'}
+        handler.requests[0].respond(200)
+        assert handler.http_admission.in_progress == 0
+        handler.on_http_data()
+        assert len(handler.requests) == 2
+
+    def test_close(self, handler):
+        handler.on_http_data()
+        handler._on_close()
+        assert handler.http_admission.in_progress == 0
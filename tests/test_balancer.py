@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+import rhc.async as async
+from rhc.balancer import Balancer
+from rhc.timer import TIMERS
+
+
+URLS = ['http://127.0.0.1:12345', 'http://127.0.0.2:12345', 'https://127.0.0.3']
+
+
+def test_endpoints():
+    b = Balancer(URLS)
+    assert [(e.address, e.port, e.is_ssl) for e in b.endpoints] == [
+        ('127.0.0.1', 12345, False),
+        ('127.0.0.2', 12345, False),
+        ('127.0.0.3', 443, True),
+    ]
+
+
+def test_invalid_method():
+    with pytest.raises(ValueError):
+        Balancer(URLS, method='random')
+
+
+@pytest.mark.parametrize('method', ['p2c', 'least'])
+def test_outstanding(method):
+    b = Balancer(URLS[:2], method=method)
+    first = b.choose()
+    second = b.choose()
+    assert first is not second
+    b.complete(first, False)
+    assert b.choose() is first
+
+
+def test_eject():
+    b = Balancer(URLS[:2], eject_failures=2, eject_time=0.001)
+    bad, good = b.endpoints
+    for _ in range(2):
+        bad.outstanding += 1
+        b.complete(bad, True)
+    assert bad.is_ejected
+    assert all(b.choose() is good for _ in range(10))
+
+    good.outstanding += 1
+    good.failures = 1
+    b.complete(good, True)
+    assert not good.is_ejected  # max_ejected
+
+    time.sleep(0.002)
+    TIMERS.service()
+    assert not bad.is_ejected
+    assert bad.stats.as_dict() == dict(requests=0, failures=2, ejected=1)
+
+
+def test_call():
+
+    class Observer(object):
+        def on_response(self, status, headers):
+            self.status = status
+
+    def send(endpoint, callback, observer):
+        observer.on_response(503, {})
+        callback(1, 'unavailable')
+
+    b = Balancer(URLS[:1], eject_failures=1)
+    observer = Observer()
+    results = []
+    b.call(lambda rc, result: results.append((rc, result)), observer, send)
+    assert results == [(1, 'unavailable')]
+    assert observer.status == 503
+    assert b.endpoints[0].failures == 1
+    assert b.endpoints[0].outstanding == 0
+
+
+def test_cancel():
+
+    def send(endpoint, callback, observer):
+        return None
+
+    b = Balancer(URLS[:1])
+    endpoint = b.endpoints[0]
+    endpoint.failures = 2
+    b.call(None, None, send).cancel()
+    assert endpoint.outstanding == 0
+    assert endpoint.failures == 2
+
+
+def test_resolve(monkeypatch):
+    addresses = ['10.0.0.1', '10.0.0.2']
+    monkeypatch.setattr('socket.gethostbyname_ex', lambda host: (host, [], list(addresses)))
+    b = Balancer(['http://service:80'], resolve_all=True, resolve_interval=0.001)
+    kept = b.endpoints[1]
+    kept.failures = 3
+    b.choose()
+    addresses[:] = ['10.0.0.2', '10.0.0.3']
+    time.sleep(0.002)
+    TIMERS.service()
+    assert [e.address for e in b.endpoints] == addresses
+    assert b.endpoints[0] is kept
+
+
+def test_connection():
+    c = async.Connection(URLS[:2])
+    assert c.url == URLS[0]
+    assert len(c.balancer.endpoints) == 2
@@ -0,0 +1,180 @@
+import time
+
+import pytest
+
+from rhc.admission import AdmissionController
+from rhc.cache import ResponseCache
+from rhc.resthandler import RESTMapper, RESTResult
+from rhc.timer import TIMERS
+
+from tests.rest import Handler
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(10, stale=10)
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def handler(cache, calls):
+
+    def delay(request):
+        request.delay()
+        calls.append(request)
+
+    mapper = RESTMapper()
+    mapper.add('/test$', get=delay, cache=cache)
+    return Handler(mapper)
+
+
+def test_coalesce(handler, calls, cache):
+    other = Handler(handler.context)
+    handler.request()
+    other.request()
+    assert len(calls) == 1
+    assert cache.stats.coalesced == 1
+    calls[0].respond('hello')
+    assert handler.sent[0]['content'] == 'hello'
+    assert other.sent[0]['content'] == 'hello'
+    assert other.request()['content'] == 'hello'  # fresh hit
+    assert len(calls) == 1
+
+
+def test_etag(handler, calls):
+    handler.request()
+    calls[0].respond('hello')
+    etag = handler.sent[0]['headers']['ETag']
+    result = handler.request(**{'If-None-Match': etag})
+    assert result['code'] == 304
+    assert 'content' not in result
+
+
+def test_stale(handler, calls, cache):
+    handler.request()
+    calls[0].respond('hello')
+    for entry in cache._entries._data.values():
+        entry.expires = 0
+    assert handler.request()['content'] == 'hello'  # stale, refresh started
+    assert len(calls) == 2
+    assert handler.request()['content'] == 'hello'  # refresh in progress
+    assert len(calls) == 2
+    calls[1].respond('goodbye')
+    assert len(handler.sent) == 3  # refresh isn't sent
+    assert handler.request()['content'] == 'goodbye'
+
+
+def test_not_cached(handler, calls):
+    handler.request()
+    calls[0].respond(RESTResult(404))
+    handler.request()
+    assert len(calls) == 2
+    calls[1].respond(RESTResult(content='x', headers={'Cache-Control': 'no-store'}))
+    handler.request()
+    assert len(calls) == 3
+
+
+def test_max_bytes():
+    cache = ResponseCache(10, max_bytes=5)
+    for key in ('a', 'b'):
+        cache.start(key)
+        cache.complete(key, RESTResult(content='123'))
+    assert cache.lookup('a')[0] is None
+    assert cache.lookup('b')[0].content == '123'
+
+
+def test_close_leader(cache):
+    callbacks = []
+
+    def call(request):
+        def fn(callback):
+            callbacks.append(callback)
+            return Handle()
+        request.call(fn)
+
+    mapper = RESTMapper()
+    mapper.add('/test$', get=call, cache=cache)
+    leader, other = Handler(mapper), Handler(mapper)
+    leader.id = other.id = 1
+    leader.request()
+    other.request()
+    leader._on_close()
+    assert cache.is_pending(('/test', ''))
+    callbacks[0](0, 'hello')
+    assert other.sent[0]['content'] == 'hello'
+    assert not cache.is_pending(('/test', ''))
+
+
+class Handle(object):
+
+    is_done = False
+
+    def cancel(self):
+        raise AssertionError('cache fill cancelled')
+
+
+def test_wait_timeout(calls):
+
+    def delay(request):
+        request.delay()
+        calls.append(request)
+
+    cache = ResponseCache(10, wait_timeout=0.001)
+    mapper = RESTMapper()
+    mapper.add('/test$', get=delay, cache=cache)
+    leader, other = Handler(mapper), Handler(mapper)
+    leader.request()
+    other.request()
+    time.sleep(0.01)
+    TIMERS.service()  # the leader is stalled
+    assert other.sent[0]['code'] == 504
+    assert cache.stats.wait_timeout == 1
+    calls[0].respond('hello')
+    assert leader.sent[0]['content'] == 'hello'
+    assert len(other.sent) == 1
+
+
+def test_wait_takeover(calls):
+
+    def delay(request):
+        request.delay()
+        calls.append(request)
+
+    cache = ResponseCache(10, wait_timeout=0.001)
+    mapper = RESTMapper()
+    mapper.add('/test$', get=delay, cache=cache)
+    stalled, leader = Handler(mapper), Handler(mapper)
+    stalled.request()
+    time.sleep(0.01)
+    assert not cache.is_pending(('/test', ''))
+    leader.request()  # takes over from the stalled request
+    assert len(calls) == 2
+    assert cache.is_pending(('/test', ''))
+    calls[1].respond('hello')
+    assert leader.sent[0]['content'] == 'hello'
+    assert not cache.is_pending(('/test', ''))
+
+
+def test_revalidate_admission(calls, cache):
+
+    def delay(request):
+        request.delay()
+        calls.append(request)
+
+    admission = AdmissionController(1)
+    mapper = RESTMapper()
+    mapper.add('/test$', get=delay, cache=cache, admission=admission)
+    handler = Handler(mapper)
+    handler.request()
+    calls[0].respond('hello')
+    for entry in cache._entries._data.values():
+        entry.expires = 0
+    admission.in_progress = 1  # no room
+    assert handler.request()['content'] == 'hello'  # stale
+    assert len(calls) == 1  # refresh was shed
+    assert admission.stats.shed == 1
+    assert not cache.is_pending(('/test', ''))
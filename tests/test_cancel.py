@@ -0,0 +1,116 @@
+import pytest
+
+import rhc.async as async
+import rhc.httphandler as http
+from rhc.cache import ResourceCache
+from rhc.httphandler import HTTPHeaders
+from rhc.resthandler import RESTHandler, RESTMapper
+from rhc.task import Task, gather
+
+
+PORT = 12347
+URL = 'http://localhost:{}'.format(PORT)
+
+
+class _SlowServer(http.HTTPHandler):
+
+    def on_http_data(self):
+        pass  # never respond
+
+
+@pytest.fixture
+def server():
+    async.SERVER.add_server(PORT, _SlowServer)
+    yield None
+    async.SERVER.close()
+
+
+class Handle(object):
+
+    def __init__(self):
+        self.is_done = False
+        self.cancelled = 0
+
+    def cancel(self):
+        self.is_done = True
+        self.cancelled += 1
+
+
+def pending(handles, callbacks):
+    def _pending(callback):
+        callbacks.append(callback)
+        handles.append(Handle())
+        return handles[-1]
+    return _pending
+
+
+def test_connect_cancel(server):
+    results = []
+    c = async.Connection(URL)
+    c.add_resource('thing', '/thing')
+    handle = c.thing()(lambda rc, result: results.append(result))
+    async.SERVER.service(delay=.01)
+    handle.cancel()
+    assert handle.is_done
+    assert handle.closed
+    assert handle.close_reason == 'cancelled'
+    assert not handle.timer.is_running
+    assert results == []
+
+
+def test_waiter_cancel():
+    handles, callbacks = [], []
+
+    def send(callback, headers, flight):
+        return pending(handles, callbacks)(callback)
+
+    cache = ResourceCache(10)
+    one = cache.call(None, 'key', None, send)
+    two = cache.call(None, 'key', None, send)
+    one.cancel()
+    assert one.is_done and not two.is_done
+    assert handles[0].cancelled == 0
+    two.cancel()
+    assert handles[0].cancelled == 1
+    assert not cache._flights
+
+
+def test_task_cancel():
+    handles, callbacks = [], []
+    results = []
+    task = Task(lambda rc, result: results.append(result))
+    task.call(pending(handles, callbacks))
+    task.cancel()
+    assert task.is_done
+    assert handles[0].cancelled == 1
+    callbacks[0](0, 'late')
+    assert results == []
+
+
+def test_gather_cancels():
+    handles, callbacks = [], []
+    results = []
+    gather(lambda rc, result: results.append(rc), [pending(handles, callbacks)] * 3, quorum=1)
+    callbacks[1](0, 'first')
+    assert results == [0]
+    assert [h.cancelled for h in handles] == [1, 0, 1]
+
+
+def test_close_cancels():
+    handles, callbacks = [], []
+
+    def handle(request):
+        request.call(pending(handles, callbacks))
+
+    mapper = RESTMapper()
+    mapper.add('/test$', get=handle)
+    h = RESTHandler(0, context=mapper)
+    h.id = 1
+    h.http_method = 'GET'
+    h.http_resource = '/test'
+    h.http_headers = HTTPHeaders()
+    h.on_http_data()
+    assert len(h._calling) == 1
+    h._on_close()
+    assert handles[0].cancelled == 1
+    assert not h._calling
@@ -0,0 +1,24 @@
+from datetime import date, datetime
+
+import pytest
+
+from rhc import codec
+
+
+def test_round_trip():
+    data = dict(a=1, b=[1, 2, 3], c=u'\u00e9', d=None, e=True)
+    assert codec.loads(codec.dumps(data)) == data
+
+
+def test_dumps_str():
+    assert isinstance(codec.dumps(dict(a=u'\u00e9')), str)
+
+
+def test_dates():
+    result = codec.loads(codec.dumps(dict(a=date(2017, 1, 2), b=datetime(2017, 1, 2, 3, 4, 5))))
+    assert result == dict(a='2017-01-02', b='2017-01-02T03:04:05')
+
+
+def test_not_serializable():
+    with pytest.raises(TypeError):
+        codec.dumps(object())
@@ -63,5 +63,39 @@ class ConfigText(unittest.TestCase):
         self.assertEqual(cfg.server.comment2, 'ab')
         self.assertEqual(cfg.server.comment3, 'ab#c')
 
+    def test_snapshot(self):
+        cfg = Config()
+        cfg._define('server.port', 100, validate_int)
+        snapshot = cfg._snapshot()
+        self.assertEqual(snapshot.server.port, 100)
+        self.assertEqual(snapshot._get('server.port'), 100)
+        self.assertIs(cfg._snapshot(), snapshot)
+        self.assertRaises(AttributeError, setattr, snapshot.server, 'port', 200)
+        cfg._set('server.port', '200')
+        self.assertEqual(snapshot.server.port, 100)
+        self.assertEqual(cfg._snapshot().server.port, 200)
+        self.assertEqual(cfg._get('server.port'), 200)
+        self.assertRaises(AttributeError, cfg._get, 'server.host')
+
+    def test_env(self):
+        os.environ['RHC_TEST_CONFIG'] = '300'
+        try:
+            cfg = Config()
+            cfg._define('server.port', 100, validate_int, env='RHC_TEST_CONFIG')
+            cfg._load(['server.port=200'])
+            self.assertEqual(cfg.server.port, 300)
+        finally:
+            del os.environ['RHC_TEST_CONFIG']
+
+    def test_on_change(self):
+        changes = []
+        cfg = Config()
+        cfg._define('server.host', 'localhost')
+        cfg._define('server.port', 100, validate_int)
+        cfg._on_change(lambda config, names: changes.append(names))
+        cfg._load(['server.host=localhost', 'server.port=200'])
+        cfg._load(['server.port=200'])
+        self.assertEqual(changes, [['server.port']])
+
 if __name__ == '__main__':
     unittest.main()
@@ -208,7 +208,7 @@ def test_form(server):
 
     def on_complete(rc, result):
         assert rc == 0
-        assert result['headers']['content-type'] == \
+        assert http.HTTPHeaders(result['headers'])['content-type'] == \
             'application/x-www-form-urlencoded'
         assert result['body'] in (
                 'whatever=yeah&yeah=whatever',
@@ -0,0 +1,95 @@
+import pytest
+
+import rhc.async as async
+from rhc.resthandler import RESTMapper
+from rhc.task import Deadline, Task, current_deadline, deadline_scope
+
+from tests.rest import Handler
+
+
+@pytest.mark.parametrize('value, timeout, remaining', [
+    (None, None, None),
+    ('2.5', None, 2.5),
+    ('2.5', 1, 1),
+    ('0.5', 1, 0.5),
+    ('bad', 1, 1),
+    ('nan', 1, 1),
+    ('inf', 1, 1),
+    ('-inf', None, None),
+    ('-1', 1, 1),
+    ('0', None, None),
+])
+def test_from_header(value, timeout, remaining):
+    deadline = Deadline.from_header(value, timeout)
+    if remaining is None:
+        assert deadline is None
+    else:
+        assert remaining - 0.1 < deadline.remaining <= remaining
+
+
+def test_task_scope():
+    seen = []
+
+    def fn(callback):
+        seen.append(current_deadline())
+        callback(0, None)
+
+    def on_success(task, result):
+        seen.append(current_deadline())
+        seen.append(Task(None).deadline)
+
+    deadline = Deadline(10)
+    Task(lambda rc, result: None, deadline=deadline).call(fn, on_success=on_success)
+    assert seen == [deadline] * 3
+    assert current_deadline() is None
+
+
+def test_task_expired():
+    called = []
+    results = []
+
+    def on_timeout(task, result):
+        results.append(result)
+
+    Task(None, deadline=Deadline(0)).call(called.append, on_timeout=on_timeout)
+    assert called == []
+    assert results == ['timeout']
+
+
+def test_resource_expired():
+    results = []
+    c = async.Connection('http://127.0.0.1:12345')
+    c.add_resource('thing', '/thing')
+    with deadline_scope(Deadline(0)):
+        c.thing()(lambda rc, result: results.append(result))
+    assert results == ['timeout']
+
+
+def test_request_deadline():
+    seen = []
+
+    def handle(request):
+        seen.append((request.deadline, current_deadline()))
+        return 'ok'
+
+    mapper = RESTMapper()
+    mapper.add('/test$', get=handle, deadline=5)
+    handler = Handler(mapper)
+    assert handler.request()['code'] == 200
+    assert handler.request(**{'X-Request-Timeout': '0.5'})['code'] == 200
+    assert 4.5 < seen[0][0].remaining <= 5
+    assert seen[0][0] is seen[0][1]
+    assert seen[1][0].remaining <= 0.5
+    assert handler.request(**{'X-Request-Timeout': '0'})['code'] == 200  # invalid: the route's deadline applies
+    assert 4.5 < seen[2][0].remaining <= 5
+
+
+def test_request_call_expired():
+
+    def handle(request):
+        request.deadline = Deadline(0)
+        request.call(lambda callback: callback(0, 'never'))
+
+    mapper = RESTMapper()
+    mapper.add('/test$', get=handle)
+    assert Handler(mapper).request()['code'] == 504
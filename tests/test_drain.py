@@ -0,0 +1,94 @@
+import socket
+import subprocess
+import sys
+
+import rhc.httphandler as http
+import rhc.micro as micro
+import rhc.tcpsocket as network
+
+
+PORT = 12349
+REQUEST = b'GET / HTTP/1.1\r\nContent-Length: 0\r\n\r\n'
+
+
+class Server(http.HTTPHandler):
+
+    def on_http_data(self):
+        self.context.append(self)  # respond later
+
+
+class Client(network.BasicHandler):
+
+    def on_init(self):
+        self.received = ''
+
+    def on_data(self, data):
+        self.received += data
+
+
+def service(n, until):
+    for _ in range(100):
+        if until():
+            return
+        n.service(delay=.01)
+    assert until()
+
+
+def listen():
+    n = network.Server()
+    waiting = []
+    n.add_server(PORT, Server, waiting)
+    return n, waiting
+
+
+def test_idle():
+    n, waiting = listen()
+    c = n.add_connection(('localhost', PORT), Client)
+    service(n, lambda: n.inbound_count == 1)
+    n.drain()
+    service(n, lambda: c.closed)
+    assert n.is_drained
+    assert n.close_reasons['server draining'] == 1
+    n.close()
+
+
+def test_in_progress():
+    n, waiting = listen()
+    c = n.add_connection(('localhost', PORT), Client)
+    service(n, lambda: c.t_ready)
+    c.send(REQUEST)
+    service(n, lambda: waiting)
+    n.drain()
+    n.service(delay=.01)
+    assert not n.is_drained
+    assert not c.closed
+    waiting[0].send_server('done')
+    service(n, lambda: c.closed)
+    assert n.is_drained
+    assert 'Connection: close' in c.received
+    assert c.received.endswith('done')
+    n.close()
+
+
+def test_inherit():
+    old, waiting = listen()
+    new = network.Server()
+    new._inherited = network.inherited_fds({network.LISTEN_FDS: old.handoff_fds()})
+    new.add_server(PORT, Server, waiting)
+    old.drain()  # stops listening; the new server still accepts
+    c = new.add_connection(('localhost', PORT), Client)
+    service(new, lambda: new.inbound_count == 1)
+    old.close()
+    new.close()
+
+
+def test_keep_fds():
+    keep, other = socket.socket(), socket.socket()
+    check = 'import os, sys\nfor fd in sys.argv[1:]:\n    try:\n        os.fstat(int(fd))\n        print("open")\n    except OSError:\n        print("closed")\n'
+    output = subprocess.check_output(
+        [sys.executable, '-c', check, str(keep.fileno()), str(other.fileno())],
+        close_fds=False, preexec_fn=micro._keep_fds([keep.fileno()]),
+    )
+    assert output.split() == ['open', 'closed']
+    keep.close()
+    other.close()
@@ -28,3 +28,31 @@ def test_echo():
     while c.is_open:  # keep going until the client closes
         n.service()
     n.close()
+
+
+def test_stats():
+    n = network.Server()
+    n.add_server(PORT, EchoServer)
+    c = n.add_connection(('localhost', PORT), EchoClient)
+    while c.is_open:
+        n.service()
+    while n.open_connections[PORT]:  # wait for the server side to see the close
+        n.service()
+    stats = n.connection_stats()
+    n.close()
+    assert stats['accepted'] == 1
+    assert stats['connected'] == 1
+    assert stats['closed'] == 2
+    assert stats['bytes_in'] == stats['bytes_out'] == 18
+    assert stats['open'] == dict(inbound={PORT: 0}, outbound=0)
+    assert stats['close_reasons'] == {'remote close': 1, 'unspecified': 1}
+
+
+def test_stats_connect_failed():
+    n = network.Server()
+    c = n.add_connection(('localhost', PORT), network.BasicHandler)  # nobody listening
+    while c.is_open:
+        n.service()
+    n.close()
+    assert n.stats.connect_failed == 1
+    assert n.open_connections['outbound'] == 0
@@ -1,6 +1,6 @@
 import pytest
 
-from rhc.httphandler import HTTPHandler
+from rhc.httphandler import HTTPHandler, HeaderTemplate, format_date, http_date, status_line
 from rhc.resthandler import RESTRequest
 
 
@@ -191,5 +191,198 @@ for record in data['feedback']['record']:
     handler.on_data(data)
     assert handler.is_open
     assert handler.request.http_multipart[0].disposition['name'] == '"foo"'
-    assert handler.request.http_multipart[0].content == 'whatever\r\n'
+    assert handler.request.http_multipart[0].content == 'whatever'
     assert handler.request.http_multipart[1].disposition['filename'] == '"tmp.py"'
+
+
+class _PipelineNetwork(object):
+
+    def __init__(self):
+        self.deferred = []
+
+    def _set_deferred(self, callback):
+        self.deferred.append(callback)
+
+
+class _PipelineHandler(HTTPHandler):
+
+    def __init__(self, budget):
+        super(_PipelineHandler, self).__init__(0)
+        self._network = _PipelineNetwork()
+        self.http_max_messages_per_turn = budget
+        self.count = 0
+
+    def on_http_data(self):
+        self.count += 1
+
+
+def test_pipeline_budget():
+    handler = _PipelineHandler(2)
+    handler.on_data('GET / HTTP/1.1\r\nContent-Length:0\r\n\r\n' * 5)
+    assert handler.count == 2
+    assert len(handler._network.deferred) == 1
+    handler._network.deferred.pop()()
+    assert handler.count == 4
+    handler._network.deferred.pop()()
+    assert handler.count == 5
+    assert len(handler._network.deferred) == 0
+
+
+class _DrainHandler(_PipelineHandler):
+
+    def __init__(self):
+        super(_DrainHandler, self).__init__(1)
+        self.sent = []
+        self.closes = []
+
+    def on_http_data(self):
+        self.count += 1
+        self.send_server('ok')
+
+    def on_http_send(self, headers, content):
+        self.sent.append(headers)
+
+    def _do_write(self, data):
+        pass
+
+    def close(self, reason=None):
+        self.closes.append(reason)
+
+
+def test_drain_pipelined():
+    handler = _DrainHandler()
+    handler.on_data('GET / HTTP/1.1\r\nContent-Length:0\r\n\r\n' * 3)
+    assert handler.count == 1  # two requests are still buffered
+    handler.on_drain()
+    assert handler.closes == []
+    while handler._network.deferred:
+        handler._network.deferred.pop()()
+    assert handler.count == 3
+    assert ['Connection: close' in data for data in handler.sent] == [False, False, True]
+
+
+def test_pipeline_no_budget():
+    handler = _PipelineHandler(0)
+    handler.on_data('GET / HTTP/1.1\r\nContent-Length:0\r\n\r\n' * 5)
+    assert handler.count == 5
+    assert len(handler._network.deferred) == 0
+
+
+def test_gzip_content(handler):
+    from rhc.httphandler import compress
+    content = compress('abcde12345' * 100, 'gzip')
+    data = 'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s' % (len(content), content)
+    handler.on_data(data[:60])  # decoded as it arrives
+    handler.on_data(data[60:])
+    assert handler.is_open
+    assert handler.request.http_content == 'abcde12345' * 100
+
+
+def test_gzip_limit(handler):
+    from rhc.httphandler import compress
+    sent = []
+    handler.send_server = lambda **kwargs: sent.append(kwargs)
+    handler.http_max_content_length = 500
+    content = compress('a' * 100000, 'gzip')
+    handler.on_data('POST / HTTP/1.1\r\nContent-Encoding: gzip\r\nContent-Length: %d\r\n\r\n%s' % (len(content), content))
+    assert handler.closed
+    assert handler.error == 'Decoded content exceeds maximum length'
+    assert sent[0]['code'] == 413
+
+
+def test_deflate_chunked(handler):
+    from rhc.httphandler import compress
+    content = compress('abcde12345', 'deflate')
+    handler.on_data('HTTP/1.1 200 OK\r\nContent-Encoding: deflate\r\nTransfer-Encoding: chunked\r\n\r\n')
+    handler.on_data('%x\r\n%s\r\n0\r\n\r\n' % (len(content), content))
+    assert handler.request.http_content == 'abcde12345'
+
+
+def test_invalid_encoding(handler):
+    handler.on_data('HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nContent-Length: 5\r\n\r\nabcde')
+    assert handler.closed
+    assert handler.error == 'Invalid content encoding'
+
+
+def test_format_date():
+    assert format_date(784111777) == 'Sun, 06 Nov 1994 08:49:37 GMT'
+
+
+def test_http_date():
+    assert http_date() is http_date()
+
+
+def test_status_line():
+    assert status_line(200, 'OK') == 'HTTP/1.1 200 OK\r\n'
+    assert status_line(200, 'Fine') == 'HTTP/1.1 200 Fine\r\n'
+
+
+@pytest.fixture
+def server():
+
+    class _handler(HTTPHandler):
+
+        def __init__(self):
+            super(_handler, self).__init__(0)
+
+        def _do_write(self, data):
+            self.sent = data
+
+    return _handler()
+
+
+def test_send_template(server):
+    server.send_server('abc', template=HeaderTemplate({'X-Test': 'yes'}))
+    header, content = server.sent.split('\r\n\r\n')
+    lines = header.split('\r\n')
+    assert lines[0] == 'HTTP/1.1 200 OK'
+    assert 'X-Test: yes' in lines
+    assert 'Content-Length: 3' in lines
+    assert content == 'abc'
+
+
+def test_send_template_override(server):
+    server.send_server('abc', headers={'x-test': 'no'}, template=HeaderTemplate({'X-Test': 'yes', 'X-Other': 'a'}))
+    lines = server.sent.split('\r\n')
+    assert 'x-test: no' in lines
+    assert 'X-Other: a' in lines
+    assert 'X-Test: yes' not in lines
+
+
+def test_send_template_date(server):
+    server.send_server('abc', template=HeaderTemplate({'Date': 'Thu, 01 Jan 1970 00:00:00 GMT'}))
+    lines = server.sent.split('\r\n')
+    assert len([line for line in lines if line.startswith('Date:')]) == 1
+    assert 'Date: Thu, 01 Jan 1970 00:00:00 GMT' in lines
+
+
+def test_template_content_length():
+    with pytest.raises(ValueError):
+        HeaderTemplate({'content-length': '3'})
+
+
+def test_headers_case_insensitive(handler):
+    handler.on_data('GET / HTTP/1.1\r\nContent-Type: text/plain\r\nX-Test:a\r\nContent-Length:0\r\n\r\n')
+    headers = handler.request.http_headers
+    assert headers['content-type'] == 'text/plain'
+    assert 'x-TEST' in headers
+    assert sorted(headers.keys()) == ['Content-Length', 'Content-Type', 'X-Test']
+    headers['x-test'] = 'b'
+    assert headers == {'Content-Length': '0', 'Content-Type': 'text/plain', 'x-test': 'b'}
+
+
+def test_lazy_query(handler):
+    handler.on_data('GET /test?a=1 HTTP/1.1\r\nContent-Length:0\r\n\r\n')
+    assert handler.request._http_query is None
+    assert handler.request.http_query == {'a': '1'}
+
+
+def test_charset(handler):
+    handler.on_data('POST / HTTP/1.1\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length:2\r\n\r\n\xc3\xa9')
+    assert handler.request.http_content == u'\u00e9'
+
+
+def test_malformed_multipart(handler):
+    handler.on_data('POST / HTTP/1.1\r\nContent-Type: multipart/form-data; boundary=xx\r\nContent-Length:26\r\n\r\n--xx\r\nbad\r\n\r\nabc\r\n--xx--\r\n')
+    assert not handler.is_open
+    assert handler.error == 'Malformed multipart message: invalid header'
@@ -0,0 +1,49 @@
+import sys
+
+import pytest
+
+import rhc.micro as micro
+from rhc.resthandler import LazyHandler, RESTMapper
+from rhc.timer import TIMERS
+
+
+@pytest.fixture
+def module(tmpdir, monkeypatch):
+    tmpdir.join('lazy_target.py').write('def handler(request, *groups):\n    return request, groups\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield 'lazy_target'
+    sys.modules.pop('lazy_target', None)
+
+
+def test_lazy(module):
+    handler = LazyHandler(module + '.handler')
+    assert module not in sys.modules
+    assert not handler.is_loaded
+    assert handler('request', 'a') == ('request', ('a',))
+    assert handler.is_loaded
+    assert module in sys.modules
+
+
+def test_import_error():
+    handler = LazyHandler('rhc.no_such_module.handler')
+    result = handler(None)
+    assert result.code == 500
+    assert handler.is_loaded
+    assert not handler.load()
+
+
+class Conf(object):
+    http_warm_up = True
+    http_warm_up_interval = 0
+
+
+def test_warm_up(module):
+    mapper = RESTMapper()
+    mapping = mapper.add('/test$', get=LazyHandler(module + '.handler'), post=LazyHandler('rhc.no_such_module.handler'))
+    micro._warm_up('test', Conf(), {'test': mapping})
+    assert module not in sys.modules
+    for _ in range(3):
+        TIMERS.service()
+    assert mapping.method['get'].is_loaded
+    assert mapping.method['post'].is_loaded
+    assert module in sys.modules
@@ -0,0 +1,14 @@
+from rhc.lru import LRU
+
+
+def test_lru():
+    lru = LRU(2)
+    lru['a'] = 1
+    lru['b'] = 2
+    assert lru.get('a') == 1  # b is now least recently used
+    lru['c'] = 3
+    assert 'b' not in lru
+    assert len(lru) == 2
+    assert lru.get('a') == 1
+    assert lru.get('c') == 3
+    assert lru.get('b', 'x') == 'x'
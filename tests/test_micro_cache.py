@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+import rhc.micro_fsm.parser as parser
+from rhc.micro_fsm.parser import Parser
+
+
+@pytest.fixture
+def micro(tmpdir):
+    tmpdir.join('shared').write('CONNECTION foo http://foo.com:10101\nRESOURCE bar /bar\n')
+    path = tmpdir.join('micro')
+    path.write('CONFIG thing default=1 validate=int env=RHC_TEST_THING\nIMPORT shared\nSERVER test 12345\nROUTE /a$\nGET a.b\n')
+    return str(path), str(tmpdir.join('micro.cache'))
+
+
+def test_cache(micro, monkeypatch):
+    path, cache = micro
+    p = Parser.parse(path, cache)
+    assert os.path.exists(cache)
+
+    monkeypatch.setattr(parser, 'load', None)  # must not parse again
+    monkeypatch.setenv('RHC_TEST_THING', '2')
+    cached = Parser.parse(path, cache)
+    assert cached is not p
+    assert cached.servers['test'].routes[0].methods == {'get': 'a.b'}
+    assert cached.connections['foo'].resources['bar'].path == '/bar'
+    assert cached.config.server.test.port == 12345
+    assert cached.config.thing == 2  # env is read again
+
+
+def test_imported_change(micro):
+    path, cache = micro
+    Parser.parse(path, cache)
+    shared = os.path.join(os.path.dirname(path), 'shared')
+    with open(shared, 'a') as f:
+        f.write('RESOURCE baz /baz\n')
+    p = Parser.parse(path, cache)
+    assert 'baz' in p.connections['foo'].resources
@@ -223,3 +223,107 @@ def test_optional():
     config = p.config.connection.foo.resource.bar
     assert config.yeah is None
     assert config.bar == 'foo'
+
+
+def test_compress():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo/bar$',
+        'COMPRESS true level=9',
+        'ROUTE /foo/akk$',
+    ])
+    s = p.servers['test']
+    c = s.routes[0].compress
+    assert c.is_active is True
+    assert c.level == 9
+    assert c.threshold is None
+    assert s.routes[1].compress is None
+
+
+def test_admission():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo/bar$',
+        'ADMISSION 10 max_queue=5 adaptive=true',
+        'ROUTE /foo/akk$',
+    ])
+    s = p.servers['test']
+    a = s.routes[0].admission
+    assert a.max_concurrent == 10
+    assert a.max_queue == 5
+    assert a.adaptive is True
+    assert a.retry_after == 1
+    assert s.routes[1].admission is None
+
+
+def test_rate_limit():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo/(\d+)$',
+        'RATE_LIMIT 10 burst=20 key=group:0',
+    ])
+    r = p.servers['test'].routes[0].rate_limit
+    assert r.rate == 10.0
+    assert r.burst == 20.0
+    assert r.key == 'group:0'
+    assert r.max_keys == 10000
+
+
+def test_cache():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo$',
+        'CACHE 5 stale=10 vary=Accept,X-Tenant wait_timeout=2',
+    ])
+    c = p.servers['test'].routes[0].cache
+    assert c.ttl == 5.0
+    assert c.wait_timeout == 2.0
+    assert c.stale == 10.0
+    assert c.vary == ['Accept', 'X-Tenant']
+    assert c.max_entries == 10000
+
+
+def test_resource_cache():
+    p = Parser.parse([
+        'CONNECTION foo http://foo',
+        'RESOURCE bar /the/bar cache=30',
+        'RESOURCE akk /the/akk',
+    ])
+    c = p.connections['foo']
+    assert c.resources['bar'].cache == 30.0
+    assert c.resources['bar'].cache_entries == 1000
+    assert c.resources['akk'].cache is None
+
+
+def test_connection_policy():
+    p = Parser.parse([
+        'CONNECTION foo http://foo retries=2 breaker=5',
+        'RESOURCE bar /the/bar hedge=95',
+    ])
+    c = p.connections['foo']
+    assert c.retries == 2
+    assert c.backoff == 0.1
+    assert c.breaker == 5
+    assert c.hedge is None
+    assert c.resources['bar'].hedge == 95.0
+    assert c.resources['bar'].retries is None
+
+
+def test_connection_balance():
+    p = Parser.parse([
+        'CONNECTION foo http://foo,http://bar balance=least eject_time=10',
+    ])
+    c = p.connections['foo']
+    assert c.balance == 'least'
+    assert c.resolve_all is False
+    assert c.eject_failures == 5
+    assert c.eject_time == 10.0
+
+
+def test_deadline():
+    p = Parser.parse([
+        'SERVER test 12345',
+        'ROUTE /foo$',
+        'DEADLINE 2.5',
+    ])
+    assert p.servers['test'].routes[0].deadline == 2.5
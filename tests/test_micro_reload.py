@@ -0,0 +1,120 @@
+import pytest
+
+import rhc.micro as micro
+import rhc.tracing as tracing
+from rhc import CONNECTIONS
+from rhc.micro_fsm.parser import Parser
+from rhc.tcpsocket import SERVER
+
+
+PORT = 12350
+
+MICRO = [
+    'SERVER test %d' % PORT,
+    'ROUTE /a$',
+    'GET tests.test_micro_reload.handler',
+    'ROUTE /b$',
+    'GET tests.test_micro_reload.handler',
+    'CONNECTION reload_test http://localhost:12345',
+    'RESOURCE thing /thing',
+]
+
+
+def handler(request):
+    return 'ok'
+
+
+@pytest.fixture
+def running():
+    p = Parser.parse(MICRO)
+    micro.setup_servers(p.config, p.servers, p.is_new)
+    micro.setup_connections(p.config, p.connections)
+    yield micro._running['test']
+    SERVER.close()
+    micro._running.clear()
+    micro._connections.clear()
+
+
+def test_unchanged(running):
+    assert micro.reload(MICRO) == []
+
+
+def test_routes(running):
+    mapper = running.listener.context
+    a = mapper.mappings[0]
+    changes = micro.reload(MICRO[:3] + ['ROUTE /c$', 'GET tests.test_micro_reload.handler'] + MICRO[5:])
+    assert changes == ['server test: route /b$ removed', 'server test: route /c$ added']
+    assert mapper.mappings[0] is a  # unchanged route keeps its state
+    assert [m.pattern.pattern for m in mapper.mappings] == ['/a$', '/c$']
+    assert micro._running['test'].listener is running.listener
+
+
+def test_port(running, tmpdir):
+    config = tmpdir.join('config')
+    config.write('server.test.port=%d\n' % (PORT + 1))
+    assert micro.reload(MICRO, str(config)) == ['server test: listening on port %d' % (PORT + 1)]
+    assert micro._running['test'].listener.port == PORT + 1
+
+
+def test_connection(running, tmpdir):
+    before = CONNECTIONS.reload_test
+    config = tmpdir.join('config')
+    config.write('connection.reload_test.timeout=1\n')
+    assert micro.reload(MICRO, str(config)) == ['connection reload_test: changed']
+    assert CONNECTIONS.reload_test is not before
+    assert CONNECTIONS.reload_test.timeout == 1
+    assert micro.reload(MICRO[:5]) == ['connection reload_test: removed']
+    assert not hasattr(CONNECTIONS, 'reload_test')
+
+
+def test_config_change(running, tmpdir, monkeypatch):
+    changed = []
+    monkeypatch.setattr(micro, 'config', Parser.parse(MICRO).config, raising=False)
+    micro.config._on_change(lambda config, names: changed.append(names))
+    config = tmpdir.join('config')
+    config.write('connection.reload_test.timeout=1\n')
+    micro.reload(MICRO, str(config))
+    assert changed == [['connection.reload_test.timeout']]
+    assert micro.config.connection.reload_test.timeout == 1
+
+
+def test_access_log(tmpdir):
+    path = str(tmpdir.join('access'))
+    lines = MICRO[:1] + [
+        'CONFIG server.test.http_access_log default=%s' % path,
+        'CONFIG server.test.http_max_header_count default=100 validate=int',
+    ] + MICRO[1:5]
+    p = Parser.parse(lines)
+    micro.setup_servers(p.config, p.servers, p.is_new)
+    try:
+        access_log = micro._running['test'].context.http_access_log
+        config = tmpdir.join('config')
+        config.write('server.test.http_max_header_count=50\n')
+        assert micro.reload(lines, str(config)) == ['server test: settings changed']
+        assert micro._running['test'].context.http_access_log is access_log
+        config.write('server.test.http_access_log=%s.new\n' % path)
+        micro.reload(lines, str(config))
+        assert micro._running['test'].context.http_access_log is not access_log
+        assert access_log not in micro.ACCESS_LOGS
+        assert access_log._is_closed
+    finally:
+        SERVER.close()
+        micro._running.clear()
+        micro.stop(None)
+
+
+def test_trace_export(tmpdir):
+    lines = MICRO[:1] + ['CONFIG server.test.trace_export default=%s' % tmpdir.join('spans')] + MICRO[1:5]
+    p = Parser.parse(lines)
+    micro.setup_servers(p.config, p.servers, p.is_new)
+    try:
+        exporter = tracing.EXPORTER
+        assert exporter is not None
+        config = tmpdir.join('config')
+        config.write('server.test.http_max_header_count=50\n')
+        micro.reload(lines + ['CONFIG server.test.http_max_header_count default=100 validate=int'], str(config))
+        assert tracing.EXPORTER is exporter
+    finally:
+        SERVER.close()
+        micro._running.clear()
+        micro.stop(None)
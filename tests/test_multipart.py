@@ -0,0 +1,71 @@
+import pytest
+
+from rhc.multipart import HTTPPart, MultipartParser, multipart_boundary
+
+
+CONTENT = (
+    'preamble\r\n'
+    '--xyz\r\n'
+    'Content-Disposition: form-data; name="foo"\r\n'
+    '\r\n'
+    'whatever\r\n'
+    '--xyz\r\n'
+    'Content-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+    'Content-Type: text/plain\r\n'
+    '\r\n'
+    + 'a' * 100 + '\r\n--xy\r\n' +
+    '\r\n'
+    '--xyz--\r\n'
+    'epilogue'
+)
+
+
+@pytest.mark.parametrize('content_type, boundary', [
+    ('multipart/form-data; boundary=xyz', 'xyz'),
+    ('multipart/form-data; charset=utf-8; Boundary="xyz"', 'xyz'),
+    ('multipart/form-data', None),
+])
+def test_boundary(content_type, boundary):
+    assert multipart_boundary(content_type) == boundary
+
+
+@pytest.mark.parametrize('size', [1, 7, len(CONTENT)])
+def test_feed(size):
+    parts = []
+    parser = MultipartParser('xyz', threshold=50, on_part=parts.append)
+    for i in range(0, len(CONTENT), size):
+        parser.feed(CONTENT[i:i + size])
+    parser.close()
+    assert parts == parser.parts
+    assert len(parts) == 2
+    assert parts[0].disposition == {'name': '"foo"'}
+    assert parts[0].content == 'whatever'
+    assert not parts[0].is_file
+    assert parts[1].headers['Content-Disposition'] == 'form-data'
+    assert parts[1].disposition['filename'] == '"a.txt"'
+    assert parts[1].content == 'a' * 100 + '\r\n--xy\r\n'
+    assert parts[1].size == 108
+    assert parts[1].is_file
+    assert parts[1].file.read() == parts[1].content
+
+
+def test_header_case():
+    parser = MultipartParser('xyz')
+    parser.feed(CONTENT.replace('Content-Disposition', 'content-disposition'))
+    parser.close()
+    assert parser.parts[1].disposition['filename'] == '"a.txt"'
+    assert parser.parts[1].headers['Content-Disposition'] == 'form-data'
+    assert parser.parts[1].headers['content-type'] == 'text/plain'
+
+
+def test_incomplete():
+    parser = MultipartParser('xyz')
+    parser.feed(CONTENT[:60])
+    with pytest.raises(ValueError):
+        parser.close()
+
+
+def test_part_content():
+    part = HTTPPart({}, {}, 'abc')
+    assert part.content == 'abc'
+    assert part.file.read() == 'abc'
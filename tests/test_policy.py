@@ -0,0 +1,135 @@
+import time
+
+from rhc.policy import CircuitBreaker, CircuitBreakers, Policy
+from rhc.timer import TIMERS
+
+
+class Handler(object):
+
+    def __init__(self):
+        self.close_reason = None
+
+    def close(self, reason):
+        self.close_reason = reason
+
+
+class Upstream(object):
+    ''' fake send: responses are (status, rc, result), or None to leave an attempt running '''
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.attempts = []
+
+    def send(self, callback, observer):
+        handler = Handler()
+        self.attempts.append((callback, observer, handler))
+        response = self.responses.pop(0)
+        if response is not None:
+            status, rc, result = response
+            observer.on_response(status, {})
+            callback(rc, result)
+        return handler
+
+
+class Result(object):
+
+    def __init__(self):
+        self.results = []
+
+    def __call__(self, rc, result):
+        self.results.append((rc, result))
+
+
+def service(call):
+    while not call.is_done:
+        TIMERS.service()
+
+
+def test_retry():
+    upstream = Upstream((503, 1, 'busy'), (200, 0, 'ok'))
+    result = Result()
+    p = Policy(retries=2, backoff=0.001)
+    service(p.call(result, 'GET', 'host', upstream.send))
+    assert result.results == [(0, 'ok')]
+    assert len(upstream.attempts) == 2
+    assert p.stats.retries == 1
+
+
+def test_retry_exhausted():
+    upstream = Upstream((503, 1, 'busy'), (503, 1, 'busy'))
+    result = Result()
+    p = Policy(retries=1, backoff=0.001)
+    service(p.call(result, 'GET', 'host', upstream.send))
+    assert result.results == [(1, 'busy')]
+    assert p.stats.failures == 1
+
+
+def test_no_retry():
+    result = Result()
+    p = Policy(retries=2, backoff=0.001)
+    p.call(result, 'POST', 'host', Upstream((503, 1, 'busy')).send)
+    p.call(result, 'GET', 'host', Upstream((404, 1, 'not found')).send)
+    assert result.results == [(1, 'busy'), (1, 'not found')]
+    assert p.stats.retries == 0
+
+
+def test_breaker():
+    breakers = CircuitBreakers(threshold=2, reset_timeout=60)
+    p = Policy(breaker=breakers)
+    result = Result()
+    for _ in range(3):
+        p.call(result, 'GET', 'host', Upstream((None, 1, 'failed to connect')).send)
+    assert result.results[-1] == (1, 'circuit open')
+    assert breakers.states == {'host': 'open'}
+    assert p.stats.rejected == 1
+
+
+def test_breaker_reset():
+    b = CircuitBreaker(threshold=1, reset_timeout=0)
+    b.failure()
+    assert b.state == 'open'
+    assert b.allow()
+    assert b.state == 'half-open'
+    assert not b.allow()  # one trial request at a time
+    b.success()
+    assert b.state == 'closed'
+    assert b.stats.as_dict() == dict(opened=1, closed=1, rejected=1)
+
+
+def test_breaker_probe_cancelled():
+    breakers = CircuitBreakers(threshold=1, reset_timeout=0)
+    p = Policy(breaker=breakers)
+    result = Result()
+    p.call(result, 'GET', 'host', Upstream((None, 1, 'failed to connect')).send)
+    probe = p.call(result, 'GET', 'host', Upstream(None).send)
+    assert breakers.states == {'host': 'half-open'}
+    probe.cancel()
+    upstream = Upstream((200, 0, 'ok'))
+    p.call(result, 'GET', 'host', upstream.send)
+    assert result.results[-1] == (0, 'ok')
+    assert breakers.states == {'host': 'closed'}
+
+
+def test_hedge():
+    p = Policy(hedge=50, min_samples=2)
+    p._latency.extend([0.001, 0.001])
+    upstream = Upstream(None, (200, 0, 'hedged'))
+    result = Result()
+    call = p.call(result, 'GET', 'host', upstream.send)
+    time.sleep(0.002)
+    service(call)
+    assert result.results == [(0, 'hedged')]
+    assert upstream.attempts[0][2].close_reason == 'hedged request complete'
+    assert p.stats.hedges == 1
+    assert p.stats.hedge_wins == 1
+
+
+def test_observer():
+
+    class Observer(object):
+        def on_response(self, status, headers):
+            self.status = status
+
+    observer = Observer()
+    Policy().call(Result(), 'GET', 'host', Upstream((200, 0, 'ok')).send, observer)
+    assert observer.status == 200
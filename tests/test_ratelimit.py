@@ -0,0 +1,63 @@
+import pytest
+
+from rhc.ratelimit import RateLimiter
+from rhc.resthandler import RESTMapper
+
+from tests.rest import Handler
+
+
+def test_bucket():
+    limiter = RateLimiter(2, burst=2)
+    assert limiter.acquire('a', now=100) == 0
+    assert limiter.acquire('a', now=100) == 0
+    assert limiter.acquire('a', now=100) == 0.5
+    assert limiter.acquire('b', now=100) == 0
+    assert limiter.acquire('a', now=100.5) == 0
+    assert limiter.stats.as_dict() == {'allowed': 4, 'limited': 1}
+
+
+def test_max_keys():
+    limiter = RateLimiter(1, max_keys=1)
+    assert limiter.acquire('a', now=100) == 0
+    assert limiter.acquire('b', now=100) == 0
+    assert limiter.acquire('a', now=100) == 0  # a's bucket was discarded
+
+
+@pytest.mark.parametrize('key, key_type, key_name', [
+    ('peer', 'peer', None),
+    ('header:X-Api-Key', 'header', 'X-Api-Key'),
+    ('group:1', 'group', 1),
+])
+def test_key(key, key_type, key_name):
+    limiter = RateLimiter(1, key=key)
+    assert limiter.key_type == key_type
+    assert limiter.key_name == key_name
+
+
+def test_bad_key():
+    with pytest.raises(ValueError):
+        RateLimiter(1, key='cookie')
+
+
+@pytest.mark.parametrize('rate', [0, -1, 'nan'])
+def test_bad_rate(rate):
+    with pytest.raises(ValueError):
+        RateLimiter(rate)
+
+
+@pytest.mark.parametrize('burst', [0, 0.5, -1, 'nan'])
+def test_bad_burst(burst):
+    with pytest.raises(ValueError):
+        RateLimiter(5, burst)
+
+
+def test_handler():
+
+    mapper = RESTMapper()
+    mapper.add('/test/(\d+)$', get=lambda request, id: id, rate_limit=RateLimiter(1, key='group:0'))
+    handler = Handler(mapper)
+    for resource in ('/test/1', '/test/1', '/test/2'):
+        handler.http_resource = resource
+        handler.on_http_data()
+    assert [s['code'] for s in handler.sent] == [200, 429, 200]
+    assert handler.sent[1]['headers'] == {'Retry-After': '1'}
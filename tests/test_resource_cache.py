@@ -0,0 +1,135 @@
+import pytest
+
+import rhc.async as async
+import rhc.httphandler as http
+from rhc.cache import ResourceCache, _max_age
+
+
+PORT = 12346
+URL = 'http://localhost:{}'.format(PORT)
+
+
+class _TestServer(http.HTTPHandler):
+
+    count = 0
+    headers = {}
+
+    def on_http_data(self):
+        _TestServer.count += 1
+        if self.http_headers.get('If-None-Match') == '"abc"':
+            return self.send_server(code=304, message='Not Modified')
+        self.send_server('{"count": %d}' % _TestServer.count, headers=_TestServer.headers)
+
+
+@pytest.fixture
+def server():
+    _TestServer.count = 0
+    _TestServer.headers = {}
+    async.SERVER.add_server(PORT, _TestServer)
+    yield None
+    async.SERVER.close()
+
+
+@pytest.fixture
+def connection():
+    c = async.Connection(URL)
+    c.add_resource('thing', '/thing/{id}', cache=ResourceCache(60))
+    return c
+
+
+class _Results(object):
+
+    def __init__(self, count):
+        self.count = count
+        self.results = []
+
+    @property
+    def is_done(self):
+        return len(self.results) == self.count
+
+    def __call__(self, rc, result):
+        assert rc == 0
+        self.results.append(result)
+
+
+def test_hit(server, connection):
+    results = _Results(1)
+    async.run(connection.thing(1)(results))
+    results = _Results(1)
+    async.run(connection.thing(1)(results))
+    assert results.results == [dict(count=1)]
+    results = _Results(1)
+    async.run(connection.thing(2)(results))
+    assert results.results == [dict(count=2)]
+
+
+def test_headers(server):
+    tenant = ['a']
+    c = async.Connection(URL)
+    c.add_resource('thing', '/thing/{id}', headers={'X-Tenant': lambda: tenant[0]}, cache=ResourceCache(60))
+    for name, expect in (('a', 1), ('b', 2), ('a', 1)):
+        tenant[0] = name
+        results = _Results(1)
+        async.run(c.thing(1)(results))
+        assert results.results == [dict(count=expect)]
+
+
+def test_single_flight(server, connection):
+    results = _Results(3)
+    for _ in range(3):
+        connection.thing(1)(results)
+    async.run(results)
+    assert results.results == [dict(count=1)] * 3
+    assert _TestServer.count == 1
+
+
+def test_copy(server, connection):
+    results = _Results(2)
+    for _ in range(2):
+        connection.thing(1)(results)
+    async.run(results)
+    results.results[0]['count'] = 'changed'
+    assert results.results[1] == dict(count=1)
+    results = _Results(1)
+    async.run(connection.thing(1)(results))
+    assert results.results == [dict(count=1)]
+
+
+def test_callback_error():
+
+    def fail(rc, result):
+        raise Exception('callback failed')
+
+    flights = []
+    cache = ResourceCache(60)
+    key = cache.key('/thing/1', None)
+    send = lambda callback, headers, flight: flights.append(flight)
+    cache.call(fail, key, None, send)
+    results = _Results(1)
+    cache.call(results, key, None, send)
+    flights[0].done(0, dict(count=1))
+    assert results.results == [dict(count=1)]
+
+
+def test_no_store(server, connection):
+    _TestServer.headers = {'Cache-Control': 'no-store'}
+    for expect in (1, 2):
+        results = _Results(1)
+        async.run(connection.thing(1)(results))
+        assert results.results == [dict(count=expect)]
+
+
+def test_revalidate(server, connection):
+    _TestServer.headers = {'Cache-Control': 'no-cache', 'ETag': '"abc"'}
+    for _ in range(2):
+        results = _Results(1)
+        async.run(connection.thing(1)(results))
+        assert results.results == [dict(count=1)]
+    assert _TestServer.count == 2
+
+
+def test_max_age():
+    assert _max_age('') is None
+    assert _max_age('public, max-age=10') == 10
+    assert _max_age('no-cache, max-age=10') == 0
+    assert _max_age('max-age=10, no-store') == -1
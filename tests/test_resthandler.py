@@ -1,5 +1,10 @@
+import zlib
+
 import pytest
-from rhc.resthandler import RESTMapper
+from rhc.httphandler import accept_encoding
+from rhc.resthandler import RESTMapper, RESTMapping, RESTResult
+
+from tests.rest import Handler
 
 
 class TestRestHandler(object):
@@ -28,3 +33,55 @@ class TestRestHandler(object):
         assert handler == 2
         handler, group, _ = mapper._match('/foo', 'put')
         assert handler == 5
+
+
+@pytest.mark.parametrize('header, encoding', [
+    (None, None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip', 'gzip'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('identity', None),
+    ('*', 'gzip'),
+])
+def test_accept_encoding(header, encoding):
+    assert accept_encoding(header) == encoding
+
+
+class TestCompress(object):
+
+    @pytest.fixture
+    def handler(self):
+
+        handler = Handler(RESTMapper())
+        handler.http_headers = {'accept-encoding': 'gzip'}
+        return handler
+
+    def test_threshold(self, handler):
+        mapping = RESTMapping('/', None, None, None, None, False, True, 6, 10)
+        result = RESTResult(content='a' * 9)
+        result.compress = handler._compression(mapping)
+        handler.rest_response(result)
+        assert handler.sent[-1]['content'] == 'a' * 9
+        assert handler.sent[-1]['headers']['Vary'] == 'Accept-Encoding'
+
+    def test_not_accepted(self, handler):
+        handler.http_headers = {}
+        mapping = RESTMapping('/', None, None, None, None, False, True, 6, 10)
+        result = RESTResult(content='a' * 100, headers={'Vary': 'Origin'})
+        result.compress = handler._compression(mapping)
+        handler.rest_response(result)
+        assert handler.sent[-1]['content'] == 'a' * 100
+        assert handler.sent[-1]['headers']['Vary'] == 'Origin, Accept-Encoding'
+
+    def test_compress(self, handler):
+        mapping = RESTMapping('/', None, None, None, None, False, True, 6, 10)
+        result = RESTResult(content='a' * 100)
+        result.compress = handler._compression(mapping)
+        handler.rest_response(result)
+        assert handler.sent[-1]['headers']['Content-Encoding'] == 'gzip'
+        assert zlib.decompress(handler.sent[-1]['content'], zlib.MAX_WBITS + 16) == 'a' * 100
+
+    def test_route_off(self, handler):
+        handler.http_compress = True
+        mapping = RESTMapping('/', None, None, None, None, False, False)
+        assert handler._compression(mapping) is None
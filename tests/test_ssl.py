@@ -56,3 +56,87 @@ def test_success():
         n.service()
     n.close()
     assert c.is_failed_handshake is False  # ssl handshake worked
+
+
+def test_shared_context():
+    n = network.Server()
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    n.add_server(PORT, network.BasicHandler, ssl=True,
+                 ssl_certfile=cert_dir + 'cert.pem', ssl_keyfile=cert_dir + 'key.pem')
+    for _ in range(2):
+        c = n.add_connection(('localhost', PORT), SuccessClient, ssl=True)
+        while c.is_open:
+            n.service()
+    n.close()
+    assert n.ssl_stats.context_created == 2  # one server, one client
+    assert n.ssl_stats.context_reused == 1   # second client
+    assert n.ssl_stats.handshake >= 2        # client side, plus any completed server side
+    assert n.ssl_stats.handshake_failed == 0
+
+
+def test_handshake_queue():
+    n = network.Server()
+    n.max_handshakes = 1
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    n.add_server(PORT, network.BasicHandler, ssl=True,
+                 ssl_certfile=cert_dir + 'cert.pem', ssl_keyfile=cert_dir + 'key.pem')
+    clients = [n.add_connection(('localhost', PORT), SuccessClient, ssl=True) for _ in range(3)]
+    while any(c.is_open for c in clients):
+        n.service()
+    n.close()
+    assert n.ssl_stats.handshake_queued > 0       # inbound handshakes waited their turn
+    assert n.handshake_queue_depth == 0
+    assert all(c.is_failed_handshake is False for c in clients)
+
+
+class SilentClient(network.BasicHandler):
+
+    def on_ready(self):
+        pass  # never start an ssl handshake
+
+
+def test_handshake_timeout():
+    n = network.Server()
+    n.handshake_timeout = .01
+    cert_dir = os.path.dirname(__file__) + '/cert/'
+    n.add_server(PORT, network.BasicHandler, ssl=True,
+                 ssl_certfile=cert_dir + 'cert.pem', ssl_keyfile=cert_dir + 'key.pem')
+    c = n.add_connection(('localhost', PORT), SilentClient)
+    while c.is_open:
+        n.service(.01)
+        network.TIMERS.service()
+    n.close()
+    assert n.ssl_stats.handshake_timeout == 1
+    assert n.handshakes_in_progress == 0
+
+
+class _Socket(object):
+
+    def __init__(self, fileno):
+        self._fileno = fileno
+
+    def fileno(self):
+        return self._fileno
+
+
+class FailingHandshake(object):
+    ''' queued inbound handshake whose peer has already gone away '''
+
+    def __init__(self, n, fileno):
+        self._network = n
+        self._sock = _Socket(fileno)
+        self._incoming = True
+        self._is_handshaking = True
+        self._handshake_timer = None
+
+    def _do_handshake(self):
+        self._network._end_handshake(self)  # as close does
+
+
+def test_handshake_queue_failures():
+    n = network.Server()
+    n.max_handshakes = 1
+    n._handshake_queue.extend(FailingHandshake(n, fileno) for fileno in range(5000))
+    n._end_handshake(FailingHandshake(n, -1))  # no recursion
+    assert n.handshake_queue_depth == 0
+    assert n.handshakes_in_progress == 0
@@ -0,0 +1,98 @@
+import functools
+import time
+
+import rhc.task as rhc_task
+from rhc.timer import TIMERS
+
+
+class Pending(object):
+    ''' async functions which complete when told to '''
+
+    def __init__(self):
+        self.callbacks = []
+
+    def __call__(self, callback):
+        self.callbacks.append(callback)
+
+
+def immediate(rc, result, callback):
+    callback(rc, result)
+
+
+def done(results):
+    def _done(rc, result):
+        results.append((rc, result))
+    return _done
+
+
+def test_all():
+    results = []
+    rhc_task.gather(done(results), [
+        functools.partial(immediate, 0, 'a'),
+        functools.partial(immediate, 1, 'b'),
+        functools.partial(immediate, 0, 'c'),
+    ], quorum=2)
+    assert results == [(0, [(0, 'a'), (1, 'b'), (0, 'c')])]
+
+
+def test_failed():
+    results = []
+    rhc_task.gather(done(results), [
+        functools.partial(immediate, 0, 'a'),
+        functools.partial(immediate, 1, 'b'),
+        functools.partial(immediate, 0, 'c'),
+    ])
+    assert results == [(1, [(0, 'a'), (1, 'b'), None])]
+
+
+def test_limit():
+    pending = Pending()
+    results = []
+    g = rhc_task.gather(done(results), [pending] * 5, limit=2)
+    assert len(pending.callbacks) == 2
+    pending.callbacks[1](0, 1)
+    assert len(pending.callbacks) == 3
+    assert g.in_progress == 2
+    for n in (0, 2, 3, 4):
+        pending.callbacks[n](0, n)
+    assert results == [(0, [(0, 0), (0, 1), (0, 2), (0, 3), (0, 4)])]
+
+
+def test_limit_immediate():
+    results = []
+    calls = [functools.partial(immediate, 0, n) for n in range(2000)]
+    rhc_task.gather(done(results), calls, limit=1)
+    assert results[0][1][-1] == (0, 1999)
+
+
+def test_first_success():
+    pending = Pending()
+    results = []
+    g = rhc_task.first_success(done(results), [pending] * 3)
+    pending.callbacks[2](1, 'no')
+    pending.callbacks[1](0, 'yes')
+    assert g.is_done
+    pending.callbacks[0](0, 'late')
+    assert results == [(0, 'yes')]
+
+
+def test_timeout():
+    pending = Pending()
+    results = []
+    g = rhc_task.gather(done(results), [pending], timeout=0.001)
+    time.sleep(0.002)
+    TIMERS.service()
+    assert g.is_done
+    pending.callbacks[0](0, 'late')
+    assert results == [(1, 'timeout')]
+
+
+def test_task_gather():
+    results = []
+
+    def on_success(task, result):
+        task.callback(0, [r for _, r in result])
+
+    task = rhc_task.Task(done(results))
+    task.gather([functools.partial(immediate, 0, n) for n in range(3)], on_success=on_success)
+    assert results == [(0, [0, 1, 2])]
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+import rhc.async as async
+import rhc.httphandler as http
+import rhc.tracing as tracing
+from rhc.httphandler import HTTPHeaders
+from rhc.resthandler import RESTHandler, RESTMapper
+from rhc.task import Task
+from rhc.tracing import SpanContext, SpanExporter, current_span, span_scope
+
+
+PORT = 12348
+URL = 'http://localhost:{}'.format(PORT)
+TRACE = '0af7651916cd43dd8448eb211c80319c'
+PARENT = 'b7ad6b7169203331'
+
+
+@pytest.fixture
+def exporter(tmpdir):
+    path = tmpdir.join('spans.log')
+    tracing.set_exporter(SpanExporter(str(path)))
+
+    def spans():
+        tracing.EXPORTER.flush()
+        return [json.loads(line) for line in path.read().splitlines()]
+    yield spans
+    tracing.set_exporter(None)
+
+
+@pytest.mark.parametrize('value, trace_id, parent_id, is_sampled', [
+    ('00-%s-%s-01' % (TRACE, PARENT), TRACE, PARENT, True),
+    ('00-%s-%s-00' % (TRACE.upper(), PARENT), TRACE, PARENT, False),
+    ('00-%s-%s' % (TRACE, PARENT), None, None, True),
+    ('00-abc-%s-01' % PARENT, None, None, True),
+    (None, None, None, True),
+])
+def test_from_header(value, trace_id, parent_id, is_sampled):
+    span = SpanContext.from_header(value)
+    assert len(span.trace_id) == 32 and len(span.span_id) == 16
+    if trace_id:
+        assert span.trace_id == trace_id
+    assert span.parent_id == parent_id
+    assert span.is_sampled == is_sampled
+
+
+def test_child():
+    span = SpanContext.from_header('00-%s-%s-01' % (TRACE, PARENT))
+    child = span.child()
+    assert child.header == '00-%s-%s-01' % (TRACE, child.span_id)
+    assert child.parent_id == span.span_id
+
+
+def test_task_scope():
+    seen = []
+
+    def fn(callback):
+        seen.append(current_span())
+        callback(0, None)
+
+    span = SpanContext()
+    with span_scope(span):
+        task = Task(lambda rc, result: None)
+    task.call(fn, on_success=lambda task, result: seen.append(current_span()))
+    assert seen == [span] * 2
+    assert current_span() is None
+
+
+def test_server_span(exporter):
+    mapper = RESTMapper()
+    mapper.add('/test$', get=lambda request: 'ok')
+    h = RESTHandler(0, context=mapper)
+    h.id = 1
+    h.http_method = 'GET'
+    h.http_resource = '/test'
+    h.http_headers = HTTPHeaders({'traceparent': '00-%s-%s-01' % (TRACE, PARENT)})
+    h.send_server = lambda **kwargs: None
+    h.on_http_data()
+    span, = exporter()
+    assert span['trace'] == TRACE
+    assert span['parent'] == PARENT
+    assert span['kind'] == 'server'
+    assert span['name'] == 'GET /test'
+    assert span['code'] == 200
+
+
+class _Server(http.HTTPHandler):
+
+    def on_http_data(self):
+        self.send_server(json.dumps(self.http_headers.get('traceparent')))
+
+
+@pytest.fixture
+def server():
+    async.SERVER.add_server(PORT, _Server)
+    yield None
+    async.SERVER.close()
+
+
+def test_client_span(server, exporter):
+    results = []
+    c = async.Connection(URL)
+    c.add_resource('thing', '/thing')
+    span = SpanContext()
+    with span_scope(span):
+        handle = c.thing()(lambda rc, result: results.append(result))
+    while not handle.closed:
+        async.SERVER.service(delay=.01)
+    header, = results
+    exported, = exporter()
+    assert header == '00-%s-%s-01' % (span.trace_id, exported['span'])
+    assert exported['parent'] == span.span_id
+    assert exported['kind'] == 'client'
+    assert exported['code'] == 200
+    assert exported['t_response'] > 0
+
+
+def test_export_bad_bytes(exporter):
+    span = SpanContext()
+    span.export('server', 'GET /bad\xff', 1.0, 2.0, resource='/bad\xff')
+    record, = exporter()
+    assert record['name'] == u'GET /bad\ufffd'
+    assert record['resource'] == u'/bad\ufffd'